@@ -1,10 +1,63 @@
 import chromadb
 import json
 import os
+import threading
 from typing import List, Dict, Any, Optional, Union
 
 from django.conf import settings
 
+
+# 进程内共享的 chroma 客户端和集合
+# PersistentClient 的创建、集合和 embedding function 的加载都比较慢，同一个路径、集合只创建一次
+_clients = {}  # db_path -> PersistentClient
+_collections = {}  # (db_path, collection_name) -> Collection
+_registry_lock = threading.RLock()
+
+
+def get_client(db_path: str = './chroma_db'):
+    """
+    获取 db_path 对应的 PersistentClient，第一次使用时创建
+    """
+    db_path = os.path.abspath(db_path)
+    client = _clients.get(db_path)
+    if client is not None:
+        return client
+
+    with _registry_lock:
+        if db_path not in _clients:
+            # 确保目录存在
+            os.makedirs(db_path, exist_ok=True)
+            _clients[db_path] = chromadb.PersistentClient(path=db_path)
+        return _clients[db_path]
+
+
+def get_collection(db_path: str = './chroma_db', collection_name: str = "default_collection"):
+    """
+    获取或创建集合，第一次使用时创建
+    """
+    key = (os.path.abspath(db_path), collection_name)
+    collection = _collections.get(key)
+    if collection is not None:
+        return collection
+
+    with _registry_lock:
+        if key not in _collections:
+            _collections[key] = get_client(db_path).get_or_create_collection(
+                name=collection_name,
+                embedding_function=settings.CHROMA_EMBEDDING_FUNCTION,
+                metadata={"hnsw:space": "cosine"}
+            )
+        return _collections[key]
+
+
+def forget_collection(db_path: str, collection_name: str) -> None:
+    """
+    集合被删除后，移除共享的集合对象，下次使用时重新创建
+    """
+    with _registry_lock:
+        _collections.pop((os.path.abspath(db_path), collection_name), None)
+
+
 class Chroma_Driver:
     def __init__(self, db_path: str = './chroma_db', collection_name: str = "default_collection"):
         """
@@ -17,25 +70,17 @@ class Chroma_Driver:
         self.db_path = db_path
         self.collection_name = collection_name
         self.client = None
-        self.collection = None
         self._initialize_db()
 
     def _initialize_db(self) -> None:
-        """初始化数据库连接和集合"""
-        # 确保目录存在
-        os.makedirs(self.db_path, exist_ok=True)
-
-        # 创建客户端
-        self.client = chromadb.PersistentClient(
-            path=self.db_path,
-        )
+        """初始化数据库连接和集合，客户端和集合在进程内共享"""
+        self.client = get_client(self.db_path)
+        get_collection(self.db_path, self.collection_name)
 
-        # 获取或创建集合
-        self.collection = self.client.get_or_create_collection(
-            name=self.collection_name,
-            embedding_function=settings.CHROMA_EMBEDDING_FUNCTION,
-            metadata={"hnsw:space": "cosine"}
-        )
+    @property
+    def collection(self):
+        # 每次从共享的集合中获取，其他 driver reset 之后也能拿到新的集合
+        return get_collection(self.db_path, self.collection_name)
 
     def insert(self, documents: List[str], metadatas: Optional[List[Dict[str, Any]]] = None,
                ids: Optional[List[str]] = None) -> List[str]:
@@ -92,6 +137,22 @@ class Chroma_Driver:
                 metadatas=metadatas if metadatas else None
             )
 
+    def upsert(self, ids: List[str], documents: List[str],
+               metadatas: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        按 id 添加或更新文档，已存在的 id 会重新向量化
+
+        Args:
+            ids: 文档 ID 列表
+            documents: 文档内容列表
+            metadatas: 元数据列表，可选
+        """
+        self.collection.upsert(
+            ids=[str(id) for id in ids],
+            documents=documents,
+            metadatas=metadatas if metadatas else None
+        )
+
     def delete(self, ids: Optional[List[str]] = None,
                where: Optional[Dict[str, Any]] = None) -> None:
         """
@@ -102,7 +163,8 @@ class Chroma_Driver:
             where: 条件筛选，可选
         """
         # ids 转成 str list
-        ids = [str(id) for id in ids]
+        if ids is not None:
+            ids = [str(id) for id in ids]
         
         self.collection.delete(
             ids=ids,
@@ -116,7 +178,7 @@ class Chroma_Driver:
         查询相似文档
 
         Args:
-            query_texts: 查询文本列表
+            query_text: 查询文本
             n_results: 返回结果数量，默认为 5
             where: 条件筛选，可选
             include: 包含的字段，默认为 ["documents", "metadatas", "distances"]
@@ -131,24 +193,47 @@ class Chroma_Driver:
             )
             
         """
+        return self.query_many([query_text], n_results, where, include)[0]
+
+    def query_many(self, query_texts: List[str], n_results: int = 5,
+                   where: Optional[Dict[str, Any]] = None,
+                   include: List[str] = ["documents", "metadatas", "distances"]) -> List[Dict[str, Any]]:
+        """
+        一次查询多个文本，所有文本的向量化在一次调用中完成
+
+        Args:
+            query_texts: 查询文本列表
+            n_results: 每个文本返回结果数量，默认为 5
+            where: 条件筛选，可选
+            include: 包含的字段，默认为 ["documents", "metadatas", "distances"]
+
+        Returns:
+            与 query_texts 顺序一致的查询结果列表，每个结果的格式与 query 相同
+        """
+        if not query_texts:
+            return []
+
         result = self.collection.query(
-            query_texts=[query_text],
+            query_texts=query_texts,
             n_results=n_results,
             where=where,
             include=include
         )
-        # 转换 id 为 int
-        try:
-            ids = [int(id) for id in result['ids'][0]]
-        except:
-            ids = result['ids'][0]
-        result_one = {
-            'ids': ids,
-            'metadatas': result['metadatas'][0],
-            'documents': result['documents'][0],
-            'distances': result['distances'][0], # 数值越大，相似度越低
-        }
-        return result_one
+
+        results = []
+        for i in range(len(query_texts)):
+            # 转换 id 为 int
+            try:
+                ids = [int(id) for id in result['ids'][i]]
+            except:
+                ids = result['ids'][i]
+            results.append({
+                'ids': ids,
+                'metadatas': result['metadatas'][i] if result.get('metadatas') else None,
+                'documents': result['documents'][i] if result.get('documents') else None,
+                'distances': result['distances'][i] if result.get('distances') else None, # 数值越大，相似度越低
+            })
+        return results
 
     def get(self, ids: Optional[List[str]] = None,
             where: Optional[Dict[str, Any]] = None,
@@ -222,8 +307,10 @@ class Chroma_Driver:
     def reset(self) -> None:
         """
         重置集合（删除所有文档）"""
-        self.client.delete_collection(self.collection_name)
-        self._initialize_db()
+        with _registry_lock:
+            self.client.delete_collection(self.collection_name)
+            forget_collection(self.db_path, self.collection_name)
+            self._initialize_db()
 
 
 if __name__ == "__main__":
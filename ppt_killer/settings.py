@@ -173,6 +173,43 @@ LLM_MODEL = PROJECT_CONFIG.get('LLM', 'LLM_MODEL')
 LLM_IMG_GEN_BASE_URL = PROJECT_CONFIG.get('LLM', 'LLM_IMG_GEN_BASE_URL')
 LLM_IMG_GEN_API_KEY = PROJECT_CONFIG.get('LLM', 'LLM_IMG_GEN_API_KEY')
 LLM_IMG_GEN_MODEL = PROJECT_CONFIG.get('LLM', 'LLM_IMG_GEN_MODEL')
+# 同时请求图片生成接口的最大数量
+LLM_IMG_GEN_CONCURRENCY = PROJECT_CONFIG.getint('LLM', 'LLM_IMG_GEN_CONCURRENCY', fallback=4)
+# 同时请求大模型的最大数量（按页面并发生成全文等）
+LLM_CONCURRENCY = PROJECT_CONFIG.getint('LLM', 'LLM_CONCURRENCY', fallback=8)
+# 大模型返回限流（429）、服务端错误（5xx）或者连接失败、超时时的最大重试次数，重试间隔按指数增加
+LLM_MAX_RETRIES = PROJECT_CONFIG.getint('LLM', 'LLM_MAX_RETRIES', fallback=4)
+# 每分钟最多的大模型请求数和 token 数，0 表示不限制
+LLM_REQUESTS_PER_MINUTE = PROJECT_CONFIG.getint('LLM', 'LLM_REQUESTS_PER_MINUTE', fallback=0)
+LLM_TOKENS_PER_MINUTE = PROJECT_CONFIG.getint('LLM', 'LLM_TOKENS_PER_MINUTE', fallback=0)
+
+# PPt 生成：执行 python-pptx 操作的线程数
+GENERATION_WORKERS = PROJECT_CONFIG.getint('GENERATION', 'WORKERS', fallback=4)
+# PPt 生成：解析后模板的缓存数量和内存上限（MB）
+TEMPLATE_CACHE_ENTRIES = PROJECT_CONFIG.getint('GENERATION', 'TEMPLATE_CACHE_ENTRIES', fallback=8)
+TEMPLATE_CACHE_MAX_MB = PROJECT_CONFIG.getint('GENERATION', 'TEMPLATE_CACHE_MAX_MB', fallback=256)
+# PPt 生成：大于这个大小（MB）的模板上传后在后台解析，0 表示总是在后台解析
+TEMPLATE_BACKGROUND_PARSE_MB = PROJECT_CONFIG.getint('GENERATION', 'TEMPLATE_BACKGROUND_PARSE_MB', fallback=20)
+# PPt 生成：图标渲染结果的缓存，ICON_CACHE_DIR 为空时只缓存在内存中
+ICON_CACHE_DIR = PROJECT_CONFIG.get('GENERATION', 'ICON_CACHE_DIR', fallback='cache/icons')
+if ICON_CACHE_DIR:
+    ICON_CACHE_DIR = os.path.join(BASE_DIR, ICON_CACHE_DIR)
+ICON_CACHE_ENTRIES = PROJECT_CONFIG.getint('GENERATION', 'ICON_CACHE_ENTRIES', fallback=512)
+# PPt 生成：图标磁盘缓存的大小上限（MB）和最长保留天数（按最近使用时间），超出时在后台清理最久没有使用的，0 表示不限制
+ICON_CACHE_MAX_MB = PROJECT_CONFIG.getint('GENERATION', 'ICON_CACHE_MAX_MB', fallback=512)
+ICON_CACHE_MAX_AGE_DAYS = PROJECT_CONFIG.getint('GENERATION', 'ICON_CACHE_MAX_AGE_DAYS', fallback=30)
+# PPt 生成：渲染图标（svg 转 png）的进程数，0 表示在生成线程中渲染
+ICON_RENDER_WORKERS = PROJECT_CONFIG.getint('GENERATION', 'ICON_RENDER_WORKERS', fallback=2)
+# PPt 生成：从相似的图标中随机选择时使用的随机数种子，为空时每次生成结果不同
+ICON_RANDOM_SEED = PROJECT_CONFIG.get('GENERATION', 'ICON_RANDOM_SEED', fallback='') or None
+# PPt 生成：上传模板后在后台按模板的图标颜色和尺寸预热最常用的 ICON_WARMUP_ICONS 个图标
+ICON_WARMUP = PROJECT_CONFIG.getboolean('GENERATION', 'ICON_WARMUP', fallback=True)
+ICON_WARMUP_ICONS = PROJECT_CONFIG.getint('GENERATION', 'ICON_WARMUP_ICONS', fallback=50)
+# PPt 生成：统计各阶段耗时，并在进度消息中返回；PROFILE_DIR 不为空时把 trace 保存为 json
+GENERATION_PROFILE = PROJECT_CONFIG.getboolean('GENERATION', 'PROFILE', fallback=False)
+GENERATION_PROFILE_DIR = PROJECT_CONFIG.get('GENERATION', 'PROFILE_DIR', fallback='')
+if GENERATION_PROFILE_DIR:
+    GENERATION_PROFILE_DIR = os.path.join(BASE_DIR, GENERATION_PROFILE_DIR)
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
 
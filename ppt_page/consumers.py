@@ -3,7 +3,6 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
 from asgiref.sync import sync_to_async
 
-from openai import AsyncOpenAI
 import os
 
 # 导入 settings
@@ -14,6 +13,7 @@ from materials.models import Document
 from project_manage.models import Project
 from knowledge_base.tools.chroma_driver import Chroma_Driver
 from materials.tools.web_browser import Web_Browser
+from project_manage.tools.llm_gateway import llm_gateway
 
 import asyncio
 
@@ -210,27 +210,8 @@ class AutoDocRelations(AsyncWebsocketConsumer):
         ppt_page.prompt = prompt
         await ppt_page.asave()
 
-        # 配置OpenAI客户端
-        try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '未配置OpenAI API密钥'
-            }))
-            return
-
         # 调用OpenAI API生成任务
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[{'role': 'user', 'content': prompt}]
-        )
-
-        # 解析LLM响应
-        response = response.choices[0].message.content.strip()
+        response = await llm_gateway.chat([{'role': 'user', 'content': prompt}])
         doc_list = self.llm_response_to_dict(response)
 
         await self.send(json.dumps({
@@ -350,26 +331,7 @@ class GenerateFullText(AsyncWebsocketConsumer):
         
 
         # 调用 OpenAI API 生成文档
-        try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '无法完成请求'
-            }), close=True)
-            return
-        
-        # 调用 OpenAI API 生成文档
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[{'role': 'user', 'content': prompt}]
-        )
-
-        # 解析LLM响应
-        response = response.choices[0].message.content.strip()
+        response = await llm_gateway.chat([{'role': 'user', 'content': prompt}])
 
         ppt_page.full_text = response
         await ppt_page.asave()
@@ -535,6 +497,14 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
         }))
 
         template = ppt_page.project.ppt_template
+        # 模板在后台解析完成前没有页面样式，不能用于生成
+        if template is not None and template.get_parse_error():
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': template.get_parse_error()
+            }), close=True)
+            return
+
         full_text = ppt_page.full_text
 
         # 根据page_and_template 中 template_id 是否为空，选择 slide_templates
@@ -578,36 +548,11 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
 
         # 调用 OpenAI API 生成文档
         try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '无法完成请求'
-            }), close=True)
-            return
-        
-        # 调用 OpenAI API 生成文档
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[
+            response_dict = await llm_gateway.chat_json([
                 {'role': 'system', 'content': prompt_system}, 
                 {'role': 'user', 'content': prompt}
-            ]
-        )
-
-        # 解析LLM响应
-        response = response.choices[0].message.content.strip()
-
-
-        if response.startswith('```json'):
-            response = response[7:-3]
-
-        try:
-            response_dict = json.loads(response)
-        except:
+            ])
+        except ValueError:
             await self.send(json.dumps({
                 'status': 'error',
                 'message': '生成的数据有误'
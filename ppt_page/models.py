@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from materials.models import Document
 from project_manage.models import Project
 from ppt_template.models import PPt_Template
@@ -47,4 +47,26 @@ class Page_and_Template(models.Model):
         unique_together = ('ppt_page', 'ppt_template')
         
     def __str__(self):
-        return f"{self.ppt_page.name} - {self.ppt_template.name}"
\ No newline at end of file
+        return f"{self.ppt_page.name} - {self.ppt_template.name}"
+
+    @classmethod
+    def bulk_save_data(cls, ppt_template, page_data):
+        '''
+        批量保存多个页面在同一个模板下的 slide_data，已有的记录批量更新，没有的批量创建
+        args:
+            page_data: {ppt_page_id: data}
+        '''
+        if not page_data:
+            return
+        with transaction.atomic():
+            existing = list(cls.objects.filter(ppt_template=ppt_template, ppt_page_id__in=page_data.keys()))
+            for page_and_template in existing:
+                page_and_template.data = page_data[page_and_template.ppt_page_id]
+            cls.objects.bulk_update(existing, ['data'])
+
+            existing_ids = {page_and_template.ppt_page_id for page_and_template in existing}
+            cls.objects.bulk_create([
+                cls(ppt_page_id=ppt_page_id, ppt_template=ppt_template, data=data)
+                for ppt_page_id, data in page_data.items()
+                if ppt_page_id not in existing_ids
+            ])
\ No newline at end of file
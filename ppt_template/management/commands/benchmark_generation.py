@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ppt_template.tools.generate_benchmark import BENCHMARK_TEMPLATES, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = '用内置模板和合成的 slide_data 离线测试 PPt 生成的性能，不请求大模型和图片接口'
+    # 只用到模板和生成相关的代码，不需要检查 url 等配置
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--templates', nargs='+', default=BENCHMARK_TEMPLATES, help='模板名称，对应 ppt_templates_files 中的文件')
+        parser.add_argument('--slides', nargs='+', type=int, default=[10, 50, 200], help='生成的页数')
+        parser.add_argument('--img-latency', type=float, default=0, help='模拟的图片接口延迟（秒）')
+        parser.add_argument('--no-memory', action='store_true', help='不统计内存峰值，tracemalloc 会让耗时变长')
+        parser.add_argument('--output-dir', default=None, help='保存生成的 ppt')
+        parser.add_argument('--icon-cache-dir', default=None, help='图标渲染结果的磁盘缓存，默认每次都重新渲染图标')
+        parser.add_argument('--json', default=None, help='把结果保存为 json 文件')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            options['templates'],
+            options['slides'],
+            trace_memory=not options['no_memory'],
+            img_latency=options['img_latency'],
+            output_dir=options['output_dir'],
+            icon_cache_dir=options['icon_cache_dir'],
+        )
+
+        for result in results:
+            phases = ' | '.join(
+                f'{name} {phase["time"]:.3f}s' + (f' {phase["peak_mb"]:.1f}MB' if 'peak_mb' in phase else '')
+                for name, phase in result['phases'].items()
+            )
+            self.stdout.write(
+                f'{result["template"]} {result["slides"]} 页：{phases} | '
+                f'图片请求 {result["img_calls"]} 次，文件 {result["size"] / 1024:.0f}KB'
+            )
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
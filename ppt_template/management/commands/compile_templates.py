@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ppt_template.models import PPt_Template
+from ppt_template.tools.template_compile import compile_template
+
+
+class Command(BaseCommand):
+    help = '预编译模板，生成时直接加载编译结果，不再重新解析模板'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', type=int, nargs='*', help='模板 id，默认编译所有模板')
+
+    def handle(self, *args, **options):
+        templates = PPt_Template.objects.all()
+        if options['template']:
+            templates = templates.filter(id__in=options['template'])
+
+        for template in templates:
+            compiled_path = compile_template(template.file.path)
+            self.stdout.write(f'{template.name}：{compiled_path}')
@@ -0,0 +1,30 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from knowledge_base.tools.chroma_driver import Chroma_Driver
+from ppt_template.tools.icon_catalog import Icon_Catalog
+
+
+class Command(BaseCommand):
+    help = '同步 icons 文件夹和图标的向量索引，只处理新增、修改和删除的图标'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--icon-folder', default='icons', help='图标文件夹')
+        parser.add_argument('--rebuild', action='store_true', help='清空索引后重新建立')
+
+    def handle(self, *args, **options):
+        icon_folder = options['icon_folder']
+        driver = Chroma_Driver(collection_name='system_icons')
+        catalog = Icon_Catalog(icon_folder, driver)
+
+        if options['rebuild']:
+            driver.reset()
+            if os.path.exists(catalog.catalog_path):
+                os.remove(catalog.catalog_path)
+
+        summary = catalog.sync()
+        self.stdout.write(
+            f'新增 {summary["added"]}，修改 {summary["changed"]}，'
+            f'删除 {summary["removed"]}，未变化 {summary["unchanged"]}'
+        )
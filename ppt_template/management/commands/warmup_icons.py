@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ppt_template.models import PPt_Template
+from ppt_template.tools.icon_render_cache import icon_render_cache
+from ppt_template.tools.icon_warmup import warmup_template_icons
+
+
+class Command(BaseCommand):
+    help = '按模板中图标的颜色和尺寸，把最常用的图标预先渲染到缓存中，并按大小和保留天数清理图标的磁盘缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', type=int, nargs='*', help='模板 id，默认预热所有模板')
+        parser.add_argument('--icons', type=int, default=None, help='预热的图标数量，默认为 ICON_WARMUP_ICONS')
+        parser.add_argument('--prune-only', action='store_true', help='只清理磁盘缓存，不预热')
+
+    def handle(self, *args, **options):
+        # 先清理，预热的结果是最近使用的，不会被清理掉
+        summary = icon_render_cache.prune()
+        self.stdout.write(f'清理图标缓存：删除 {summary["removed"]} 个，剩余 {summary["bytes"] / 1024 / 1024:.1f} MB')
+        if options['prune_only']:
+            return
+
+        templates = PPt_Template.objects.all()
+        if options['template']:
+            templates = templates.filter(id__in=options['template'])
+
+        for template in templates:
+            count = warmup_template_icons(template.file.path, max_icons=options['icons'])
+            self.stdout.write(f'{template.name}：预热 {count} 个图标')
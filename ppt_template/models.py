@@ -1,7 +1,9 @@
 from django.db import models
 from .tools.template_parse import  Template_Parser
+from .tools import background_tasks, template_compile
 from django.core.files.storage import FileSystemStorage
 import os
+import hashlib
 from django.conf import settings
 
 import logging
@@ -44,6 +46,20 @@ class PPt_Template(models.Model):
     sections = models.JSONField(null=True, blank=True, default=dict)
     # 默认应该有的 components 应该包括 text
 
+    # 已解析的模板文件的 sha1，文件内容不变时不重新解析
+    file_hash = models.CharField(max_length=40, blank=True, default='')
+    # 解析状态：较大的模板在后台解析，解析完成前为 pending
+    PARSE_PENDING = 'pending'
+    PARSE_READY = 'ready'
+    PARSE_FAILED = 'failed'
+    parse_status = models.CharField(max_length=16, default=PARSE_READY)
+
+    # 解析后保存的字段
+    PARSED_FIELDS = [
+        'cover_template', 'toc_template', 'chapter_L1_template', 'chapter_L2_template', 'blank_template',
+        'slide_templates', 'components', 'sections', 'file_hash', 'parse_status',
+    ]
+
     class Meta:
         # name 和 user 是唯一的
         unique_together = ('name', 'user')
@@ -84,14 +100,81 @@ class PPt_Template(models.Model):
 
         
         self.components = parser.components
-        self.sections = parser.extract_sections()
-
+        # Template_Parser 初始化时已经提取过 section
+        self.sections = parser.sections
+
+    def get_parse_error(self):
+        '''
+        模板还不能用于生成（后台解析中或者解析失败）时返回提示信息，可以使用时返回 None
+        '''
+        if self.parse_status == self.PARSE_PENDING:
+            return '模板解析中，请稍后再试'
+        if self.parse_status == self.PARSE_FAILED:
+            return '模板解析失败，请重新上传模板'
+        return None
+
+    def get_file_hash(self):
+        sha1 = hashlib.sha1()
+        with open(self.file.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
 
     def save(self, *args, **kwargs):
+        # 新上传的文件在 super().save() 中才写入磁盘
+        file_changed = not self.file._committed or not self.file_hash
         super().save(*args, **kwargs)
-        self.parse_file()
-        if 'force_insert' in kwargs:
-            del kwargs['force_insert']
-        super().save(*args, **kwargs)
+        if not file_changed:
+            return
+
+        # 只修改了名称等字段，或者上传了内容相同的文件时，不重新解析
+        file_hash = self.get_file_hash()
+        if file_hash == self.file_hash:
+            return
+        self.file_hash = file_hash
+
+        # 较大的模板在后台解析，上传请求直接返回
+        if os.path.getsize(self.file.path) > settings.TEMPLATE_BACKGROUND_PARSE_MB * 1024 * 1024:
+            self.parse_status = self.PARSE_PENDING
+            super().save(update_fields=['file_hash', 'parse_status'])
+            background_tasks.submit(process_template_file, self.id, file_hash)
+            return
+
+        self.process_file()
+
+    def process_file(self):
+        '''
+        解析模板文件并保存解析结果，然后预编译模板、预热图标
+        '''
+        try:
+            self.parse_file()
+        except Exception:
+            self.parse_status = self.PARSE_FAILED
+            super().save(update_fields=['parse_status'])
+            raise
+        self.parse_status = self.PARSE_READY
+        super().save(update_fields=self.PARSED_FIELDS)
+
+        # icon_warmup 依赖 cairosvg，使用时再导入
+        from .tools.icon_warmup import schedule_warmup
+
+        # 预编译模板，生成时不再重新提取组件、生成空白 ppt；失败时生成时解析模板
+        try:
+            template_compile.compile_template(self.file.path)
+        except Exception:
+            logger.exception(f'预编译模板失败：{self.file.path}')
+
+        # 在后台预热模板中图标的渲染结果
+        schedule_warmup(self.file.path)
+
+        
+
 
-        
\ No newline at end of file
+def process_template_file(template_id, file_hash):
+    '''
+    后台解析模板，模板已经删除或者又上传了新的文件时跳过
+    '''
+    template = PPt_Template.objects.filter(id=template_id, file_hash=file_hash).first()
+    if template is None:
+        return
+    template.process_file()
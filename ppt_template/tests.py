@@ -1,3 +1,623 @@
-from django.test import TestCase
+import os
+import json
+import time
 
-# Create your tests here.
+import pytest
+from django.conf import settings
+from pptx import Presentation
+from pptx.enum.dml import MSO_FILL
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+from .tools.template_cache import Template_Cache, Parsed_Template
+from .tools.slide_index import Slide_Index
+from .tools.template_parse import Template_Parser
+from .tools.placeholder_grammar import parse_placeholder, parse_style
+from .tools.container_layout import calculate_positions, calculate_grid_positions
+from .tools.icon_render_cache import Icon_Render_Cache
+from .tools.icon_catalog import Icon_Catalog, build_icon_document
+
+
+class _File:
+    def __init__(self, path):
+        self.path = path
+
+
+class _Template:
+    def __init__(self, id, path):
+        self.id = id
+        self.file = _File(path)
+
+
+def _loader(calls):
+    def load(path):
+        calls.append(path)
+        return Parsed_Template(None, None, [], {}, b'', 10)
+    return load
+
+
+def test_template_cache_reuses_until_file_changes(tmp_path):
+    path = tmp_path / 'a.pptx'
+    path.write_bytes(b'v1')
+    template = _Template(1, str(path))
+    cache = Template_Cache(max_entries=4, max_bytes=1024)
+    calls = []
+
+    first = cache.get(template, _loader(calls))
+    assert cache.get(template, _loader(calls)) is first
+    assert len(calls) == 1
+
+    # 模板文件更新后重新解析，并替换旧版本
+    path.write_bytes(b'version 2')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert cache.get(template, _loader(calls)) is not first
+    assert len(calls) == 2
+    assert len(cache) == 1
+
+
+def test_template_cache_evicts_least_recently_used(tmp_path):
+    cache = Template_Cache(max_entries=2, max_bytes=1024)
+    calls = []
+    templates = []
+    for i in range(3):
+        path = tmp_path / f'{i}.pptx'
+        path.write_bytes(b'x')
+        templates.append(_Template(i, str(path)))
+
+    cache.get(templates[0], _loader(calls))
+    cache.get(templates[1], _loader(calls))
+    cache.get(templates[0], _loader(calls))
+    cache.get(templates[2], _loader(calls))
+    assert len(cache) == 2
+
+    # templates[1] 最久没有使用，被淘汰
+    cache.get(templates[0], _loader(calls))
+    assert len(calls) == 3
+    cache.get(templates[1], _loader(calls))
+    assert len(calls) == 4
+
+
+def test_template_cache_memory_cap(tmp_path):
+    cache = Template_Cache(max_entries=10, max_bytes=15)
+    calls = []
+    for i in range(3):
+        path = tmp_path / f'{i}.pptx'
+        path.write_bytes(b'x')
+        cache.get(_Template(i, str(path)), _loader(calls))
+    assert len(cache) == 1
+
+
+def test_slide_index_matches_linear_lookup():
+    ppt = Presentation(os.path.join(settings.BASE_DIR, 'ppt_templates_files', '橙色.pptx'))
+    index = Slide_Index(ppt)
+    slides = list(ppt.slides)
+
+    assert index.get(0) is slides[0]
+    assert index.get(str(slides[3].slide_id)) is slides[3]
+    name = Slide_Index.get_slide_names(slides[2])[0]
+    assert index.get(name) is next(s for s in slides if name in Slide_Index.get_slide_names(s))
+    assert index.get('不存在的页面') is None
+
+    index.remove(slides[3].slide_id)
+    assert index.get_by_id(slides[3].slide_id) is None
+
+
+def test_parse_placeholder():
+    assert parse_placeholder('正文') is None
+    assert parse_placeholder('@标题') == {'type': 'text', 'name': '标题', 'style': None, 'notes': None}
+    assert parse_placeholder('@img-配图（max_n-3）：插图') == {
+        'type': 'img', 'name': '配图', 'style': 'max_n-3', 'notes': '插图'
+    }
+    # 其他前缀保留在 name 中
+    assert parse_placeholder('@diy-模块1内容：说明')['name'] == 'diy-模块1内容'
+
+    # 缓存不能被调用方修改
+    parse_placeholder('@标题')['name'] = '修改'
+    assert parse_placeholder('@标题')['name'] == '标题'
+
+
+def test_parse_style():
+    assert parse_style('direction-l-r gap-160000 wrap') == {'direction': 'l-r', 'gap': '160000', 'wrap': ''}
+
+
+def test_container_layout_single_line():
+    positions = calculate_positions(1000, 100, 0, 0, 200, 100, 3, 'l-r', 'c', 't', 100)
+    assert positions == [(100, 0), (400, 0), (700, 0)]
+    positions = calculate_positions(1000, 100, 0, 0, 200, 100, 3, 'l-r', 'j', 't', 100)
+    assert positions == [(0, 0), (400, 0), (800, 0)]
+
+
+def test_container_layout_wrap():
+    # 没有超出一行时与不换行一致
+    assert calculate_grid_positions(1000, 500, 0, 0, 200, 100, 3, 'l-r', 'l', 't', 100, wrap='') == \
+        calculate_positions(1000, 500, 0, 0, 200, 100, 3, 'l-r', 'l', 't', 100)
+
+    # 每行最多放 3 个，5 个组件分两行
+    positions = calculate_grid_positions(1000, 500, 0, 0, 200, 100, 5, 'l-r', 'l', 't', 100, wrap='')
+    assert positions == [(0, 0), (300, 0), (600, 0), (0, 200), (300, 200)]
+
+    positions = calculate_grid_positions(1000, 500, 0, 0, 200, 100, 4, 'l-r', 'l', 't', 100, wrap='2')
+    assert positions == [(0, 0), (300, 0), (0, 200), (300, 200)]
+
+
+def test_icon_render_cache(tmp_path):
+    icon = tmp_path / 'a.svg'
+    icon.write_text('<svg/>')
+    key = Icon_Render_Cache.make_key(str(icon), 'FF0000', 20, 20, 96)
+    assert Icon_Render_Cache.make_key(str(icon), '00FF00', 20, 20, 96) != key
+
+    cache = Icon_Render_Cache(str(tmp_path / 'cache'), max_entries=1)
+    assert cache.get(key) is None
+    cache.put(key, b'svg', b'png')
+    assert cache.get(key) == (b'svg', b'png')
+
+    # 内存中被淘汰后从磁盘读取，新的实例（其他进程）也可以读取
+    cache.put('0' * 40, b'svg2', b'png2')
+    assert len(cache) == 1
+    assert cache.get(key) == (b'svg', b'png')
+    assert Icon_Render_Cache(str(tmp_path / 'cache')).get(key) == (b'svg', b'png')
+
+    # 图标文件更新后 key 变化
+    os.utime(icon, ns=(0, os.stat(icon).st_mtime_ns + 1))
+    assert Icon_Render_Cache.make_key(str(icon), 'FF0000', 20, 20, 96) != key
+
+
+def test_icon_render_cache_prune(tmp_path):
+    folder = tmp_path / 'cache'
+    cache = Icon_Render_Cache(str(folder), max_entries=0, max_bytes=15, max_age=3600)
+    keys = [f'{i:02d}' + '0' * 38 for i in range(4)]
+    for key in keys:
+        os.makedirs(folder / key[:2], exist_ok=True)
+        cache._write_file(os.path.join(folder, key[:2], f'{key}.svg'), b'svg')
+        cache._write_file(os.path.join(folder, key[:2], f'{key}.png'), b'png')
+    (folder / 'usage.json').write_text('{}')
+
+    # keys[0] 超过保留天数，其余按最近使用时间从旧到新
+    now = time.time()
+    for key, age in zip(keys, [7200, 30, 20, 10]):
+        for ext in ('svg', 'png'):
+            os.utime(folder / key[:2] / f'{key}.{ext}', (now - age, now - age))
+    # 磁盘命中后成为最近使用的
+    assert cache.get(keys[1]) == (b'svg', b'png')
+
+    # 每个渲染结果 6 字节，删除过期的 keys[0] 后还超过 15 字节，再删除最久没有使用的 keys[2]
+    assert cache.prune() == {'removed': 2, 'bytes': 12}
+    assert [cache.get(key) is not None for key in keys] == [False, True, False, True]
+    assert (folder / 'usage.json').exists()
+    assert Icon_Render_Cache(str(folder)).prune() == {'removed': 0, 'bytes': 12}
+
+
+def test_build_icon_document():
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg"><title> 火箭 </title>'
+        '<g><desc>发射</desc><title>发射</title></g><desc/></svg>'
+    )
+    # 文件名、文件夹、title、desc 依次排列，重复的词只保留第一个，空的 title、desc 跳过
+    assert build_icon_document(os.path.join('交通', '火箭', '火箭.svg'), svg.encode()) == '火箭 交通 发射'
+    # 没有命名空间的 svg 也读取 title
+    assert build_icon_document('书本.svg', '<svg><title>阅读</title></svg>'.encode()) == '书本 阅读'
+    # 不是合法的 xml 时只使用路径
+    assert build_icon_document(os.path.join('文具', '书本.svg'), b'<svg') == '书本 文具'
+
+
+class _Icon_Driver:
+    def __init__(self):
+        self.vectors = {}
+        self.deleted_where = []
+
+    def upsert(self, ids, documents, metadatas=None):
+        self.vectors.update(zip(ids, documents))
+
+    def delete(self, ids=None, where=None):
+        if where is not None:
+            self.deleted_where.append(where)
+        for id in ids or []:
+            self.vectors.pop(id)
+
+
+def test_icon_catalog_sync_is_incremental(tmp_path):
+    (tmp_path / '交通').mkdir()
+    (tmp_path / '交通' / '火箭.svg').write_text('<svg xmlns="http://www.w3.org/2000/svg"><title>发射</title></svg>')
+    (tmp_path / '书本.svg').write_text('<svg/>')
+    # 旧版本的 info.json 只有路径
+    (tmp_path / 'info.json').write_text(json.dumps({'icons': ['书本.svg']}))
+
+    driver = _Icon_Driver()
+    catalog = Icon_Catalog(str(tmp_path), driver)
+    assert catalog.sync() == {'added': 2, 'changed': 0, 'removed': 0, 'unchanged': 0}
+    assert driver.deleted_where == [{'path': {'$in': ['书本.svg']}}]
+    assert driver.vectors[os.path.join('交通', '火箭.svg')] == '火箭 交通 发射'
+
+    # 只修改时间变化时不重新向量化
+    os.utime(tmp_path / '书本.svg', ns=(0, os.stat(tmp_path / '书本.svg').st_mtime_ns + 1))
+    assert catalog.sync() == {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 2}
+
+    (tmp_path / '书本.svg').write_text('<svg><desc>阅读</desc></svg>')
+    (tmp_path / '交通' / '火箭.svg').unlink()
+    assert catalog.sync() == {'added': 0, 'changed': 1, 'removed': 1, 'unchanged': 0}
+    assert driver.vectors == {'书本.svg': '书本 阅读'}
+
+
+def test_generation_profiler(tmp_path):
+    import asyncio
+    from .tools.generate_profiler import Generation_Profiler, profiled, profile_stage
+
+    class _Worker:
+        def __init__(self, profiler):
+            self.profiler = profiler
+
+        @profiled('export', size=len)
+        def export(self):
+            return b'12345'
+
+        @profiled('fetch')
+        async def fetch(self):
+            return 1
+
+    profiler = Generation_Profiler('test')
+    worker = _Worker(profiler)
+    worker.export()
+    worker.export()
+    asyncio.run(worker.fetch())
+    with profile_stage(profiler, 'llm') as stage:
+        stage.add_bytes(3)
+
+    summary = profiler.summary()
+    assert summary['export']['count'] == 2
+    assert summary['export']['bytes'] == 10
+    assert summary['fetch']['count'] == 1
+    assert summary['llm']['bytes'] == 3
+
+    trace = json.loads(open(profiler.dump(str(tmp_path)), encoding='utf-8').read())
+    assert len(trace['events']) == 4
+
+    # 关闭统计时直接调用
+    assert _Worker(None).export() == b'12345'
+    with profile_stage(None, 'llm') as stage:
+        stage.add_bytes(3)
+
+
+@pytest.fixture
+def icon_cache(tmp_path, monkeypatch):
+    '''
+    生成图标时使用临时的图标缓存，不写入 ICON_CACHE_DIR
+    '''
+    # cairosvg 依赖系统中的 libcairo
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    from .tools.icons_handle import Icons_Handler
+
+    cache = Icon_Render_Cache(str(tmp_path / 'icon_cache'))
+    monkeypatch.setattr(Icons_Handler, 'render_cache', cache)
+    return cache
+
+
+@pytest.mark.parametrize('template_name', ['橙色', '蓝色', '黑白'])
+def test_offline_benchmark(tmp_path, icon_cache, template_name):
+    from .tools.generate_benchmark import run_benchmark
+
+    icon_cache_dir = tmp_path / 'benchmark_icons'
+    result = run_benchmark(template_name, 10, trace_memory=False, icon_cache_dir=str(icon_cache_dir))
+    assert list(result['phases']) == ['parse_template', 'init', 'build', 'multimedia', 'save']
+    assert result['img_calls'] > 0
+    assert result['profile']['insert_slide']['count'] == 10
+    assert result['size'] > 0
+    # 图标的渲染结果只写入 benchmark 自己的缓存
+    assert any(icon_cache_dir.iterdir())
+    assert len(icon_cache) == 0
+
+
+def test_icon_render_pool_matches_inline():
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    from .tools.icon_render import Icon_Render_Pool
+
+    with open(os.path.join(settings.BASE_DIR, 'icons', 'default.svg'), encoding='utf-8') as f:
+        svg_content = f.read()
+    jobs = [(svg_content, 'FF0000', 32, 32, 96), (svg_content, '00FF00', 48, 24, 96)]
+
+    pool = Icon_Render_Pool(max_workers=1)
+    try:
+        assert pool.render(jobs) == Icon_Render_Pool(max_workers=0).render(jobs)
+    finally:
+        pool.shutdown()
+
+
+def test_find_icons_batches_and_memoizes():
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    import random
+    from .tools.icons_handle import Icons_Handler
+
+    class _Driver:
+        calls = []
+
+        def query_many(self, query_texts, n_results=5):
+            self.calls.append(list(query_texts))
+            return [
+                {
+                    'distances': [0.1, 0.12, 0.3] if q != '没有' else [0.9],
+                    'metadatas': [{'path': f'{q}{i}.svg'} for i in range(3 if q != '没有' else 1)],
+                }
+                for q in query_texts
+            ]
+
+    def handler(seed):
+        h = Icons_Handler.__new__(Icons_Handler)
+        h.icon_folder = 'icons'
+        h.chroma_driver = _Driver()
+        h.random = random.Random(seed)
+        return h
+
+    Icons_Handler.clear_query_cache()
+    queries = ['火箭', '书本', '火箭', '没有']
+    first = handler(1).find_icons(queries)
+    # 重复的文本只查询一次，所有文本在一次查询中完成
+    assert _Driver.calls == [['火箭', '书本', '没有']]
+    assert first[3] is None
+    assert first[0] in ('火箭0.svg', '火箭1.svg')
+
+    # 同样的种子结果相同，并且不再查询 chroma
+    assert handler(1).find_icons(queries) == first
+    assert len(_Driver.calls) == 1
+    Icons_Handler.clear_query_cache()
+
+
+def test_chroma_clients_and_collections_are_shared(tmp_path, monkeypatch):
+    from knowledge_base.tools import chroma_driver
+
+    class _Client:
+        created = 0
+
+        def __init__(self, path):
+            _Client.created += 1
+            self.collections = {}
+
+        def get_or_create_collection(self, name, **kwargs):
+            return self.collections.setdefault(name, object())
+
+        def delete_collection(self, name):
+            self.collections.pop(name)
+
+    monkeypatch.setattr(chroma_driver.chromadb, 'PersistentClient', _Client)
+    monkeypatch.setattr(settings, 'CHROMA_EMBEDDING_FUNCTION', None, raising=False)
+
+    db_path = str(tmp_path / 'chroma_db')
+    first = chroma_driver.Chroma_Driver(db_path, 'system_icons')
+    second = chroma_driver.Chroma_Driver(db_path, 'system_icons')
+    other = chroma_driver.Chroma_Driver(db_path, 'other')
+    assert _Client.created == 1
+    assert first.collection is second.collection
+    assert first.collection is not other.collection
+
+    # reset 之后其他 driver 也使用新的集合
+    old_collection = first.collection
+    first.reset()
+    assert second.collection is first.collection is not old_collection
+
+
+def test_icon_usage_merges_saved_counts(tmp_path):
+    from .tools.icon_usage import Icon_Usage
+
+    file_path = str(tmp_path / 'usage.json')
+    first, second = Icon_Usage(file_path), Icon_Usage(file_path)
+    first.record(['火箭.svg', '火箭.svg', '书本.svg'])
+    second.record(['书本.svg', '书本.svg'])
+    first.save()
+    second.save()
+    assert Icon_Usage(file_path).most_common(2) == ['书本.svg', '火箭.svg']
+
+
+def test_warmup_renders_used_icons_in_template_colors(monkeypatch):
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    from .tools import icon_warmup
+    from .tools.icon_usage import Icon_Usage
+
+    usage = Icon_Usage()
+    monkeypatch.setattr(icon_warmup, 'icon_usage', usage)
+    template_path = os.path.join(settings.BASE_DIR, 'ppt_templates_files', '橙色.pptx')
+
+    class _Handler:
+        calls = []
+
+        def render_icons(self, icons, record_usage=True):
+            self.calls.append((icons, record_usage))
+
+    # 没有使用记录时不预热
+    assert icon_warmup.warmup_template_icons(template_path, _Handler()) == 0
+
+    usage.record(['火箭.svg', '书本.svg', '火箭.svg'])
+    assert icon_warmup.warmup_template_icons(template_path, _Handler(), max_icons=1) == 2
+    icons, record_usage = _Handler.calls[0]
+    assert not record_usage
+    assert icons == [('火箭.svg', '784718', 51, 51, 96), ('火箭.svg', 'D5AB82', 42, 42, 96)]
+
+
+def test_color_parser_caches_slide_colors():
+    from .tools.ppt_color_parse import Color_Parser, _adjust_brightness
+
+    prs = Presentation(os.path.join(settings.BASE_DIR, 'ppt_templates_files', '橙色.pptx'))
+    parser = Color_Parser(prs)
+    # 渐变填充等没有前景色的 shape 不参与比较
+    shapes = [
+        shape for slide in prs.slides for shape in slide.shapes
+        if shape.shape_type != MSO_SHAPE_TYPE.GROUP and shape.fill.type in (None, MSO_FILL.SOLID)
+    ]
+    colors = [parser.get_fore_color_rgb_hex(shape) for shape in shapes]
+    assert len(parser._slide_cache) == len({shape.part for shape in shapes})
+    assert [parser.get_fore_color_rgb_hex(shape) for shape in shapes] == colors
+
+    assert _adjust_brightness('FFFFFF', -0.5) == '808080'
+
+
+def test_shape_walker_parent_shapes():
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    from .tools.ppt_generate import Shape_Walker
+
+    prs = Presentation()
+    slide = prs.slides.add_slide(prs.slide_layouts[6])
+    text = slide.shapes.add_textbox(0, 0, 100, 100)
+    group = slide.shapes.add_group_shape([slide.shapes.add_textbox(0, 100, 100, 100)])
+
+    # 只展开部分 shape（如新添加的组件）时，添加、删除 shape 使用它们所在的 shapes
+    nodes = Shape_Walker().walk([text, group], parent=slide.shapes)
+    assert [node.shapes for node in nodes] == [slide.shapes, slide.shapes, group.shapes, slide.shapes]
+    assert [node.group_start for node in nodes] == [False, True, False, False]
+    assert nodes[2].text == ''
+
+
+@pytest.mark.parametrize('template_name', ['橙色', '蓝色', '黑白'])
+def test_compiled_template_matches_parsed(tmp_path, template_name):
+    import shutil
+    import logging
+    from .tools import template_compile
+
+    template_path = str(tmp_path / f'{template_name}.pptx')
+    shutil.copy(os.path.join(settings.BASE_DIR, 'ppt_templates_files', f'{template_name}.pptx'), template_path)
+    assert template_compile.load_compiled(template_path) is None
+
+    template_compile.compile_template(template_path)
+    parsed = template_compile.parse_template(template_path)
+    compiled = template_compile.load_template(template_path)
+
+    def components(parsed):
+        return [
+            ({k: v for k, v in c.items() if k != 'element'}, c['element'].shape_id)
+            for c in parsed.component_list
+        ]
+
+    assert components(compiled) == components(parsed)
+    assert compiled.section_dict == parsed.section_dict
+    assert compiled.color_parser.color_scheme == parsed.color_parser.color_scheme
+    assert sorted(compiled.image_hashes.values()) == sorted(parsed.image_hashes.values())
+
+    # 上传时 Template_Parser 找到的组件（只在模板页中查找）与编译结果一致
+    compiled_components = {c['name']: c['placeholders'] for c in compiled.component_list}
+    parser = Template_Parser(template_path, logging.getLogger(__name__))
+    assert parser.components
+    for component in parser.components:
+        assert compiled_components[component['name']] == component['placeholders']
+
+    # 模板文件更新后编译结果失效
+    with open(template_path, 'ab') as f:
+        f.write(b'\0')
+    assert template_compile.load_compiled(template_path) is None
+
+
+@pytest.mark.django_db
+def test_template_is_parsed_only_when_file_changes(tmp_path, settings, monkeypatch):
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    from django.contrib.auth import get_user_model
+    from django.core.files.base import ContentFile
+    from .models import PPt_Template
+    from .tools import background_tasks
+
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.ICON_WARMUP = False
+    parses = []
+    parse_file = PPt_Template.parse_file
+    monkeypatch.setattr(PPt_Template, 'parse_file', lambda self: parses.append(self.name) or parse_file(self))
+
+    with open(os.path.join(settings.BASE_DIR, 'ppt_templates_files', '橙色.pptx'), 'rb') as f:
+        content = f.read()
+    user = get_user_model().objects.create(username='tester')
+    template = PPt_Template(name='橙色', user=user, file=ContentFile(content, name='橙色.pptx'))
+    template.save()
+    assert parses == ['橙色']
+    assert template.parse_status == PPt_Template.PARSE_READY
+    assert template.slide_templates and template.file_hash
+
+    # 只修改名称、上传内容相同的文件时不重新解析
+    template.name = '橙色2'
+    template.save()
+    template.file = ContentFile(content, name='橙色2.pptx')
+    template.save()
+    assert parses == ['橙色']
+
+    # 较大的模板在后台解析
+    monkeypatch.setattr(background_tasks, 'submit', lambda func, *args: func(*args))
+    settings.TEMPLATE_BACKGROUND_PARSE_MB = 0
+    large = PPt_Template(name='大模板', user=user, file=ContentFile(content, name='大模板.pptx'))
+    large.save()
+    assert large.parse_status == PPt_Template.PARSE_PENDING
+    large.refresh_from_db()
+    assert large.parse_status == PPt_Template.PARSE_READY
+    assert large.sections == template.sections
+    assert parses == ['橙色', '大模板']
+
+
+def test_template_parser_skips_section_slides():
+    import logging
+
+    parser = Template_Parser(
+        os.path.join(settings.BASE_DIR, 'ppt_templates_files', '橙色.pptx'), logging.getLogger(__name__)
+    )
+    section_ids = {int(slide['id']) for slides in parser.sections.values() for slide in slides}
+    template_ids = {parser.prs.slides[t['id']].slide_id for t in parser.slide_templates}
+    assert section_ids and template_ids
+    assert not section_ids & template_ids
+
+    slide = parser.prs.slides[1]
+    assert parser._get_slide(slide) is slide
+    assert parser._get_slide(str(slide.slide_id)) is slide
+
+
+def test_insert_slide_does_not_modify_shared_template(tmp_path, icon_cache):
+    from lxml import etree
+    from .tools.ppt_generate import PPt_Generator
+    from .tools.generate_benchmark import Benchmark_Template, Offline_Icons_Handler
+
+    # 标题有文字，正文 placeholder 没有 txBody
+    prs = Presentation()
+    slide = prs.slides.add_slide(prs.slide_layouts[1])
+    slide.shapes.title.text = '标题'
+    body = slide.placeholders[1]._element
+    body.remove(body.txBody)
+    template_path = str(tmp_path / 'template.pptx')
+    prs.save(template_path)
+
+    template = Benchmark_Template('insert-slide', template_path)
+    generator = PPt_Generator(str(tmp_path / 'out.pptx'), template, icons_handler=Offline_Icons_Handler())
+    template_xml = etree.tostring(generator._get_slide(0, generator.temp_ppt)._element)
+
+    slide_n = generator._insert_slide_from_template(0)
+    assert slide_n.shapes.title.text == '标题'
+    assert etree.tostring(generator._get_slide(0, generator.temp_ppt)._element) == template_xml
+
+
+def test_incremental_generation_reuses_unchanged_pages(tmp_path, icon_cache):
+    import logging
+    import shutil
+    from .tools.generate_benchmark import Benchmark_Template, Offline_Icons_Handler, synthesize_slide_data
+    from .tools.ppt_generate import PPt_Generator
+
+    template_path = str(tmp_path / '橙色.pptx')
+    shutil.copy(os.path.join(settings.BASE_DIR, 'ppt_templates_files', '橙色.pptx'), template_path)
+    template = Benchmark_Template('incremental', template_path)
+    parser = Template_Parser(template_path, logging.getLogger(__name__))
+    slides = dict(zip('abcd', synthesize_slide_data(parser.slide_templates, 4)))
+
+    def generate(file_name, pages, reuse_file=None):
+        generator = PPt_Generator(str(tmp_path / file_name), template, reuse_file, icons_handler=Offline_Icons_Handler())
+        unchanged = {key: generator.is_page_unchanged(key, *slide) for key, slide in pages}
+        reused = {key: generator.add_page(key, *slide)[1] for key, slide in pages}
+        assert unchanged == reused
+        generator.finish_pages()
+        generator.save()
+        return reused, [slide.slide_id for slide in Presentation(generator.file_name).slides]
+
+    reused, first_ids = generate('first.pptx', list(slides.items()))
+    assert not any(reused.values()) and len(first_ids) == 4
+    old_ids = dict(zip('abcd', first_ids))
+
+    # 修改 b，删除 c，调整顺序：d、b、a
+    changed_b = (slides['b'][0], slides['b'][1] + '\n修改')
+    reused, second_ids = generate(
+        'second.pptx', [('d', slides['d']), ('b', changed_b), ('a', slides['a'])], reuse_file=str(tmp_path / 'first.pptx')
+    )
+    assert reused == {'d': True, 'b': False, 'a': True}
+    assert len(second_ids) == 3
+    assert second_ids[0] == old_ids['d'] and second_ids[2] == old_ids['a']
+    assert second_ids[1] not in first_ids
+
+    # 模板更新后（模板版本不同）不复用
+    os.utime(template_path, ns=(0, os.stat(template_path).st_mtime_ns + 1))
+    reused, third_ids = generate('third.pptx', [('a', slides['a'])], reuse_file=str(tmp_path / 'second.pptx'))
+    assert reused == {'a': False}
+    assert len(third_ids) == 1
@@ -0,0 +1,30 @@
+'''
+模板的后台任务：解析较大的模板、预热图标
+    任务在一个后台线程中依次执行，不阻塞上传模板的请求
+    任务中可以使用 ORM，执行完成后关闭这个线程的数据库连接
+'''
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='template_task')
+
+
+def _run(func, args):
+    try:
+        return func(*args)
+    except Exception:
+        logger.exception(f'后台任务执行失败：{func.__name__}{args}')
+    finally:
+        close_old_connections()
+
+
+def submit(func, *args):
+    '''
+    在后台线程中执行 func(*args)，返回 Future，异常记录到日志中，Future 的结果为 None
+    '''
+    return _executor.submit(_run, func, args)
@@ -0,0 +1,140 @@
+'''
+container 中组件的排列
+    direction: l-r 从左到右，t-b 从上到下
+    align / valign: 水平、垂直对齐，l r c j / t b c j，j 为两端对齐，只在排列方向上有效
+    gap: 组件之间的间隔
+    wrap: 组件放不下一行（列）时换行（列），wrap-N 表示每行（列）最多 N 个，只写 wrap 时按 container 的大小计算
+'''
+
+from pptx.util import Emu
+
+
+def calculate_positions(
+    parent_width, parent_height, parent_x, parent_y,
+    child_width, child_height,
+    child_count: int,
+    direction: str = "l-r",
+    horizontal_alignment: str = "l",
+    vertical_alignment: str = "t",
+    spacing=Emu(0),
+) -> list[tuple[Emu, Emu]]:
+    """
+    计算子元素在父元素中的排列位置（单行或单列）
+
+    返回:
+        每个子元素的左上角坐标列表，格式为 [(x1, y1), (x2, y2), ...]
+    """
+    # 计算子元素总体尺寸
+    if direction == "l-r":
+        total_children_width = child_width * child_count + spacing * (child_count - 1)
+        total_children_height = child_height
+    else:  # t-b
+        total_children_width = child_width
+        total_children_height = child_height * child_count + spacing * (child_count - 1)
+
+    # 计算水平方向偏移量
+    if horizontal_alignment == "l":
+        start_x = parent_x
+    elif horizontal_alignment == "r":
+        start_x = parent_x + parent_width - total_children_width
+    elif horizontal_alignment == "c":
+        start_x = parent_x + (parent_width - total_children_width) / 2
+    else:  # j (只在l-r排列时有效)
+        if child_count > 1:
+            # 重新计算 j 模式下的间距
+            spacing = (parent_width - child_width * child_count) / (child_count - 1)
+        start_x = parent_x
+
+    # 计算垂直方向偏移量
+    if vertical_alignment == "t":
+        start_y = parent_y
+    elif vertical_alignment == "b":
+        start_y = parent_y + parent_height - total_children_height
+    elif vertical_alignment == "c":
+        start_y = parent_y + (parent_height - total_children_height) / 2
+    else:  # j (只在t-b排列时有效)
+        if child_count > 1:
+            # 重新计算 j 模式下的间距
+            spacing = (parent_height - child_height * child_count) / (child_count - 1)
+        start_y = parent_y
+
+    # 计算每个子元素的位置
+    if direction == "l-r":
+        step = child_width + spacing
+        return [(Emu(start_x + i * step), Emu(start_y)) for i in range(child_count)]
+    else:  # t-b
+        step = child_height + spacing
+        return [(Emu(start_x), Emu(start_y + i * step)) for i in range(child_count)]
+
+
+def get_wrap_size(wrap, parent_size, child_size, spacing):
+    '''
+    每行（列）最多放多少个组件，wrap 为 None 时不换行
+    '''
+    if wrap is None:
+        return None
+    if wrap != '':
+        return max(1, int(wrap))
+    return max(1, int((parent_size + spacing) // (child_size + spacing)))
+
+
+def calculate_grid_positions(
+    parent_width, parent_height, parent_x, parent_y,
+    child_width, child_height,
+    child_count: int,
+    direction: str = "l-r",
+    horizontal_alignment: str = "l",
+    vertical_alignment: str = "t",
+    spacing=Emu(0),
+    wrap=None,
+) -> list[tuple[Emu, Emu]]:
+    """
+    计算子元素的位置，一行（列）放不下时换行（列）
+    换行后，每一行在行内按排列方向对齐，所有行作为一个整体在另一个方向上对齐，行间距与 spacing 相同
+
+    参数:
+        wrap: None 不换行；'' 按父元素大小计算每行（列）的数量；数字字符串为每行（列）的最大数量
+    """
+    if direction == "l-r":
+        line_size = get_wrap_size(wrap, parent_width, child_width, spacing)
+    else:
+        line_size = get_wrap_size(wrap, parent_height, child_height, spacing)
+
+    if line_size is None or child_count <= line_size:
+        return calculate_positions(
+            parent_width, parent_height, parent_x, parent_y,
+            child_width, child_height, child_count,
+            direction, horizontal_alignment, vertical_alignment, spacing
+        )
+
+    line_counts = [min(line_size, child_count - i) for i in range(0, child_count, line_size)]
+
+    positions = []
+    if direction == "l-r":
+        # 每一行是一个 l-r 的单行排列，所有行按垂直方向排列
+        rows = calculate_positions(
+            parent_width, parent_height, parent_x, parent_y,
+            parent_width, child_height, len(line_counts),
+            "t-b", "l", vertical_alignment, spacing
+        )
+        for count, (_, row_y) in zip(line_counts, rows):
+            positions.extend(calculate_positions(
+                parent_width, child_height, parent_x, row_y,
+                child_width, child_height, count,
+                "l-r", horizontal_alignment, "t", spacing
+            ))
+    else:
+        # 每一列是一个 t-b 的单列排列，所有列按水平方向排列
+        columns = calculate_positions(
+            parent_width, parent_height, parent_x, parent_y,
+            child_width, parent_height, len(line_counts),
+            "l-r", horizontal_alignment, "t", spacing
+        )
+        for count, (column_x, _) in zip(line_counts, columns):
+            positions.extend(calculate_positions(
+                child_width, parent_height, column_x, parent_y,
+                child_width, child_height, count,
+                "t-b", "l", vertical_alignment, spacing
+            ))
+
+    return positions
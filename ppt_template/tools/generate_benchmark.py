@@ -0,0 +1,280 @@
+'''
+PPt 生成的离线性能测试
+    不依赖大模型、图片接口和 chroma：
+        slide_data 根据 Template_Parser 解析出的页面模板合成，覆盖 text、icon、img、container
+        图片接口返回本地生成的纯色 PNG，图标按名称固定选择 icons 文件夹中的 svg
+        图标的渲染结果放在单独的缓存中，不读写生成时使用的图标缓存（ICON_CACHE_DIR）
+    按阶段（解析模板、初始化、生成页面、图片替换、保存）统计耗时和内存峰值，
+    同时附带 Generation_Profiler 的分阶段统计
+    可以通过 manage.py benchmark_generation 运行，也可以在 pytest 中调用 run_benchmark
+'''
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from functools import lru_cache
+
+from django.conf import settings
+from PIL import Image
+
+from .icons_handle import Icons_Handler
+from .icon_render_cache import Icon_Render_Cache
+from .icon_usage import Icon_Usage
+from .template_parse import Template_Parser
+from .template_cache import template_cache
+from .generate_profiler import Generation_Profiler
+from .ppt_generate import PPt_Generator
+
+# 内置的模板
+BENCHMARK_TEMPLATES = ['橙色', '蓝色', '黑白']
+
+# 合成数据时使用的图标名称，最后一个找不到图标
+ICON_WORDS = ['火箭', '书本', '上传', '品质', '任务清单', '没有这个图标']
+
+TEXT_SAMPLE = '通过离线数据测试 PPt 生成的性能，覆盖文字、图标、图片和容器'
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Image_Data:
+    def __init__(self, b64_json):
+        self.b64_json = b64_json
+
+
+@lru_cache(maxsize=32)
+def _fake_png(width, height):
+    # 纯色 PNG，压缩后很小，同样的尺寸只生成一次
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (96, 144, 192)).save(buffer, 'PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class Fake_Images:
+    '''
+    模拟 AsyncOpenAI().images，返回请求尺寸的本地 PNG
+    '''
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = 0
+
+    async def generate(self, prompt, size, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        width, height = [int(x) for x in size.split('x')]
+        return _Response([_Image_Data(_fake_png(width, height))])
+
+
+class Fake_Image_Client:
+    '''
+    替换 PPt_Generator.client，latency 为每次请求的模拟延迟（秒）
+    '''
+
+    def __init__(self, latency=0):
+        self.images = Fake_Images(latency)
+
+
+class Offline_Icons_Handler(Icons_Handler):
+    '''
+    不使用 chroma 的 Icons_Handler，根据名称的哈希从 icons 文件夹中选择图标，结果是固定的
+    '''
+
+    # 测试中的使用次数不计入图标的使用统计
+    usage = Icon_Usage()
+
+    def __init__(self, icon_folder='icons', render_cache=None):
+        '''
+        render_cache: 图标渲染结果的 Icon_Render_Cache，为 None 时使用进程内共享的缓存
+        '''
+        self.icon_folder = icon_folder
+        self.random = random.Random(0)
+        if render_cache is not None:
+            self.render_cache = render_cache
+        self.icons = sorted(
+            os.path.relpath(os.path.join(root, file), icon_folder)
+            for root, dirs, files in os.walk(icon_folder)
+            for file in files if file.endswith('.svg')
+        )
+
+    def _query_icons(self, queries):
+        result = {}
+        for query in queries:
+            if not self.icons or query == ICON_WORDS[-1]:
+                result[query] = []
+                continue
+            digest = hashlib.sha1(query.encode('utf8')).digest()
+            result[query] = [(0.0, self.icons[digest[0] % len(self.icons)])]
+        return result
+
+
+class Benchmark_Template:
+    '''
+    模拟 PPt_Template，只提供 PPt_Generator 需要的 id 和 file.path
+    '''
+
+    class _File:
+        def __init__(self, path):
+            self.path = path
+
+    def __init__(self, name, path):
+        self.id = f'benchmark-{name}'
+        self.name = name
+        self.file = self._File(path)
+
+
+def _fill_placeholder(placeholder, i):
+    p_type = placeholder['type']
+    data = {'name': placeholder['name'], 'type': p_type}
+    if p_type == 'icon':
+        data['content'] = ICON_WORDS[i % len(ICON_WORDS)]
+    elif p_type == 'img':
+        data['content'] = f'{TEXT_SAMPLE}，配图 {i}'
+    elif p_type == 'container':
+        # 组件数量在 min 和 max 之间变化
+        min_n = placeholder.get('min_component_number', 1)
+        max_n = placeholder.get('max_component_number', 5)
+        count = min_n + i % (max_n - min_n + 1)
+        data['content'] = ''
+        data['components_placeholders'] = [
+            [_fill_placeholder(c, i + k) for c in placeholder.get('component_placeholders', [])]
+            for k in range(count)
+        ]
+    else:
+        data['content'] = TEXT_SAMPLE[:8 + i % len(TEXT_SAMPLE)]
+    return data
+
+
+def synthesize_slide_data(slide_templates, n_slides):
+    '''
+    依次使用 slide_templates 中的页面模板，合成 n_slides 页的 slide_data
+    返回 [(slide_data, slide_note), ...]
+    '''
+    slides = []
+    for i in range(n_slides):
+        slide_template = slide_templates[i % len(slide_templates)]
+        slide_data = {
+            'template_id': slide_template['id'],
+            'placeholders': [_fill_placeholder(p, i + j) for j, p in enumerate(slide_template['placeholders'])]
+        }
+        slides.append((slide_data, f'{slide_template["name"]} {i}\n{TEXT_SAMPLE}'))
+    return slides
+
+
+class Phase_Recorder:
+    '''
+    记录每个阶段的耗时和内存峰值（tracemalloc），trace_memory 为 False 时只记录耗时
+    tracemalloc 只统计 python 分配的内存，lxml 中 xml 树占用的内存不在其中
+    '''
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self._name = None
+
+    def __call__(self, name):
+        self._name = name
+        return self
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        phase = {'time': round(time.perf_counter() - self._start, 3)}
+        if self.trace_memory:
+            phase['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        self.phases[self._name] = phase
+        return False
+
+
+def run_benchmark(template_name, n_slides, trace_memory=True, img_latency=0, output_dir=None, icon_cache_dir=None):
+    '''
+    用内置模板 template_name 生成 n_slides 页的 ppt
+    args:
+        trace_memory: 是否用 tracemalloc 统计内存峰值，开启后耗时会变长
+        img_latency: 模拟的图片接口延迟（秒）
+        output_dir: 保存生成的 ppt，为 None 时不写文件
+        icon_cache_dir: 图标渲染结果的磁盘缓存，为 None 时每次运行只使用新的内存缓存（图标都重新渲染）
+    返回 dict，包括各阶段的耗时、内存峰值和 Generation_Profiler 的统计
+    '''
+    template_path = os.path.join(settings.BASE_DIR, 'ppt_templates_files', f'{template_name}.pptx')
+    template = Benchmark_Template(template_name, template_path)
+    profiler = Generation_Profiler(f'benchmark_{template_name}_{n_slides}')
+    phase = Phase_Recorder(trace_memory)
+
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    # 模板缓存会影响初始化的耗时，每次都从解析模板开始
+    template_cache.invalidate(template.id)
+
+    try:
+        with phase('parse_template'):
+            parser = Template_Parser(template_path, logging.getLogger(__name__))
+            slides = synthesize_slide_data(parser.slide_templates, n_slides)
+
+        # file_name 不存在时，PPt_Generator 从空白模板开始生成
+        file_name = os.path.join(output_dir or tempfile.gettempdir(), f'benchmark_{template_name}_{n_slides}.pptx')
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+        with phase('init'):
+            generator = PPt_Generator(
+                file_name, template, profiler=profiler,
+                icons_handler=Offline_Icons_Handler(render_cache=Icon_Render_Cache(icon_cache_dir)),
+            )
+            generator.client = Fake_Image_Client(img_latency)
+
+        with phase('build'):
+            for i, (slide_data, slide_note) in enumerate(slides):
+                generator.add_page(i, slide_data, slide_note)
+            generator.finish_pages()
+
+        async def replace_multimedia():
+            async for _ in generator.batch_replace_multimedia():
+                pass
+
+        with phase('multimedia'):
+            asyncio.run(replace_multimedia())
+
+        with phase('save'):
+            if output_dir is None:
+                blob = generator.export_blob()
+            else:
+                blob = generator.save_and_export_blob()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    return {
+        'template': template_name,
+        'slides': n_slides,
+        'img_calls': generator.client.images.calls,
+        'size': len(blob),
+        'phases': phase.phases,
+        'profile': profiler.summary(),
+    }
+
+
+def run_benchmarks(template_names=None, slide_counts=(10, 50, 200), **kwargs):
+    '''
+    对多个模板、多个页数运行 run_benchmark，返回结果列表
+    '''
+    return [
+        run_benchmark(template_name, n_slides, **kwargs)
+        for template_name in (template_names or BENCHMARK_TEMPLATES)
+        for n_slides in slide_counts
+    ]
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from asgiref.sync import sync_to_async
+
+from .ppt_generate import PPt_Generator
+
+
+class Generation_Executor:
+    '''
+    PPt 生成执行器
+    python-pptx 的操作（deepcopy、xpath、zip 读写）都是同步的，直接在 consumer 中调用会卡住整个事件循环，
+    导致同一个 Daphne 进程上的其他 WebSocket 都没有响应
+    这里把这些操作放到线程池中执行，consumer 通过 Async_PPt_Generator await 结果
+    '''
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # 第一次使用时才创建线程池
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='ppt_generate'
+                    )
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        在线程池中执行同步函数，并等待结果
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def create_generator(self, file_name: str, template, reuse_file: str = None, profiler=None):
+        '''
+        在线程池中创建 PPt_Generator，返回对应的 Async_PPt_Generator
+        '''
+        generator = await self.run(PPt_Generator, file_name, template, reuse_file, profiler)
+        generator.executor = self
+        return Async_PPt_Generator(generator, self)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+class Async_PPt_Generator:
+    '''
+    PPt_Generator 的异步外观，所有同步操作都在 Generation_Executor 的线程池中执行
+    同一个 generator 的操作通过 lock 串行执行，避免多个线程同时修改同一份 ppt
+    '''
+
+    def __init__(self, generator: PPt_Generator, executor: Generation_Executor):
+        self.generator = generator
+        self.executor = executor
+        self._lock = asyncio.Lock()
+
+    @property
+    def profiler(self):
+        return self.generator.profiler
+
+    async def _run(self, func, *args, **kwargs):
+        async with self._lock:
+            return await self.executor.run(func, *args, **kwargs)
+
+    async def add_slide(self, slide_data, slide_note=None):
+        return await self._run(self.generator.add_slide, slide_data, slide_note)
+
+    async def is_page_unchanged(self, page_key, slide_data, slide_note=None, source=None):
+        return await self._run(self.generator.is_page_unchanged, page_key, slide_data, slide_note, source)
+
+    async def add_page(self, page_key, slide_data, slide_note=None, source=None):
+        return await self._run(self.generator.add_page, page_key, slide_data, slide_note, source)
+
+    async def finish_pages(self):
+        return await self._run(self.generator.finish_pages)
+
+    async def batch_clear_slide(self):
+        return await self._run(self.generator.batch_clear_slide)
+
+    async def save(self, file_name_with_path=None):
+        return await self._run(self.generator.save, file_name_with_path)
+
+    async def save_and_export_blob(self, file_name_with_path=None):
+        return await self._run(self.generator.save_and_export_blob, file_name_with_path)
+
+    async def export_blob(self):
+        return await self._run(self.generator.export_blob)
+
+    async def export_to_field(self, field_file):
+        '''
+        序列化一次，直接保存到 FileField 的 storage，不经过临时文件，返回 blob 供发送给前端
+        '''
+        blob = await self.export_blob()
+        await sync_to_async(field_file.save)('', ContentFile(blob))
+        return blob
+
+    async def batch_replace_multimedia(self):
+        '''
+        图片请求在事件循环中并发执行，页面修改由 PPt_Generator 交给线程池执行
+        '''
+        async with self._lock:
+            async for slide_id in self.generator.batch_replace_multimedia():
+                yield slide_id
+
+
+# 进程内共享的执行器
+generation_executor = Generation_Executor(settings.GENERATION_WORKERS)
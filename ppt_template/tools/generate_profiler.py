@@ -0,0 +1,167 @@
+'''
+PPt 生成的性能统计
+    按阶段（stage）记录耗时、调用次数和处理的字节数，用来判断慢在大模型、图片生成、图标渲染、页面复制还是保存文件
+    默认关闭，settings.GENERATION_PROFILE 为 True 时由 consumer 创建 Generation_Profiler 并交给 PPt_Generator
+    阶段可以嵌套，耗时都是包含子阶段的墙钟时间；并发执行的阶段（如图片生成）耗时会叠加，可能大于总耗时
+'''
+
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Stage_Timer:
+    '''
+    一次阶段执行的计时，退出时记录到 profiler
+    '''
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.bytes = 0
+        self.start = None
+
+    def add_bytes(self, n):
+        self.bytes += n or 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.name, self.start, time.perf_counter(), self.bytes)
+        return False
+
+
+class Null_Stage:
+    '''
+    关闭统计时使用的空计时
+    '''
+
+    def add_bytes(self, n):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_STAGE = Null_Stage()
+
+
+class Generation_Profiler:
+    '''
+    记录一次生成过程中各阶段的耗时
+    generator 的操作在线程池中执行，图片生成在事件循环中执行，所以 record 需要加锁
+    '''
+
+    def __init__(self, name=''):
+        self.name = name
+        self.created = time.time()
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        # 阶段名 -> [次数, 耗时, 字节数]
+        self._stages = {}
+        # 每次执行的记录，用于导出 trace
+        self._events = []
+
+    def stage(self, name):
+        '''
+        用法：with profiler.stage('save') as stage: ... stage.add_bytes(n)
+        '''
+        return Stage_Timer(self, name)
+
+    def record(self, name, start, end, nbytes=0):
+        with self._lock:
+            stage = self._stages.setdefault(name, [0, 0.0, 0])
+            stage[0] += 1
+            stage[1] += end - start
+            stage[2] += nbytes
+            self._events.append((
+                name, start - self._origin, end - start, nbytes, threading.current_thread().name
+            ))
+
+    def summary(self):
+        '''
+        各阶段的统计，按耗时从大到小排列，可以直接放到 WebSocket 消息中
+        '''
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda item: item[1][1], reverse=True)
+            return {
+                name: {'count': count, 'time': round(cost, 3), 'bytes': nbytes}
+                for name, (count, cost, nbytes) in stages
+            }
+
+    def to_dict(self):
+        with self._lock:
+            events = [
+                {'stage': name, 'start': round(start, 6), 'time': round(cost, 6), 'bytes': nbytes, 'thread': thread}
+                for name, start, cost, nbytes, thread in self._events
+            ]
+        return {
+            'name': self.name,
+            'created': self.created,
+            'total': round(time.perf_counter() - self._origin, 3),
+            'stages': self.summary(),
+            'events': events,
+        }
+
+    def dump(self, folder):
+        '''
+        把 trace 保存为 json 文件，返回文件路径
+        '''
+        os.makedirs(folder, exist_ok=True)
+        file_name = f'{self.name or "generation"}_{time.strftime("%Y%m%d_%H%M%S", time.localtime(self.created))}.json'
+        file_path = os.path.join(folder, file_name)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return file_path
+
+
+def profile_stage(profiler, name):
+    '''
+    profiler 为 None 时返回空的计时，不做任何统计
+    '''
+    if profiler is None:
+        return NULL_STAGE
+    return profiler.stage(name)
+
+
+def profiled(name, size=None):
+    '''
+    方法的装饰器，从 self.profiler 获取 profiler，为 None 时直接调用
+    args:
+        name: 阶段名
+        size: 根据返回值计算字节数的函数
+    '''
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                if self.profiler is None:
+                    return await func(self, *args, **kwargs)
+                with self.profiler.stage(name) as stage:
+                    result = await func(self, *args, **kwargs)
+                    if size is not None:
+                        stage.add_bytes(size(result))
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return func(self, *args, **kwargs)
+            with self.profiler.stage(name) as stage:
+                result = func(self, *args, **kwargs)
+                if size is not None:
+                    stage.add_bytes(size(result))
+            return result
+        return wrapper
+
+    return decorator
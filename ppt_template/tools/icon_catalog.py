@@ -0,0 +1,173 @@
+'''
+图标库的索引
+    icons 文件夹中的图标在 chroma 的 system_icons 集合中建立向量索引，用于根据文字查找图标
+    info.json 中记录每个图标的修改时间、大小和内容哈希，同步时只处理新增、修改和删除的图标：
+        修改时间和大小没有变化的图标不读取内容；内容哈希没有变化的图标不重新向量化
+    向量的 id 为图标的相对路径，文档为文件名、所在文件夹（作为标签）以及 svg 中的 <title>、<desc>
+    每个进程只在第一次使用时同步一次，也可以通过 manage.py sync_icons 手动同步
+'''
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from lxml import etree
+
+CATALOG_VERSION = 2
+SVG_NS = 'http://www.w3.org/2000/svg'
+
+# 每次写入 chroma 的图标数量
+BATCH_SIZE = 256
+
+
+def _read_svg_text(content):
+    '''
+    读取 svg 中 <title> 和 <desc> 的文字
+    '''
+    try:
+        root = etree.fromstring(content, etree.XMLParser(recover=True, resolve_entities=False))
+    except etree.XMLSyntaxError:
+        return []
+    if root is None:
+        return []
+
+    texts = []
+    for tag in ('title', 'desc'):
+        for elem in root.iter(f'{{{SVG_NS}}}{tag}', tag):
+            text = (elem.text or '').strip()
+            if text and text not in texts:
+                texts.append(text)
+    return texts
+
+
+def build_icon_document(icon_path, content):
+    '''
+    图标的索引文本：文件名、文件夹名（标签）、svg 中的 title 和 desc
+    '''
+    folder, file_name = os.path.split(icon_path)
+    parts = [os.path.splitext(file_name)[0]]
+    parts.extend(tag for tag in folder.split(os.sep) if tag)
+    parts.extend(_read_svg_text(content))
+
+    words = []
+    for part in parts:
+        if part not in words:
+            words.append(part)
+    return ' '.join(words)
+
+
+class Icon_Catalog:
+    '''
+    args:
+        icon_folder: 图标文件夹
+        chroma_driver: system_icons 集合的 Chroma_Driver
+    '''
+
+    def __init__(self, icon_folder, chroma_driver):
+        self.icon_folder = icon_folder
+        self.chroma_driver = chroma_driver
+        self.catalog_path = os.path.join(icon_folder, 'info.json')
+
+    def _load(self):
+        '''
+        返回 (图标路径 -> 记录, 旧版本 info.json 中的图标路径)
+        '''
+        if not os.path.exists(self.catalog_path):
+            return {}, []
+        with open(self.catalog_path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+
+        # 旧版本只记录了路径，向量的 id 是随机的，需要按 path 删除后重建
+        if catalog.get('version') != CATALOG_VERSION:
+            return {}, list(catalog.get('icons', []))
+        return catalog['icons'], []
+
+    def _save(self, icons):
+        tmp_path = f'{self.catalog_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CATALOG_VERSION, 'icons': icons}, f, indent=4, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.catalog_path)
+
+    def _scan(self):
+        '''
+        icons 文件夹中所有的 svg：相对路径 -> os.stat 的结果
+        '''
+        files = {}
+        for root, dirs, file_names in os.walk(self.icon_folder):
+            for file_name in file_names:
+                if not file_name.endswith('.svg'): continue
+                full_path = os.path.join(root, file_name)
+                files[os.path.relpath(full_path, self.icon_folder)] = os.stat(full_path)
+        return files
+
+    def sync(self):
+        '''
+        同步图标文件夹和向量索引
+        返回各类图标的数量：added、changed、removed、unchanged
+        '''
+        icons, legacy_paths = self._load()
+        files = self._scan()
+
+        if legacy_paths:
+            for start in range(0, len(legacy_paths), BATCH_SIZE):
+                self.chroma_driver.delete(where={'path': {'$in': legacy_paths[start:start + BATCH_SIZE]}})
+
+        summary = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        upserts = []  # (path, document)
+        new_icons = {}
+        for icon_path, stat in sorted(files.items()):
+            record = icons.get(icon_path)
+            if record and record['mtime'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                new_icons[icon_path] = record
+                summary['unchanged'] += 1
+                continue
+
+            with open(os.path.join(self.icon_folder, icon_path), 'rb') as f:
+                content = f.read()
+            content_hash = hashlib.sha1(content).hexdigest()
+            new_icons[icon_path] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': content_hash}
+
+            if record and record['hash'] == content_hash:
+                # 只是修改时间变化
+                summary['unchanged'] += 1
+                continue
+
+            summary['changed' if record else 'added'] += 1
+            upserts.append((icon_path, build_icon_document(icon_path, content)))
+
+        removed = [icon_path for icon_path in icons if icon_path not in files]
+        summary['removed'] = len(removed)
+
+        for start in range(0, len(removed), BATCH_SIZE):
+            self.chroma_driver.delete(ids=removed[start:start + BATCH_SIZE])
+        for start in range(0, len(upserts), BATCH_SIZE):
+            batch = upserts[start:start + BATCH_SIZE]
+            self.chroma_driver.upsert(
+                ids=[icon_path for icon_path, _ in batch],
+                documents=[document for _, document in batch],
+                metadatas=[{'path': icon_path} for icon_path, _ in batch],
+            )
+
+        if new_icons != icons or legacy_paths:
+            self._save(new_icons)
+        return summary
+
+
+# 已经同步过的图标文件夹，每个进程只同步一次
+_synced_folders = set()
+_sync_lock = threading.Lock()
+
+
+def sync_once(icon_folder, chroma_driver):
+    '''
+    进程内第一次调用时同步 icon_folder，返回 sync 的结果，已经同步过时返回 None
+    '''
+    folder = os.path.abspath(icon_folder)
+    with _sync_lock:
+        if folder in _synced_folders:
+            return None
+        summary = Icon_Catalog(icon_folder, chroma_driver).sync()
+        _synced_folders.add(folder)
+        return summary
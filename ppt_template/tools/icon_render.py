@@ -0,0 +1,180 @@
+'''
+图标的渲染：修改 svg 的颜色、字体，再用 cairosvg 转换为 png
+    cairosvg 的转换是 CPU 密集的纯 python 代码，图标多的时候放到进程池中并行执行
+    这个模块会在进程池的子进程中导入，不能依赖 django 的配置
+'''
+
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cairosvg import svg2png
+from lxml import etree
+
+# 需要添加的中文字体
+CHINESE_FONTS = ['"PingFang SC"', '"Microsoft YaHei"', '"WenQuanYi Micro Hei"']
+
+
+def get_svg_dimensions(svg_content):
+    """从SVG文件中提取宽度和高度"""
+
+    width_match = re.search(r'width\s*=\s*"([^"]+)"', svg_content)
+    height_match = re.search(r'height\s*=\s*"([^"]+)"', svg_content)
+
+    if not width_match or not height_match:
+        viewBox_match = re.search(r'viewBox\s*=\s*"([^"]+)"', svg_content)
+        if viewBox_match:
+            viewBox = viewBox_match.group(1).split()
+            if len(viewBox) == 4:
+                return float(viewBox[2]), float(viewBox[3])
+        raise ValueError("无法从SVG中提取尺寸信息")
+
+    width = float(re.sub(r'[^\d.]', '', width_match.group(1)))
+    height = float(re.sub(r'[^\d.]', '', height_match.group(1)))
+
+    return width, height
+
+
+def add_chinese_fonts(svg_xml):
+    """
+    在所有font-family属性后添加中文字体
+    在分号前增加: ,"PingFang SC", "Microsoft YaHei", "WenQuanYi Micro Hei"
+    """
+    # 查找所有font-family属性
+    for elem in svg_xml.xpath('//@font-family'):
+        # 获取原来的字体
+        fonts = elem.value.split(';')[0]
+        for font in CHINESE_FONTS:
+            if font in fonts:
+                continue
+        else:
+            # 在分号前添加中文字体
+            fonts = f"{elem.value}, {font}"
+
+        elem.value = fonts
+
+    return svg_xml
+
+
+def change_svg_fill(svg_xml, fill_color):
+    """
+    改变SVG的fill颜色，目前支持 6 位 16 进制颜色
+    """
+
+    if fill_color == None: return svg_xml
+
+    if len(fill_color) == 6:
+        fill_color = '#' + fill_color
+
+    for elem in svg_xml.xpath('//*[@fill]'):
+        elem.set('fill', fill_color)
+
+    # 给 svg 增加 fill
+    ns = {'svg': 'http://www.w3.org/2000/svg'}
+    svg_xml.xpath('//svg:svg', namespaces=ns)[0].set('fill', fill_color)
+
+    return svg_xml
+
+
+def modify_svg(svg_content, fill_color):
+    '''
+    添加中文字体、修改颜色，返回修改后 svg 的 bytes
+    '''
+    svg_xml = etree.fromstring(svg_content.encode('utf-8'))
+    svg_xml = add_chinese_fonts(svg_xml)
+    svg_xml = change_svg_fill(svg_xml, fill_color)
+    return etree.tostring(svg_xml, encoding='utf-8')
+
+
+def svg_to_png(svg_content, png_path=None, width=None, height=None, dpi=96):
+    """
+    转换SVG为PNG，png_path 为 None 时返回 png 的内容
+    """
+
+    # 获取SVG原始尺寸
+    orig_width, orig_height = get_svg_dimensions(svg_content)
+
+    # 计算输出尺寸
+    if width and not height:
+        scale = width / orig_width
+        height = orig_height * scale
+    elif height and not width:
+        scale = height / orig_height
+        width = orig_width * scale
+    elif not width and not height:
+        width, height = orig_width, orig_height
+
+    # 执行转换
+    return svg2png(
+        bytestring=svg_content.encode('utf-8'),
+        write_to=png_path,
+        dpi=dpi,
+        parent_width=orig_width,
+        parent_height=orig_height,
+        output_width=int(width),
+        output_height=int(height)
+    )
+
+
+def render_svg(svg_content, fill_color, width, height, dpi=96):
+    '''
+    渲染一个图标，返回 (修改后的 svg, png) 的 bytes，进程池中执行的任务
+    '''
+    svg = modify_svg(svg_content, fill_color)
+    png = svg_to_png(svg.decode('utf-8'), None, width, height, dpi)
+    return svg, png
+
+
+def _render_job(job):
+    return render_svg(*job)
+
+
+class Icon_Render_Pool:
+    '''
+    渲染图标的进程池
+    args:
+        max_workers: 进程数，为 0 时在当前线程中渲染
+        min_batch: 待渲染的图标少于这个数量时，在当前线程中渲染，避免进程间通信的开销
+    子进程使用 spawn 启动：生成在多线程的环境中执行，fork 可能复制到其他线程持有的锁
+    '''
+
+    def __init__(self, max_workers: int, min_batch: int = 2):
+        self.max_workers = max_workers
+        self.min_batch = min_batch
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # 第一次使用时才创建进程池
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def render(self, jobs):
+        '''
+        jobs: [(svg_content, fill_color, width, height, dpi), ...]
+        返回与 jobs 顺序一致的 [(svg, png), ...]
+        '''
+        if self.max_workers <= 0 or len(jobs) < self.min_batch:
+            return [_render_job(job) for job in jobs]
+
+        try:
+            return list(self.executor.map(_render_job, jobs))
+        except BrokenProcessPool:
+            # 子进程异常退出时重建进程池，这一批在当前线程中渲染
+            self.shutdown(wait=False)
+            return [_render_job(job) for job in jobs]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,187 @@
+'''
+图标渲染结果的缓存
+    同一个图标、颜色、尺寸只需要渲染一次，渲染结果（修改颜色后的 svg 和 png）先放在内存 LRU 中，
+    同时保存到磁盘，进程重启或者其他进程生成时也可以直接使用
+    key 包括图标文件的路径和修改时间，图标文件更新后自动失效
+    key 中的颜色、尺寸组合会不断增加，磁盘缓存按大小和保留天数清理（prune）：
+        最近使用时间取文件 atime 和 mtime 中较晚的一个，磁盘命中时更新 mtime，不依赖文件系统是否记录 atime
+        先删除超过保留天数的，再按最近使用时间从旧到新删除，直到总大小不超过上限
+        写入磁盘缓存时，每个进程最多每 PRUNE_INTERVAL 秒在后台线程中清理一次
+'''
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import background_tasks
+
+# 两次后台清理之间的最短间隔（秒）
+PRUNE_INTERVAL = 3600
+
+
+class Icon_Render_Cache:
+    '''
+    内存 LRU + 磁盘的两级缓存
+    args:
+        folder: 磁盘缓存的文件夹，为空时只使用内存缓存
+        max_entries: 内存中最多保存的渲染结果数量，0 表示不使用内存缓存
+        max_bytes: 磁盘缓存的大小上限，0 表示不限制
+        max_age: 磁盘缓存最长保留的秒数（按最近使用时间），0 表示不限制
+    '''
+
+    def __init__(self, folder=None, max_entries=512, max_bytes=0, max_age=0):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned_at = None  # 第一次写入磁盘时清理一次
+
+    @staticmethod
+    def make_key(icon_file, fill_color, width, height, dpi):
+        '''
+        icon_file 为图标文件的完整路径，文件不存在时 mtime 为 0
+        '''
+        try:
+            mtime = os.stat(icon_file).st_mtime_ns
+        except OSError:
+            mtime = 0
+        raw = f'{os.path.abspath(icon_file)}|{mtime}|{fill_color}|{width}|{height}|{dpi}'
+        return hashlib.sha1(raw.encode('utf8')).hexdigest()
+
+    def _get_file_paths(self, key):
+        folder = os.path.join(self.folder, key[:2])
+        return os.path.join(folder, f'{key}.svg'), os.path.join(folder, f'{key}.png')
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        '''
+        返回 (svg_bytes, png_bytes)，不存在时返回 None
+        '''
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+
+        if not self.folder:
+            return None
+        svg_path, png_path = self._get_file_paths(key)
+        try:
+            with open(svg_path, 'rb') as f:
+                svg = f.read()
+            with open(png_path, 'rb') as f:
+                png = f.read()
+        except OSError:
+            return None
+
+        # 记录最近使用时间，清理时保留常用的图标
+        try:
+            os.utime(png_path)
+        except OSError:
+            pass
+        self._remember(key, (svg, png))
+        return svg, png
+
+    def _write_file(self, path, data):
+        # 先写临时文件再替换，避免其他进程读到写了一半的文件
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, key, svg, png):
+        self._remember(key, (svg, png))
+        if not self.folder:
+            return
+
+        svg_path, png_path = self._get_file_paths(key)
+        try:
+            os.makedirs(os.path.dirname(svg_path), exist_ok=True)
+            # 先写 svg，get 时两个文件都存在才算命中
+            self._write_file(svg_path, svg)
+            self._write_file(png_path, png)
+        except OSError:
+            # 磁盘缓存写入失败不影响生成
+            return
+        self._schedule_prune()
+
+    def _schedule_prune(self):
+        if not self.max_bytes and not self.max_age:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._pruned_at is not None and now - self._pruned_at < PRUNE_INTERVAL:
+                return
+            self._pruned_at = now
+        background_tasks.submit(self.prune)
+
+    def prune(self):
+        '''
+        按 max_age 和 max_bytes 清理磁盘缓存，一个渲染结果的 svg、png（以及写了一半的临时文件）一起删除
+        返回 {'removed': 删除的渲染结果数量, 'bytes': 剩余的总大小}
+        '''
+        if not self.folder or not os.path.isdir(self.folder):
+            return {'removed': 0, 'bytes': 0}
+
+        # key -> [最近使用时间, 大小, 文件列表]，只处理 key 前两位的子文件夹，usage.json 等文件不在其中
+        entries = {}
+        for sub_folder in os.scandir(self.folder):
+            if not sub_folder.is_dir():
+                continue
+            for file in os.scandir(sub_folder.path):
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                entry = entries.setdefault(file.name.split('.', 1)[0], [0, 0, []])
+                entry[0] = max(entry[0], stat.st_atime, stat.st_mtime)
+                entry[1] += stat.st_size
+                entry[2].append(file.path)
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries.values())
+        removed = 0
+        for used_at, size, paths in sorted(entries.values(), key=lambda entry: entry[0]):
+            expired = self.max_age and now - used_at > self.max_age
+            if not expired and (not self.max_bytes or total <= self.max_bytes):
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+        return {'removed': removed, 'bytes': total}
+
+    def clear(self):
+        '''
+        清空内存缓存，磁盘缓存可以直接删除文件夹，或者通过 prune 清理
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 进程内共享的图标缓存
+icon_render_cache = Icon_Render_Cache(
+    settings.ICON_CACHE_DIR, settings.ICON_CACHE_ENTRIES,
+    max_bytes=settings.ICON_CACHE_MAX_MB * 1024 * 1024, max_age=settings.ICON_CACHE_MAX_AGE_DAYS * 24 * 3600,
+)
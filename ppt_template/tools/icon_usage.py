@@ -0,0 +1,94 @@
+'''
+图标的使用次数
+    Icons_Handler 渲染图标时记录每个图标被使用的次数，预热模板的图标时优先渲染最常用的图标
+    次数保存在 ICON_CACHE_DIR/usage.json 中，多个进程共用：保存时读取文件中的次数，再加上本进程新增的次数
+    统计只用于选择预热的图标，多个进程同时保存时可能丢失少量次数
+'''
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+
+class Icon_Usage:
+    '''
+    args:
+        file_path: 保存次数的文件，为空时只统计在内存中
+        save_interval: 两次保存之间的最短间隔（秒）
+    '''
+
+    def __init__(self, file_path=None, save_interval=30):
+        self.file_path = file_path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._counts = None  # 第一次使用时从文件读取
+        self._pending = Counter()  # 上次保存后新增的次数
+        self._saved_at = None  # 第一次记录时立即保存
+
+    def _read_file(self):
+        if not self.file_path:
+            return Counter()
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                return Counter(json.load(f))
+        except (OSError, ValueError):
+            return Counter()
+
+    def _load(self):
+        if self._counts is None:
+            self._counts = self._read_file()
+        return self._counts
+
+    def record(self, icon_paths):
+        '''
+        记录一批图标各使用了一次，距离上次保存超过 save_interval 时保存
+        '''
+        with self._lock:
+            counts = self._load()
+            for icon_path in icon_paths:
+                counts[icon_path] += 1
+                self._pending[icon_path] += 1
+            if self._saved_at is not None and time.monotonic() - self._saved_at < self.save_interval:
+                return
+        self.save()
+
+    def most_common(self, n):
+        '''
+        返回使用次数最多的 n 个图标路径
+        '''
+        with self._lock:
+            return [icon_path for icon_path, _ in self._load().most_common(n)]
+
+    def save(self):
+        with self._lock:
+            self._saved_at = time.monotonic()
+            if not self.file_path or not self._pending:
+                return
+
+            # 合并其他进程保存的次数
+            counts = self._read_file()
+            counts.update(self._pending)
+            self._pending.clear()
+            self._counts = counts
+
+            try:
+                os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+                tmp_path = f'{self.file_path}.{uuid.uuid4().hex}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(counts, f, ensure_ascii=False)
+                os.replace(tmp_path, self.file_path)
+            except OSError:
+                # 统计写入失败不影响生成
+                pass
+
+
+# 进程内共享的图标使用次数
+icon_usage = Icon_Usage(os.path.join(settings.ICON_CACHE_DIR, 'usage.json') if settings.ICON_CACHE_DIR else None)
+# 进程退出时保存还没有保存的次数
+atexit.register(icon_usage.save)
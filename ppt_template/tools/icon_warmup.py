@@ -0,0 +1,102 @@
+'''
+模板图标的预热
+    生成时图标的颜色由 Color_Parser.get_fore_color_rgb_hex 根据 shape 的填充计算，尺寸为 icon placeholder 的大小，
+    所以一个模板只会用到少数几种颜色和尺寸
+    上传模板后在后台收集模板中 icon placeholder 的颜色和尺寸，把最常用的图标（见 icon_usage）提前渲染到缓存中，
+    新模板第一次生成时不需要再渲染这些图标
+    容器中的组件会按布局缩放，缩放后的尺寸无法提前知道，只预热组件原来的尺寸
+'''
+
+import logging
+from collections import Counter
+
+from django.conf import settings
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+from . import background_tasks
+from .icon_usage import icon_usage
+from .icons_handle import Icons_Handler
+from .placeholder_grammar import parse_placeholder
+from .ppt_color_parse import Color_Parser
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_shapes(shapes, ratio=1):
+    '''
+    展开 group，返回 (shape, 累计缩放比例)，与 Shape_Walker 的计算相同
+    '''
+    for shape in shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            xfrm = shape.element.grpSpPr.xfrm
+            yield from _iter_shapes(shape.shapes, ratio * int(xfrm.ext.cx) / int(xfrm.chExt.cx))
+        else:
+            yield shape, ratio
+
+
+def collect_icon_specs(template_path):
+    '''
+    收集模板中 icon placeholder 的颜色和尺寸，计算方法与 PPt_Generator._collect_icon_task 相同
+    返回 [((color, width, height), 数量), ...]，按数量从多到少排列
+    '''
+    prs = Presentation(template_path)
+    color_parser = Color_Parser(prs)
+
+    specs = Counter()
+    for slide in prs.slides:
+        for shape, ratio in _iter_shapes(slide.shapes):
+            if not getattr(shape, 'has_text_frame', False) or shape.width is None:
+                continue
+            parsed = parse_placeholder(shape.text_frame.text)
+            if parsed is None or parsed['type'] != 'icon':
+                continue
+
+            color = color_parser.get_fore_color_rgb_hex(shape)
+            specs[(color, int(shape.width.pt * ratio), int(shape.height.pt * ratio))] += 1
+    return specs.most_common()
+
+
+def warmup_template_icons(template_path, icons_handler=None, max_icons=None):
+    '''
+    把最常用的 max_icons 个图标按模板中每种颜色和尺寸渲染到缓存中
+    args:
+        icons_handler: 为 None 时使用进程内共享的 Icons_Handler
+        max_icons: 为 None 时使用 settings.ICON_WARMUP_ICONS
+    返回预热的图标数量（包括已经在缓存中的），还没有使用记录时不预热
+    '''
+    if max_icons is None:
+        max_icons = settings.ICON_WARMUP_ICONS
+    icon_paths = icon_usage.most_common(max_icons)
+    if not icon_paths:
+        return 0
+
+    specs = collect_icon_specs(template_path)
+    if not specs:
+        return 0
+
+    icons = [
+        (icon_path, color, width, height, 96)
+        for (color, width, height), _ in specs
+        for icon_path in icon_paths
+    ]
+    icons_handler = icons_handler or Icons_Handler.shared()
+    # 预热不算作图标的使用
+    icons_handler.render_icons(icons, record_usage=False)
+    return len(icons)
+
+
+def _warmup(template_path):
+    count = warmup_template_icons(template_path)
+    if count:
+        logger.info(f'预热模板图标 {template_path}：{count} 个')
+
+
+def schedule_warmup(template_path):
+    '''
+    在后台任务中预热模板的图标，渲染本身由 Icons_Handler 的进程池完成
+    settings.ICON_WARMUP 为 False 时不预热，返回 Future，不预热时返回 None
+    '''
+    if not settings.ICON_WARMUP:
+        return None
+    return background_tasks.submit(_warmup, template_path)
@@ -1,47 +1,65 @@
 import os
 from knowledge_base.tools import chroma_driver
-import json
 import random
-from cairosvg import svg2png
-import os
-from lxml import etree
-import re
+import threading
+from django.conf import settings
+
+from . import icon_render, icon_catalog
+from .icon_render_cache import icon_render_cache
+from .icon_usage import icon_usage
 
 class Icons_Handler:
 
-    def __init__(self, icon_folder='icons'):
+    # 图标渲染结果的缓存和渲染图标的进程池，进程内共享
+    render_cache = icon_render_cache
+    render_pool = icon_render.Icon_Render_Pool(settings.ICON_RENDER_WORKERS)
+    # 图标的使用次数，预热模板图标时使用
+    usage = icon_usage
+
+    # 查询文本 -> 最相似的图标 [(distance, path), ...]，进程内共享，图标库更新后清空
+    _query_cache = {}
+    _query_lock = threading.Lock()
+
+    # 图标文件夹 -> 进程内共享的 Icons_Handler，见 shared
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, icon_folder='icons', seed=None):
+        '''
+        seed: 从候选图标中随机选择时使用的随机数种子，为 None 时使用 settings.ICON_RANDOM_SEED
+        '''
         self.icon_folder = icon_folder
+        self.random = random.Random(settings.ICON_RANDOM_SEED if seed is None else seed)
         self.chroma_driver = chroma_driver.Chroma_Driver(collection_name='system_icons')
         self.mantain_info_json()
 
     def mantain_info_json(self):
-        
-        # 检查 info.json 是否存在
-        info_json_path = os.path.join(self.icon_folder, 'info.json')
-        if os.path.exists(info_json_path):
-            with open(info_json_path, 'r') as f:
-                info_json = json.load(f)
-        else:
-            info_json = {'icons': []}
-
-        
-        # 检查 icons 文件夹下的图标是否在 info.json 中
-        new_icons = []
-        for root, dirs, files in os.walk(self.icon_folder):
-            for file in files:
-                if file.endswith('.svg'):
-                    # 获取图标从 icon_folder 起的相对路径
-                    icon_path = os.path.relpath(os.path.join(root, file), self.icon_folder)
-                    # 检查图标是否在 info.json 中
-                    if icon_path not in info_json['icons']:
-                        info_json['icons'].append(icon_path)
-                        new_icons.append(icon_path)
-        
-        # 插入新图标到 Chroma 数据库
-        if new_icons:
-            with open(info_json_path, 'w') as f:
-                json.dump(info_json, f, indent=4, ensure_ascii=False)
-            self.chroma_driver.insert(documents=new_icons, metadatas=[{'path': i} for i in new_icons])
+        '''
+        同步图标库的索引，每个进程只同步一次，见 Icon_Catalog
+        '''
+        summary = icon_catalog.sync_once(self.icon_folder, self.chroma_driver)
+        if summary and summary['added'] + summary['changed'] + summary['removed'] > 0:
+            self.clear_query_cache()
+
+    @classmethod
+    def shared(cls, icon_folder='icons'):
+        '''
+        进程内共享的 Icons_Handler，第一次使用时创建（连接 chroma、同步图标库）
+        各个 generator 共用，从候选图标中随机选择时通过 find_icons 的 rng 使用自己的随机数
+        '''
+        handler = cls._shared.get(icon_folder)
+        if handler is not None:
+            return handler
+
+        with cls._shared_lock:
+            if icon_folder not in cls._shared:
+                cls._shared[icon_folder] = cls(icon_folder)
+            return cls._shared[icon_folder]
+
+    @classmethod
+    def clear_query_cache(cls):
+        with cls._query_lock:
+            cls._query_cache.clear()
 
 
     def find_icon(self, query: str, threshold: float = 0.55):
@@ -50,27 +68,65 @@ class Icons_Handler:
 
         Args:
             query: 查询文本
-            n_results: 返回结果数量，默认为 5
+            threshold: 距离阈值，最相似的图标超过阈值时返回 None
 
         Returns:
             查找结果
         """
-        result = self.chroma_driver.query(query_text=query, n_results=5)
-        min_distance = result['distances'][0]
-        if min_distance > threshold:
-            return None
-        else:
-            max_distance = min(min_distance+0.05, threshold)
+        return self.find_icons([query], threshold)[0]
 
-            icons_candidate = []
-            for i in range(5):
-                if result['distances'][i] < max_distance:
-                    icons_candidate.append(result['metadatas'][i]['path'])
+    def _query_icons(self, queries):
+        """
+        查询每个文本最相似的 5 个图标，没有查询过的文本在一次 chroma 查询中完成
+
+        Returns:
+            查询文本 -> [(distance, path), ...]
+        """
+        with self._query_lock:
+            found = {q: self._query_cache[q] for q in queries if q in self._query_cache}
+        missing = list(dict.fromkeys(q for q in queries if q not in found))
+
+        if missing:
+            results = self.chroma_driver.query_many(query_texts=missing, n_results=5)
+            with self._query_lock:
+                for query, result in zip(missing, results):
+                    candidates = [
+                        (distance, metadata['path'])
+                        for distance, metadata in zip(result['distances'], result['metadatas'])
+                    ]
+                    self._query_cache[query] = candidates
+                    found[query] = candidates
+        return found
+
+    def find_icons(self, queries, threshold: float = 0.55, rng=None):
+        """
+        批量查找图标，与 find_icon 的规则相同
 
+        Args:
+            queries: 查询文本列表
+            threshold: 距离阈值
+            rng: 从候选图标中随机选择时使用的 random.Random，为 None 时使用 self.random
+
+        Returns:
+            与 queries 顺序一致的图标路径列表，找不到时为 None
+        """
+        rng = rng or self.random
+        query_result = self._query_icons(queries)
+
+        icon_paths = []
+        for query in queries:
+            candidates = query_result[query]
+            if not candidates or candidates[0][0] > threshold:
+                icon_paths.append(None)
+                continue
+
+            min_distance = candidates[0][0]
+            max_distance = min(min_distance+0.05, threshold)
+            icons_candidate = [path for distance, path in candidates if distance < max_distance]
 
             # 从 icons_candidate 中随机选择一个图标
-            icon_path = random.choice(icons_candidate)
-            return icon_path
+            icon_paths.append(rng.choice(icons_candidate or [candidates[0][1]]))
+        return icon_paths
 
 
     def get_icon_content(self, icon_path: str):
@@ -95,116 +151,79 @@ class Icons_Handler:
             return icon_content
 
     
-    # svg 转 png
+    # svg 转 png，具体实现在 icon_render 中，子进程中也可以使用
     def _get_svg_dimensions(self, svg_content):
         """从SVG文件中提取宽度和高度"""
-            
-        width_match = re.search(r'width\s*=\s*"([^"]+)"', svg_content)
-        height_match = re.search(r'height\s*=\s*"([^"]+)"', svg_content)
-        
-        if not width_match or not height_match:
-            viewBox_match = re.search(r'viewBox\s*=\s*"([^"]+)"', svg_content)
-            if viewBox_match:
-                viewBox = viewBox_match.group(1).split()
-                if len(viewBox) == 4:
-                    return float(viewBox[2]), float(viewBox[3])
-            raise ValueError("无法从SVG中提取尺寸信息")
-        
-        width = float(re.sub(r'[^\d.]', '', width_match.group(1)))
-        height = float(re.sub(r'[^\d.]', '', height_match.group(1)))
-        
-        return width, height
+        return icon_render.get_svg_dimensions(svg_content)
 
     def _add_chinese_fonts(self, svg_xml):
-        """
-        在所有font-family属性后添加中文字体
-        在分号前增加: ,"PingFang SC", "Microsoft YaHei", "WenQuanYi Micro Hei"
-        """
-        # 需要添加的中文字体
-        chinese_fonts = ['"PingFang SC"', '"Microsoft YaHei"', '"WenQuanYi Micro Hei"']
-        
-        # 查找所有font-family属性
-        for elem in svg_xml.xpath('//@font-family'):
-            # 获取原来的字体
-            fonts = elem.value.split(';')[0]
-            for font in chinese_fonts:
-                if font in fonts:
-                    continue
-            else:
-                # 在分号前添加中文字体
-                fonts = f"{elem.value}, {font}"
-
-            elem.value = fonts
-
-        return svg_xml
+        return icon_render.add_chinese_fonts(svg_xml)
 
     def _change_svg_fill(self, svg_xml, fill_color):
-        """
-        改变SVG的fill颜色，目前支持 6 位 16 进制颜色
-        """
-
-        if fill_color == None: return svg_xml
-        
-        if len(fill_color) == 6:
-            fill_color = '#' + fill_color
-
-        for elem in svg_xml.xpath('//*[@fill]'):
-            elem.set('fill', fill_color)
-
-        # 给 svg 增加 fill
-        ns = {'svg': 'http://www.w3.org/2000/svg'}
-        svg_xml.xpath('//svg:svg', namespaces=ns)[0].set('fill', fill_color)
-
-        return svg_xml
+        return icon_render.change_svg_fill(svg_xml, fill_color)
 
     def modify_svg(self, svg_content, svg_path, fill_color):
+        '''
+        svg_path 为 None 时不保存修改后的 svg
+        '''
+        modified_svg = icon_render.modify_svg(svg_content, fill_color)
+        if svg_path is not None:
+            with open(svg_path, 'wb') as f:
+                f.write(modified_svg)
 
-        # 读取并修改SVG内容，添加中文字体
-        svg_xml = etree.fromstring(svg_content.encode('utf-8'))
-        
-        # 添加中文字体
-        svg_xml = self._add_chinese_fonts(svg_xml)
-        # 改变fill颜色
-        svg_xml = self._change_svg_fill(svg_xml, fill_color)
-
-        modified_svg = etree.tostring(svg_xml, encoding='utf-8')
-        with open(svg_path, 'wb') as f:
-            f.write(modified_svg)
-        
         return modified_svg.decode('utf-8')
 
+    def svg_to_png(self, svg_content, png_path, width=None, height=None, dpi=96):
+        """
+        转换SVG为PNG，自动添加中文字体支持
+        png_path 为 None 时返回 png 的内容
+        """
+        return icon_render.svg_to_png(svg_content, png_path, width, height, dpi)
 
+    def render_icon(self, icon_path, fill_color, width, height, dpi=96):
+        """
+        渲染指定颜色、尺寸的图标，同样的图标、颜色和尺寸只渲染一次
 
+        Returns:
+            (修改颜色后的 svg, png) 的 bytes
+        """
+        return self.render_icons([(icon_path, fill_color, width, height, dpi)])[0]
 
-    def svg_to_png(self, svg_content, png_path, width=None, height=None, dpi=96):
+    def render_icons(self, icons, record_usage=True):
         """
-        转换SVG为PNG，自动添加中文字体支持
+        批量渲染图标，缓存中没有的图标交给进程池并行渲染
+
+        Args:
+            icons: [(icon_path, fill_color, width, height, dpi), ...]
+            record_usage: 是否记录图标的使用次数，预热时为 False
+
+        Returns:
+            与 icons 顺序一致的 [(svg, png), ...]
         """
+        if record_usage:
+            self.usage.record(icon[0] for icon in icons)
+
+        results = [None] * len(icons)
+        # 缓存 key -> 需要这个结果的位置，相同的图标只渲染一次
+        missing = {}
+        for i, (icon_path, fill_color, width, height, dpi) in enumerate(icons):
+            icon_file = os.path.join(self.icon_folder, icon_path)
+            key = self.render_cache.make_key(icon_file, fill_color, width, height, dpi)
+            cached = self.render_cache.get(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                missing.setdefault(key, []).append(i)
 
-        # 获取SVG原始尺寸
-        orig_width, orig_height = self._get_svg_dimensions(svg_content)
-        
-        # 计算输出尺寸
-        if width and not height:
-            scale = width / orig_width
-            height = orig_height * scale
-        elif height and not width:
-            scale = height / orig_height
-            width = orig_width * scale
-        elif not width and not height:
-            width, height = orig_width, orig_height
-        
-        # 执行转换
-        svg2png(
-            bytestring=svg_content.encode('utf-8'),
-            write_to=png_path,
-            dpi=dpi,
-            parent_width=orig_width,
-            parent_height=orig_height,
-            output_width=int(width),
-            output_height=int(height)
-        )
-        
-            
+        if missing:
+            jobs = []
+            for indexes in missing.values():
+                icon_path, fill_color, width, height, dpi = icons[indexes[0]]
+                jobs.append((self.get_icon_content(icon_path), fill_color, width, height, dpi))
 
-    
+            for (key, indexes), (svg, png) in zip(missing.items(), self.render_pool.render(jobs)):
+                self.render_cache.put(key, svg, png)
+                for i in indexes:
+                    results[i] = (svg, png)
+
+        return results
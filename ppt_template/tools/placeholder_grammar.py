@@ -0,0 +1,192 @@
+'''
+模板中 placeholder 的语法，Template_Parser、template_compile 和 PPt_Generator 共用
+    @type-name(style)：notes
+        type: img、svg、container、icon，没有或者是其他前缀时为 text，其他前缀保留在 name 中
+        (style) 和 ：notes 都可能不存在，括号和冒号支持中英文
+    #name 为组件
+'''
+
+import re
+from functools import lru_cache
+
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+# 已知的 placeholder 类型前缀
+TYPE_PREFIXES = (
+    ('img-', 'img'),
+    ('svg-', 'svg'),
+    ('container-', 'container'),
+    ('icon-', 'icon'),
+)
+
+# name(style)：notes
+PLACEHOLDER_PATTERN = re.compile(
+    r'^(?P<name>[^(:：\(\)（）\n]+)'
+    r'(?:[(（](?P<style>[^()（）]*?)[)）])?'
+    r'(?:[:：](?P<notes>.*))?$'
+)
+
+# 替换后的 icon：@icon-name
+ICON_PATTERN = re.compile(r'^@icon-(.*)')
+
+# 待生成的图片：@img-uid，生成失败的图片带 -g 后缀
+IMG_PATTERN = re.compile(r'@img-(.+?)(-g)?$')
+
+
+@lru_cache(maxsize=4096)
+def _parse_placeholder(text):
+    if not text.startswith('@'):
+        return None
+
+    text = text[1:]
+    p_type = 'text'
+    for prefix, t in TYPE_PREFIXES:
+        if text.startswith(prefix):
+            p_type = t
+            text = text[len(prefix):]
+            break
+
+    match = PLACEHOLDER_PATTERN.match(text)
+    if not match:
+        return None
+    return (p_type, match.group('name'), match.group('style'), match.group('notes'))
+
+
+def parse_placeholder(text):
+    '''
+    解析 shape 中的文字，不是 placeholder 时返回 None
+    返回 dict，key 包括 type、name、style、notes，style 和 notes 不存在时为 None
+    同样的文字只解析一次，每次返回新的 dict，调用方可以修改
+    '''
+    parsed = _parse_placeholder(text)
+    if parsed is None:
+        return None
+    p_type, name, style, notes = parsed
+    return {'type': p_type, 'name': name, 'style': style, 'notes': notes}
+
+
+@lru_cache(maxsize=1024)
+def _parse_style(style_str):
+    style_list = []
+    for style in style_str.split(' '):
+        if '-' in style:
+            key, value = style.split('-', 1)
+            style_list.append((key, value))
+        else:
+            style_list.append((style, ''))
+    return tuple(style_list)
+
+
+def parse_style(style_str):
+    '''
+    解析 style_str，如 direction-l-r gap-160000，返回一个 dict
+    '''
+    return dict(_parse_style(style_str))
+
+
+def get_shape_placeholders(shape, components=()):
+    '''
+    从 shape 中提取 placeholder，group 中的 placeholder 依次展开
+    shape 是组件的名称（# 开头）时返回 'component'，上层的 group 跳过
+    args:
+        components: 已经提取的组件，container 的 component_placeholders 从中获取
+    '''
+    placeholder_list = []
+    if shape.has_text_frame:
+        text = shape.text_frame.text
+
+        if text.startswith('#'):
+            return 'component'
+
+        parsed = parse_placeholder(text)
+        if parsed:
+
+            data = dict(name=parsed['name'], type=parsed['type'])
+            if parsed['style'] != None:
+                data['style'] = parsed['style']
+            if parsed['notes'] != None:
+                data['description'] = parsed['notes']
+
+            # 对 container 获取 component_placeholders min_component_number max_component_number
+            if data['type'] == 'container':
+                component = [c for c in components if c['name'] == data['name']]
+                if component != []:
+                    data['component_placeholders'] = component[0]['placeholders']
+
+                style_dict = parse_style(data['style'])
+                data['min_component_number'] = int(style_dict['min_n']) if 'min_n' in style_dict else 1
+                data['max_component_number'] = int(style_dict['max_n']) if 'max_n' in style_dict else 5
+
+            placeholder_list.append(data)
+    elif shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+        for sub_shape in shape.shapes:
+            sub_pl = get_shape_placeholders(sub_shape, components)
+            if sub_pl != 'component' and sub_pl != []: placeholder_list.extend(sub_pl)
+
+    return placeholder_list
+
+
+def sort_placeholders(placeholder_list):
+    '''
+    对 placeholder 进行排序，按照 name 排序
+    '''
+    return sorted(placeholder_list, key=lambda x: x['name'])
+
+
+def find_component(shape):
+    '''
+    组件是只有两个元素的 group：一个是 # 开头的 text（组件名称），另一个是 group、text 或其他（组件本身）
+    是组件时返回 (组件名称, 组件 shape, 组件在 group 中的位置)，否则返回 None
+    '''
+    if shape.shape_type != MSO_SHAPE_TYPE.GROUP or len(shape.shapes) != 2:
+        return None
+
+    sub_shapes = list(shape.shapes)
+    for name_i, child_i in ((0, 1), (1, 0)):
+        name_shape = sub_shapes[name_i]
+        if name_shape.has_text_frame and name_shape.text.startswith('#'):
+            if name_shape.text == '#':
+                return None
+            return name_shape.text[1:], sub_shapes[child_i], child_i
+    return None
+
+
+if __name__ == '__main__':
+    # 单个 shape 的解析耗时：每次编译正则、re 模块缓存的编译、预编译、预编译 + 解析结果缓存
+    import timeit
+
+    texts = [
+        '@标题',
+        '@img-配图(max_n-3)：和标题相关的插图',
+        '@container-并列样式1(direction-l-r min_n-2 max_n-4 gap-160000)：并列的要点',
+        '@icon-图标：与要点相关的图标',
+        '@正文：100 字以内的说明',
+    ]
+
+    def parse_recompiled():
+        for text in texts:
+            # 清空 re 模块的缓存，每次都重新编译
+            re.purge()
+            re.compile(PLACEHOLDER_PATTERN.pattern).match(text[1:])
+
+    def parse_re_cached():
+        for text in texts:
+            re.compile(PLACEHOLDER_PATTERN.pattern).match(text[1:])
+
+    def parse_precompiled():
+        for text in texts:
+            PLACEHOLDER_PATTERN.match(text[1:])
+
+    def parse_cached():
+        for text in texts:
+            parse_placeholder(text)
+
+    number = 2000
+    for name, func in [
+        ('每次编译', parse_recompiled),
+        ('re 模块缓存的编译', parse_re_cached),
+        ('预编译', parse_precompiled),
+        ('预编译 + 解析结果缓存', parse_cached),
+    ]:
+        cost = timeit.timeit(func, number=number)
+        print(f'{name}: {cost / number / len(texts) * 1e6:.3f} us / shape')
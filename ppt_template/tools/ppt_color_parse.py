@@ -1,3 +1,7 @@
+import threading
+import weakref
+from functools import lru_cache
+
 from pptx import Presentation
 from pptx.opc.constants import RELATIONSHIP_TYPE as RT
 from pptx.oxml import parse_xml
@@ -117,11 +121,33 @@ def hsl_to_rgb(h, s, l):
     
     return (r, g, b)
 
+@lru_cache(maxsize=1024)
+def _adjust_brightness(rgb_hex, bright):
+    '''
+    rgb 颜色按 brightness 调整明度，返回 16 进制的颜色
+    '''
+    r, g, b = int(rgb_hex[0:2], 16), int(rgb_hex[2:4], 16), int(rgb_hex[4:6], 16)
+    h, s, l = rgb_to_hsl(r, g, b)
+    r, g, b = hsl_to_rgb(h, s, l + bright)
+    return f'{r:02x}{g:02x}{b:02x}'.upper()
+
+
 class Color_Parser:
+    '''
+    解析主题颜色，计算 shape 的填充颜色
+    主题色板在初始化时计算；每个页面对应的主题和颜色映射在第一次使用时解析并缓存，
+    同一个页面上的 shape 不再重复查找母版、主题和执行 xpath
+    '''
 
-    def __init__(self, prs: Presentation):
+    def __init__(self, prs: Presentation, color_scheme=None):
+        '''
+        color_scheme: 预编译模板中保存的色板，为 None 时从主题中计算
+        '''
         self.prs = prs
-        self.color_scheme = self._get_theme_colors()
+        self.color_scheme = color_scheme if color_scheme is not None else self._get_theme_colors()
+        # SlidePart -> (主题名称, 颜色映射)，页面删除后自动释放
+        self._slide_cache = weakref.WeakKeyDictionary()
+        self._slide_cache_lock = threading.Lock()
 
     
     def _get_theme_colors(self):
@@ -173,9 +199,24 @@ class Color_Parser:
         return color_scheme
 
     
-    def _get_mapped_color_name(self, slide, color_name):
+    def _get_slide_colors(self, slide_part):
+        '''
+        返回页面对应的 (主题名称, 颜色映射)，颜色映射为 dict，如 {'bg1': 'lt1', 'tx1': 'dk1', ...}
+        '''
+        with self._slide_cache_lock:
+            cached = self._slide_cache.get(slide_part)
+        if cached is not None:
+            return cached
+
+        slide_layout = slide_part.slide_layout
+        theme_name = str(slide_layout.slide_master.part.part_related_by(RT.THEME).partname)
+        cached = (theme_name, self._get_color_map(slide_layout))
+        with self._slide_cache_lock:
+            self._slide_cache[slide_part] = cached
+        return cached
+
+    def _get_color_map(self, slide_layout):
         
-        slide_layout = slide.slide_layout
         # 有重写
         '''
         <p:clrMapOvr>
@@ -190,8 +231,7 @@ class Color_Parser:
         </p:clrMapOvr>
         '''
         if layout_clrMap := slide_layout._element.xpath('//a:overrideClrMapping'):
-            layout_clrMap = layout_clrMap[0]
-            return layout_clrMap.xpath(f'./@{color_name}')[0]
+            return dict(layout_clrMap[0].attrib)
 
         # 以母版的映射为准
         '''
@@ -200,7 +240,14 @@ class Color_Parser:
         '''
         slide_master = slide_layout.slide_master
         master_clrMap = slide_master._element.xpath('//p:clrMap')[0]
-        return master_clrMap.xpath(f'./@{color_name}')[0]
+        return dict(master_clrMap.attrib)
+
+    def _get_mapped_color_name(self, slide, color_name):
+        '''
+        slide 为 SlidePart，返回主题颜色映射后的名称
+        '''
+        _, color_map = self._get_slide_colors(slide)
+        return color_map[color_name]
 
             
     def get_fore_color_rgb_hex(self, shape):
@@ -214,8 +261,7 @@ class Color_Parser:
         if fill_type == None:
             # 尝试通过 fillRef 获取主题颜色
             theme_color = shape._element.xpath('//a:fillRef/a:schemeClr/@val')
-            part=shape.part
-            theme_name = str(part.slide_layout.slide_master.part.part_related_by(RT.THEME).partname)
+            theme_name, _ = self._get_slide_colors(shape.part)
             if theme_color:
                 color_name = theme_color[0]
                 bright = 0
@@ -230,10 +276,7 @@ class Color_Parser:
                 rgb_hex = fore_color.rgb
                 bright = fore_color.brightness
                 if bright != 0:
-                    r, g, b = int(rgb_hex[0:2], 16), int(rgb_hex[2:4], 16), int(rgb_hex[4:6], 16)
-                    h, s, l = rgb_to_hsl(r, g, b)
-                    r, g, b = hsl_to_rgb(h, s, l + bright)
-                    rgb_hex = f'{r:02x}{g:02x}{b:02x}'.upper()
+                    rgb_hex = _adjust_brightness(str(rgb_hex), bright)
                 else:
                     rgb_hex = str(rgb_hex)
                 return rgb_hex
@@ -246,9 +289,9 @@ class Color_Parser:
                 while part := shape.part:
                     if isinstance(part, SlidePart):
                         break
-                theme_name = str(part.slide_layout.slide_master.part.part_related_by(RT.THEME).partname)
+                theme_name, color_map = self._get_slide_colors(part)
                 color_scheme = self.color_scheme[theme_name]
-                mapped_color_name = self._get_mapped_color_name(part, color_name)
+                mapped_color_name = color_map[color_name]
                 # 如果 mapped_color_name 包含 bg 或 lt
                 if 'bg' in mapped_color_name or 'lt' in mapped_color_name:
                     bright = -bright
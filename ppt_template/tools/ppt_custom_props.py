@@ -0,0 +1,78 @@
+'''
+读写 pptx 的自定义属性（docProps/custom.xml）
+python-pptx 不支持自定义属性，这里直接处理 xml，属性值都保存为字符串
+PowerPoint 另存时会保留自定义属性，但界面中只能编辑 255 个字符以内的值，所以每个属性的值都要尽量短
+'''
+
+from lxml import etree
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.opc.package import Part
+from pptx.opc.packuri import PackURI
+
+CUSTOM_PROPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/custom-properties'
+VT_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes'
+# 自定义属性固定的 fmtid
+CUSTOM_PROPS_FMTID = '{D5CDD505-2E9C-101B-9397-08002B2CF9AE}'
+
+_nsmap = {None: CUSTOM_PROPS_NS, 'vt': VT_NS}
+
+
+def _get_part(prs):
+    package = prs.part.package
+    try:
+        return package.part_related_by(RT.CUSTOM_PROPERTIES)
+    except KeyError:
+        return None
+
+
+def read_custom_properties(prs, prefix=''):
+    '''
+    读取名称以 prefix 开头的自定义属性，返回 dict：名称 -> 字符串值
+    '''
+    part = _get_part(prs)
+    if part is None:
+        return {}
+
+    root = etree.fromstring(part.blob)
+    props = {}
+    for prop in root.iterfind(f'{{{CUSTOM_PROPS_NS}}}property'):
+        name = prop.get('name')
+        if name is None or not name.startswith(prefix):
+            continue
+        value = prop[0].text if len(prop) else None
+        props[name] = value or ''
+    return props
+
+
+def write_custom_properties(prs, props, prefix=''):
+    '''
+    用 props 替换名称以 prefix 开头的所有自定义属性，其他属性保留
+    '''
+    package = prs.part.package
+    part = _get_part(prs)
+    if part is None:
+        root = etree.Element(f'{{{CUSTOM_PROPS_NS}}}Properties', nsmap=_nsmap)
+    else:
+        root = etree.fromstring(part.blob)
+
+    for prop in list(root.iterfind(f'{{{CUSTOM_PROPS_NS}}}property')):
+        if prop.get('name', '').startswith(prefix):
+            root.remove(prop)
+
+    # pid 从 2 开始，不能重复
+    pids = [int(p.get('pid', 1)) for p in root.iterfind(f'{{{CUSTOM_PROPS_NS}}}property')]
+    pid = max(pids, default=1) + 1
+    for name, value in props.items():
+        prop = etree.SubElement(root, f'{{{CUSTOM_PROPS_NS}}}property')
+        prop.set('fmtid', CUSTOM_PROPS_FMTID)
+        prop.set('pid', str(pid))
+        prop.set('name', name)
+        etree.SubElement(prop, f'{{{VT_NS}}}lpwstr').text = str(value)
+        pid += 1
+
+    blob = etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+    if part is None:
+        part = Part(PackURI('/docProps/custom.xml'), CT.OFC_CUSTOM_PROPERTIES, package, blob)
+        package.relate_to(part, RT.CUSTOM_PROPERTIES)
+    else:
+        part._blob = blob
@@ -1,23 +1,27 @@
-from pydoc import text
 from pptx import Presentation
 from pptx.dml.color import RGBColor
 from pptx.slide import Slide
 from pptx.opc.package import Part
 from pptx.enum.shapes import MSO_SHAPE_TYPE
 from pptx.util import Emu
+from pptx.text.text import _Paragraph
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
 import os
 from lxml import etree
-import shutil
 import copy
 import tempfile
 import zipfile
 import uuid
+import hashlib
 import re
+import random
 from openai import AsyncOpenAI, BadRequestError
 import base64
 from PIL import Image
 import io
 import asyncio
+import functools
+import json
 
 from pptx.oxml.ns import _nsmap
 
@@ -25,8 +29,14 @@ _nsmap['p14'] = 'http://schemas.microsoft.com/office/powerpoint/2010/main'
 _nsmap['asvg'] = 'http://schemas.microsoft.com/office/drawing/2016/SVG/main'
 
 from ..models import PPt_Template
-from .ppt_color_parse import Color_Parser
 from .icons_handle import Icons_Handler
+from .template_cache import template_cache, Parsed_Template
+from . import template_compile
+from .slide_index import Slide_Index
+from .ppt_custom_props import read_custom_properties, write_custom_properties
+from .container_layout import calculate_positions, calculate_grid_positions
+from .placeholder_grammar import parse_placeholder, parse_style, ICON_PATTERN, IMG_PATTERN
+from .generate_profiler import profiled, profile_stage
 
 from django.conf import settings
 
@@ -38,8 +48,113 @@ file_dir = os.path.dirname(os.path.dirname(file_path))
 templates_dir = os.path.join(file_dir, 'templates')
 
 default_img_prompt = '简约插画风' # '请不要在图片中增加文字'
+
+# 增量生成时在 ppt 自定义属性中记录的信息：模板版本，以及每个页面的 slide_id 和指纹
+PAGE_PROP_PREFIX = 'PPtYoda.'
+TEMPLATE_PROP = 'PPtYoda.template'
+PAGE_PROP = 'PPtYoda.page.'
 default_svg_prompt = ''
 
+class Shape_Node:
+    '''
+    展开后的 shape 树中的一个节点
+        shape: python-pptx 中的 shape
+        shapes: shape 所在的 shapes，用于添加、删除 shape
+        ratio: 从 slide 到 shape 累计的 group 缩放比例
+        text: shape 中的文字，没有 text_frame 时为 None；handler 修改文字后需要同步更新
+        placeholders: 替换 placeholder 时使用的数据，组件中的 shape 为组件自己的数据
+        removed: shape 已经从树中删除，后续 handler 跳过
+        group_start / group_end: group 的开始、结束标记，用于记录和恢复 group 的位置和大小
+    '''
+    __slots__ = ('shape', 'shapes', 'ratio', 'text', 'placeholders', 'removed', 'group_start', 'group_end', 'geometry')
+
+    def __init__(self, shape, shapes, ratio=1, text=None, placeholders=None, group_start=False, group_end=None):
+        self.shape = shape
+        self.shapes = shapes
+        self.ratio = ratio
+        self.text = text
+        self.placeholders = placeholders
+        self.removed = False
+        self.group_start = group_start
+        self.group_end = group_end
+        self.geometry = None
+
+
+class Shape_Walker:
+    '''
+    把 slide 的 shape 树展开一次，group 的累计缩放比例只计算一次，每个 shape 的文字只读取一次
+    然后在一次遍历中依次调用所有 handler(node, walker)
+        handler 可以删除 node.shape（同时设置 node.removed），也可以通过 walker.insert 添加需要继续处理的 shape
+    往 group 中添加图片时 python-pptx 会重新计算 group 的大小，遍历完一个 group 后恢复为原来的位置和大小
+    '''
+
+    def __init__(self):
+        self._pending = []
+
+    @staticmethod
+    def get_group_scale(group_shape):
+        xfrm = group_shape.element.grpSpPr.xfrm
+        return int(xfrm.ext.cx) / int(xfrm.chExt.cx)
+
+    def walk(self, shapes, ratio=1, placeholders=None, nodes=None, parent=None):
+        '''
+        深度优先展开 shapes，返回 Shape_Node 列表
+        args:
+            parent: shapes 是部分 shape 的列表（如新添加的组件）时，传入它们所在的 shapes，用于添加、删除 shape
+        '''
+        if nodes is None: nodes = []
+        if parent is None: parent = shapes
+
+        for shape in shapes:
+            if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+                start = Shape_Node(shape, parent, ratio, group_start=True)
+                nodes.append(start)
+                self.walk(shape.shapes, ratio * self.get_group_scale(shape), placeholders, nodes)
+                nodes.append(Shape_Node(shape, parent, ratio, group_end=start))
+                continue
+
+            text = None
+            if hasattr(shape, 'has_text_frame') and shape.has_text_frame:
+                text = shape.text_frame.text
+            nodes.append(Shape_Node(shape, parent, ratio, text, placeholders))
+
+        return nodes
+
+    def visit(self, nodes, handlers):
+        '''
+        依次处理 nodes，nodes 可以是 walk 的结果，也可以是 shapes
+        '''
+        if not isinstance(nodes, list):
+            nodes = self.walk(nodes)
+
+        self._pending = nodes[::-1]
+        while self._pending:
+            node = self._pending.pop()
+
+            if node.group_start:
+                shape = node.shape
+                node.geometry = (shape.left, shape.top, shape.width, shape.height)
+                continue
+            if node.group_end is not None:
+                self._restore_group(node.shape, node.group_end.geometry)
+                continue
+
+            for handler in handlers:
+                if node.removed: break
+                handler(node, self)
+
+    def insert(self, nodes):
+        '''
+        添加的 shape 在当前 shape 之后立即处理
+        '''
+        self._pending.extend(reversed(nodes))
+
+    def _restore_group(self, shape, geometry):
+        if geometry is None: return
+        if (shape.left, shape.top, shape.width, shape.height) == geometry: return
+        shape.left, shape.top, shape.width, shape.height = geometry
+
+
 # 从路径模板新建 ppt
 class PPt_Generator:
     '''
@@ -47,155 +162,123 @@ class PPt_Generator:
     目前还添加了很多插入现有页面的功能，后续可能有用，或者分拆出来
     '''
 
-    def __init__(self, file_name: str, template: PPt_Template):
+    # 设置 namespace
+    ns = {
+        'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
+        'p14': 'http://schemas.microsoft.com/office/powerpoint/2010/main',
+        'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    }
 
-        # 设置 namespace
-        self.ns = {
-            'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
-            'p14': 'http://schemas.microsoft.com/office/powerpoint/2010/main',
-            'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
-            'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
-        }
+    def __init__(self, file_name: str, template: PPt_Template, reuse_file: str = None, profiler=None, icons_handler=None):
+        '''
+        args:
+            file_name: ppt 的保存路径，文件存在时直接打开
+            template: 模板
+            reuse_file: 增量生成时复用的 ppt（如上次生成的中间文件），
+                file_name 不存在且 reuse_file 是用同一个模板生成的时，在 reuse_file 的基础上生成
+            profiler: Generation_Profiler，为 None 时不统计耗时
+            icons_handler: 查找、渲染图标的 Icons_Handler，为 None 时使用进程内共享的 Icons_Handler
+        '''
+        self.profiler = profiler
 
-        # 处理 template
+        # 处理 template，解析结果从进程内缓存获取
         self.template = template
         self.template_path = template.file.path
-        self.temp_ppt = Presentation(self.template_path)
-        self.color_parser = Color_Parser(self.temp_ppt)
+        with profile_stage(profiler, 'load_template'):
+            parsed_template = template_cache.get(template, self._parse_template)
+        self.temp_ppt = parsed_template.temp_ppt
+        self.temp_slide_index = parsed_template.slide_index
+        self.color_parser = parsed_template.color_parser
+        self.template_image_hashes = parsed_template.image_hashes
 
         self.temp_dir = tempfile.TemporaryDirectory()
         self.file_name = file_name
 
 
-        if not os.path.exists(file_name):
-
-            # 复制模板到临时文件
-            tmp_file_name = os.path.join(self.temp_dir.name, 'temp.pptx')
-            shutil.copy(self.template_path, tmp_file_name)
-            # self.tmp_file_path = tmp_file_name
-            self.ppt = Presentation(tmp_file_name)
-            # 删除 ppt 中的所有页面
-            # for slide in self.ppt.slides:
-            #     self.ppt.slides.remove(slide)
-            # xml_slides = self.ppt.slides._sldIdLst
-            # for slide in xml_slides:
-            #     rId = slide.rId
-            #     self.ppt.part.drop_rel(rId)
-            #     del slide
-                # xml_slides.remove(slide)
-            for slide in self.ppt.slides:
-                self._rm_slide(slide)
-            self._rm_sections()
+        self.template_key = self._get_template_key()
 
-        else:
-            self.ppt = Presentation(file_name)
+        with profile_stage(profiler, 'open_ppt'):
+            if not os.path.exists(file_name):
+                self.ppt = self._open_reuse_file(reuse_file)
+                if self.ppt is None:
+                    # 打开已经删除了所有页面和 section 的空白模板
+                    self.ppt = Presentation(io.BytesIO(parsed_template.blank_blob))
+            else:
+                self.ppt = Presentation(file_name)
+        self.slide_index = Slide_Index(self.ppt)
+
+        # 图片 part 登记：sha1 -> part，模板 part -> ppt 中的 part，避免相同的图片重复保存
+        self._image_parts = {}
+        self._svg_parts = None
+        self._cloned_parts = {}
 
-        # self.component_list = template.components
-        self.component_list = self._extract_components()
-        self.section_dict = self._get_sections()
+        # 增量生成：page_key -> (slide_id, fingerprint)，以及本次按顺序添加的页面
+        self._page_fingerprints = self._read_page_fingerprints()
+        self._pages = []
+
+        self.component_list = parsed_template.component_list
+        self.section_dict = parsed_template.section_dict
 
         # llm 设置
         self.client = AsyncOpenAI(base_url=settings.LLM_IMG_GEN_BASE_URL, api_key=settings.LLM_IMG_GEN_API_KEY)
         self.img_gen_model = settings.LLM_IMG_GEN_MODEL
+        self.img_gen_concurrency = settings.LLM_IMG_GEN_CONCURRENCY
 
-        self.icons_handler = Icons_Handler()
-
-    def _get_sections(self):
-
-        # 获取所有 section
-        xml_str = self.ppt.element.xml
-        tree = etree.fromstring(xml_str)
-        # xpath 找到 <p14:section name="section_name"> 中的所有 <p14:sldId>
-        sections = tree.xpath(f"//p14:section", namespaces=self.ns)
-
-        section_dict = {}
-        for section in sections:
-            section_name = section.get('name')
-            section_dict[section_name] = section.xpath("./p14:sldIdLst/p14:sldId/@id", namespaces=self.ns)
+        self.icons_handler = icons_handler or Icons_Handler.shared()
+        # 每个 generator 选择图标的随机数独立，设置了 ICON_RANDOM_SEED 时结果不受其他生成的影响
+        self.icons_random = random.Random(settings.ICON_RANDOM_SEED)
 
-        return section_dict
+        # 同步操作的执行器，为 None 时直接执行，由 Generation_Executor 设置为线程池
+        self.executor = None
 
-    def _rm_sections(self):
-
-        # 获取所有 section
-        # sections = self.ppt._element.xpath(f"//p14:section")
-        # section_list = self.ppt._element.xpath(f"//p14:sectionLst")
-        # if len(section_list) == 0:
-        #     return
-
-        # section_list = section_list[0]
-        # for section in sections:
-        #     section_list.remove(section)
+    @profiled('parse_template')
+    def _parse_template(self, template_path):
+        '''
+        解析模板，结果放在 template_cache 中供后续的 generator 复用
+        有预编译结果时直接加载，见 template_compile
+        '''
+        return template_compile.load_template(template_path)
 
-        section_list = self.ppt._element.xpath(f"//p14:sectionLst")
-        p_ext = self.ppt._element.xpath('//p:ext')
-        if section_list:
-            p_ext[0].remove(section_list[0])
+    def _get_slide_index(self, ppt):
+        '''
+        获取 ppt 对应的 Slide_Index，模板的索引在 template_cache 中共享
+        '''
+        if ppt is getattr(self, 'ppt', None):
+            return self.slide_index
+        if ppt is getattr(self, 'temp_ppt', None):
+            return self.temp_slide_index
+        return Slide_Index(ppt)
 
     def _get_slide(self, slide_id, ppt=None):
 
         if ppt is None: ppt = self.ppt
 
-        # 获取指定 slide
-        if isinstance(slide_id, int):
-            try:
-                return ppt.slides[slide_id]
-            except IndexError:
-                pass
-
-            try:
-                return ppt.slides.get(slide_id)
-            except IndexError:
-                pass
-        
-        if isinstance(slide_id, str):
-
-            try:
-                slide_id = int(slide_id)
-                try:
-                    return ppt.slides[slide_id]
-                except IndexError:
-                    pass
-
+        # 获取指定 slide：int 或数字先按页码、再按 slide_id 查找，其余按 notes 第一行或 slide.name 查找
+        return self._get_slide_index(ppt).get(slide_id)
 
-                try:
-                    return ppt.slides.get(slide_id)
-                except IndexError:
-                    pass
-            except ValueError:
-                pass
-
-            for slide in ppt.slides:
-                if slide.has_notes_slide:
-                    slide_name = slide.notes_slide.notes_text_frame.text.split('\n')[0]
-                    if slide_name == slide_id:
-                        return slide
-                if slide.name == slide_id:
-                    return slide
-            
-            return None
 
-        if isinstance(slide_id, Slide):
-            return slide_id
-
-
-    def _rm_slide(self, slide_id):
+    def _rm_slide(self, slide_id, ppt=None):
 
         # 删除指定 slide
+        if ppt is None: ppt = self.ppt
 
-        slide = self._get_slide(slide_id)
+        slide_index = self._get_slide_index(ppt)
+        slide = slide_index.get(slide_id)
         slide_id = slide.slide_id
 
-        xml_slides = self.ppt.slides._sldIdLst
+        xml_slides = ppt.slides._sldIdLst
         rel_list = [x for x in xml_slides if x.id==slide_id]
         rel = rel_list[0]
         rel_id = rel.rId
 
         xml_slides.remove(rel) # 删除页面列表中的索引
-        self.ppt.part.drop_rel(rel_id) # 是啥对应的 xml
+        ppt.part.drop_rel(rel_id) # 是啥对应的 xml
+        slide_index.remove(slide_id)
         # 保存时会自动删除没有索引的素材
 
 
+    @profiled('save', size=os.path.getsize)
     def save(self, file_name_with_path=None):
 
         # self.ppt.save(self.tmp_file_path)
@@ -217,21 +300,43 @@ class PPt_Generator:
             os.makedirs(file_path)
 
         self.ppt.save(os.path.join(file_path, file_name))
+        return os.path.join(file_path, file_name)
 
         # with zipfile.ZipFile(self.file_name, 'r') as zip_ref:
         #     zip_ref.extractall(self.file_name[:-5])
 
+    @profiled('export', size=len)
+    def export_blob(self):
+        '''
+        把 ppt 序列化到内存中，返回 blob，不写磁盘
+        '''
+        buffer = io.BytesIO()
+        self.ppt.save(buffer)
+        return buffer.getvalue()
+
     def save_and_export_blob(self, file_name_with_path=None):
         '''
-        导出 ppt 文件为 blob
+        导出 ppt 文件为 blob，同时保存到文件，只序列化一次，不再从磁盘读回
         '''
-        self.save(file_name_with_path)
         if file_name_with_path is None:
             file_name_with_path = self.file_name
-        with open(file_name_with_path, 'rb') as f:
-            blob = f.read()
+
+        blob = self.export_blob()
+        file_path = os.path.dirname(file_name_with_path)
+        if file_path != '' and not os.path.exists(file_path):
+            os.makedirs(file_path)
+        with open(file_name_with_path, 'wb') as f:
+            f.write(blob)
         return blob
 
+    async def _run_blocking(self, func, *args):
+        '''
+        执行同步的 ppt 操作，设置了 executor 时在线程池中执行，避免阻塞事件循环
+        '''
+        if self.executor is None:
+            return func(*args)
+        return await self.executor.run(func, *args)
+
     def __del__(self):
         self.temp_dir.cleanup()
 
@@ -272,153 +377,61 @@ class PPt_Generator:
 
         return width, height
 
-    def _extract_components(self):
-        '''
-        从页面中提取组件，组件是一个 group 元素，包含一个 # 开头的 text
-        需要去除 # 开头的 text，把剩下元素的 xml 保存下来，作为元素，并根据 # 后跟随的文字命名
-        返回 json
-        '''
-        component_list = []
-        # 遍历所有编组的形状
-        for slide in self.temp_ppt.slides:
-            for shape in slide.shapes:
-                if shape.shape_type == MSO_SHAPE_TYPE.GROUP and len(shape.shapes) == 2:
-                # 理论上只有两个元素，一个 text，另一个是 group、text 或其他
-                    is_component = False
-                    component_name = ''
-                    component_element = None
-                    sub_shapes = shape.shapes
-                    sub_shape_1 = sub_shapes[0]
-                    sub_shape_2 = sub_shapes[1]
-                    if sub_shape_1.has_text_frame and sub_shape_1.text.startswith('#'):
-                        is_component = True
-                        component_name = sub_shape_1.text[1:]
-                        # component_element = sub_shape_2._element
-                        component = sub_shape_2
-                    elif sub_shape_2.has_text_frame and sub_shape_2.text.startswith('#'):
-                        is_component = True
-                        component_name = sub_shape_2.text[1:]
-                        # component_element = sub_shape_1._element
-                        component = sub_shape_1
-
-                    if is_component:
-
-                        # 计算比例尺
-                        origin_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:ext/@cx')[0])
-                        scaled_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:chExt/@cx')[0])
-                        scale = origin_width / scaled_width
-
-
-                        # 获取 tag 的 rid
-                        # tags = {}
-                        # rids = component._element.xpath('.//p:tags/@r:id')
-                        # for rid in rids:
-                        #     r_part = component.part.related_part(rid)
-                        #     tags[rid] = r_part
-
-                        # if component.shape_type == MSO_SHAPE_TYPE.GROUP:
-                        #     width, height = self._calc_group_shape_size(component)
-                        # else:
-                        #     width = component.width
-                        #     height = component.height
-                        component_list.append({
-                            'name': component_name,
-                            # 'xml': component_xml,
-                            'element': component,
-                            'width': component.width * scale,
-                            'height': component.height * scale,
-                            # 'tags': tags,
-                            'placeholders': self._get_placeholder(component)
-                        })
-
-        return component_list
-
-    
-    def _get_placeholder(self, shape):
-        '''
-        从 shape 中提取 placeholder，如果是 @-c 开头，那么是组件，这部分要通知上层的 group 进行跳过
-        '''
-        placeholder_list = []
-        if shape.has_text_frame:
-            text = shape.text_frame.text
-
-            if text.startswith('#'):
-                return 'component'
-
-            if text.startswith('@'):
-
-                text = text[1:]
-                if text.startswith('img-'):
-                    type = 'img'
-                    text = text[4:]
-                elif text.startswith('svg-'):
-                    type = 'svg'
-                    text = text[4:]
-                elif text.startswith('container-'):
-                    type = 'container'
-                    text = text[10:]
-                else:
-                    type = 'text'
-
-                # 寻找 name(style)：notes，(style) 和 ：notes 都可能不存在
-                pattern = r'^(?P<name>[^(:\n]+)(?:[\(（](?P<style>[^()]*)[\)）])?(?:[\:：](?P<notes>.*))?$'
-                match = re.match(pattern, text)
-
-                if match:
-                    data = dict(name=match.group('name'))
-                    data['type'] = type
-                    if match.group('style') != None:
-                        data['style'] = match.group('style')
-                    if match.group('notes') != None:
-                        data['description'] = match.group('notes')
-
-                # 对 container 获取 component_placeholders min_component_number max_component_number
-                if type == 'container':
-                    component = [ c for c in self.components if c['name'] == data['name']]
-                    if component != []:
-                        data['component_placeholders'] = component[0]['placeholders']
-
-                    style_dict = self._parse_style(data['style'])
-                    data['min_component_number'] = int(style_dict['min_n']) if 'min_n' in style_dict else 1
-                    data['max_component_number'] = int(style_dict['max_n']) if 'max_n' in style_dict else 5
-
-                placeholder_list.append(data)
-        elif shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-            for sub_shape in shape.shapes:
-                sub_pl = self._get_placeholder(sub_shape)
-                if sub_pl != 'component' and sub_pl != []: placeholder_list.extend(sub_pl)
-
-        return placeholder_list
-
-    
     def _get_slides_id_from_temp_section(self, section_name):
-        # 获取指定 section 中的所有 slide
-        xml_str = self.ppt.element.xml
-        tree = etree.fromstring(xml_str)
-        # xpath 找到 <p14:section name="section_name"> 中的所有 <p14:sldId>
-        slide_ids = tree.xpath(f"//p14:section[@name='{section_name}']//p14:sldId/@id", namespaces=self.ns)
-
-        return slide_ids
-
-    def _save_temp_img(self, img):
-
-        name = img.filename
-        dpi = img.dpi
-        size = img.size
-        blob = img.blob
-        content_type = img.content_type
-        # 保存图片到临时文件
-        temp_file_path = os.path.join(self.temp_dir.name, name)
-        with open(temp_file_path, 'wb') as f:
-            f.write(blob)
+        # 获取模板指定 section 中的所有 slide
+        return self.section_dict.get(section_name, [])
 
-        return temp_file_path
+    def _get_or_add_image_part(self, blob, sha1=None):
+        '''
+        获取内容相同的图片 part，没有时新建，相同内容的图片在 ppt 中只保存一份
+        sha1: 已经计算好的哈希
+        '''
+        sha1 = sha1 or hashlib.sha1(blob).hexdigest()
+        img_part = self._image_parts.get(sha1)
+        if img_part is None:
+            img_part = self.ppt.part.package.get_or_add_image_part(io.BytesIO(blob))
+            self._image_parts[sha1] = img_part
+        return img_part
+
+    def _get_or_add_svg_part(self, blob, sha1=None):
+        '''
+        获取内容相同的 svg part，没有时新建
+        '''
+        if self._svg_parts is None:
+            # 打开已有文件时，登记其中已有的 svg
+            self._svg_parts = {}
+            for part in self.ppt.part.package.iter_parts():
+                if part.content_type == 'image/svg+xml':
+                    self._svg_parts.setdefault(hashlib.sha1(part.blob).hexdigest(), part)
+
+        sha1 = sha1 or hashlib.sha1(blob).hexdigest()
+        svg_part = self._svg_parts.get(sha1)
+        if svg_part is None:
+            package = self.ppt.part.package
+            svg_part = Part(package.next_image_partname('svg'), 'image/svg+xml', package, blob)
+            self._svg_parts[sha1] = svg_part
+        return svg_part
+
+    def _clone_image_part(self, o_part):
+        '''
+        获取模板中图片 part 在 ppt 中对应的 part，同一个模板 part 只处理一次
+        '''
+        n_part = self._cloned_parts.get(o_part)
+        if n_part is None:
+            sha1 = self.template_image_hashes.get(o_part)
+            if o_part.content_type == 'image/svg+xml':
+                n_part = self._get_or_add_svg_part(o_part.blob, sha1)
+            else:
+                n_part = self._get_or_add_image_part(o_part.blob, sha1)
+            self._cloned_parts[o_part] = n_part
+        return n_part
 
     def _create_image_part(self, n_shps, n_shp, o_shp):
-        # 在新的 shapes 下，把 o_shp 中的图片复制过来
+        # 在新的 shapes 下，把 o_shp 中的图片复制过来，直接复用内存中的 blob
 
-        temp_img_file = self._save_temp_img(o_shp.image)
-        img_part, rId = n_shps.part.get_or_add_image_part(temp_img_file)
+        o_rId = o_shp._element.blip_rId
+        img_part = self._clone_image_part(o_shp.part.related_part(o_rId))
+        rId = n_shps.part.relate_to(img_part, RT.IMAGE)
         bilp_info = n_shp._element.xpath('./p:blipFill/a:blip')[0]
         bilp_info.set(f'{{{self.ns['r']}}}embed', rId)
 
@@ -426,11 +439,8 @@ class PPt_Generator:
         svg_embed = o_shp._element.xpath('p:blipFill/a:blip//asvg:svgBlip/@r:embed')
         if svg_embed != []:
             rId = svg_embed[0]
-            svg_part =o_shp.part.related_part(rId)
-            n_package = n_shps.part._package
-            n_svg_part = Part(n_package.next_image_partname('svg'), 'image/svg+xml', n_package, svg_part.blob)
-            # n_svg_part = Part(n_package.next_media_partname('svg'), 'image/svg+xml', n_package, svg_part.blob)
-            n_rId = n_shps.part.relate_to(n_svg_part, 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image')
+            n_svg_part = self._clone_image_part(o_shp.part.related_part(rId))
+            n_rId = n_shps.part.relate_to(n_svg_part, RT.IMAGE)
 
             n_svg_blip = n_shp._element.xpath('p:blipFill/a:blip//asvg:svgBlip')[0]
             n_svg_blip.set(f'{{{self.ns['r']}}}embed', n_rId)
@@ -438,11 +448,15 @@ class PPt_Generator:
     
     def _create_image_parts(self, n_shps, o_shps):
         # 创建图片文件
-        
+
+        # shape_id -> 原 shape，同 id 时取第一个
+        o_shp_dict = {}
+        for s in o_shps:
+            o_shp_dict.setdefault(s.shape_id, s)
+
         for shp in n_shps:
 
-            shp_id = shp.shape_id
-            o_shp = [ s for s in o_shps if s.shape_id == shp_id][0]
+            o_shp = o_shp_dict[shp.shape_id]
 
             if shp.shape_type == MSO_SHAPE_TYPE.PICTURE:
                 self._create_image_part(n_shps, shp, o_shp)
@@ -493,6 +507,7 @@ class PPt_Generator:
             i += 1
 
 
+    @profiled('insert_slide')
     def _insert_slide_from_template(self, slide_id, copy_notes=False):
         # 复制模板中的指定 slide 到 ppt
         slide = self._get_slide(slide_id, self.temp_ppt)
@@ -508,26 +523,35 @@ class PPt_Generator:
             slide_n.background._element = copy.deepcopy(slide.background._element)
 
         # 再处理 placeholders
+        # 模板在多个 generator 间共享，只读取已有的 txBody，text_frame 在没有 txBody 时会新建
         for placeholder in slide.placeholders:
 
-            o_text_frame = placeholder.text_frame._element
+            o_text_frame = getattr(placeholder._element, 'txBody', None)
+            if o_text_frame is None: continue
             idx = placeholder._element.ph_idx
             try:
-                n_text_frame = slide_n.placeholders[idx].text_frame._element
-                slide_n.placeholders[idx]._element.replace(n_text_frame, copy.deepcopy(o_text_frame))
-            except: # KeyError("no placeholder on this slide with idx == %d" % idx)
-                pass
+                n_element = slide_n.placeholders[idx]._element
+            except KeyError: # no placeholder on this slide with idx == idx
+                continue
+            n_text_frame = getattr(n_element, 'txBody', None)
+            if n_text_frame is not None:
+                n_element.replace(n_text_frame, copy.deepcopy(o_text_frame))
+            elif hasattr(n_element, '_insert_txBody'):
+                n_element._insert_txBody(copy.deepcopy(o_text_frame))
 
             # n_text_frame = slide_n.placeholders[i].text_frame._element
             # o_text_frame = slide.placeholders[i].text_frame._element
 
         self._deepcopy_shapes(slide_n.shapes, slide.shapes)
 
-        if copy_notes:
+        # 模板在多个 generator 间共享，没有 notes 的页面不能访问 notes_slide（会新建）
+        if copy_notes and slide.has_notes_slide:
             # 复制 notes
             notes = slide.notes_slide
             notes_n = slide_n.notes_slide
             notes_n.notes_text_frame.text = notes.notes_text_frame.text
+
+        self.slide_index.add(slide_n)
         # for shp in slide.shapes:
 
         #     if shp.shape_type == MSO_SHAPE_TYPE.PLACEHOLDER:
@@ -563,6 +587,119 @@ class PPt_Generator:
                     self._insert_slide_from_template(slide_name, copy_notes=True)
 
 
+# ============
+# 增量生成
+# ============
+
+    def _get_template_key(self):
+        '''
+        模板的版本，模板文件修改后变化
+        '''
+        stat = os.stat(self.template_path)
+        return f'{self.template.id}:{stat.st_mtime_ns}:{stat.st_size}'
+
+    def _open_reuse_file(self, reuse_file):
+        '''
+        打开可以复用的 ppt，不存在或者不是用当前版本的模板生成时返回 None
+        '''
+        if reuse_file is None or not os.path.exists(reuse_file):
+            return None
+        ppt = Presentation(reuse_file)
+        props = read_custom_properties(ppt, PAGE_PROP_PREFIX)
+        if props.get(TEMPLATE_PROP) != self.template_key:
+            return None
+        return ppt
+
+    def _read_page_fingerprints(self):
+        props = read_custom_properties(self.ppt, PAGE_PROP_PREFIX)
+        if props.get(TEMPLATE_PROP) != self.template_key:
+            return {}
+
+        fingerprints = {}
+        for name, value in props.items():
+            if not name.startswith(PAGE_PROP): continue
+            slide_id, _, fingerprint = value.partition(':')
+            try:
+                fingerprints[name[len(PAGE_PROP):]] = (int(slide_id), fingerprint)
+            except ValueError:
+                continue
+        return fingerprints
+
+    @staticmethod
+    def get_page_fingerprint(slide_data, slide_note=None, source=None):
+        '''
+        页面的指纹：slide_data（包括 template_id）、slide_note 和生成 slide_data 时的输入 source
+        '''
+        content = json.dumps([slide_data, slide_note, source], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(content.encode('utf8')).hexdigest()[:16]
+
+    def _get_unchanged_slide(self, page_key, fingerprint):
+        old = self._page_fingerprints.get(str(page_key))
+        if old is None or old[1] != fingerprint:
+            return None
+        # 同一个页面只能用一次
+        if old[0] in [slide_id for _, slide_id, _ in self._pages]:
+            return None
+        return self.slide_index.get_by_id(old[0])
+
+    def is_page_unchanged(self, page_key, slide_data, slide_note=None, source=None):
+        '''
+        page_key 对应的页面在复用的 ppt 中存在，并且指纹没有变化
+        '''
+        fingerprint = self.get_page_fingerprint(slide_data, slide_note, source)
+        return self._get_unchanged_slide(page_key, fingerprint) is not None
+
+    @profiled('add_page')
+    def add_page(self, page_key, slide_data, slide_note=None, source=None):
+        '''
+        增量生成页面：page_key（如 PPt_Page 的 id）对应的页面没有变化时，保留原来的页面（包括已经生成的图片），
+        否则调用 add_slide 重新生成。所有页面添加完后需要调用 finish_pages
+        返回：
+            slide, 是否复用了原来的页面
+        '''
+        page_key = str(page_key)
+        fingerprint = self.get_page_fingerprint(slide_data, slide_note, source)
+        slide = self._get_unchanged_slide(page_key, fingerprint)
+        reused = slide is not None
+        if not reused:
+            slide = self.add_slide(slide_data, slide_note)
+        self._pages.append((page_key, slide.slide_id, fingerprint))
+        return slide, reused
+
+    def arrange_slides(self, slide_ids):
+        '''
+        按 slide_ids 的顺序排列页面，不在 slide_ids 中的页面排在最前面
+        '''
+        sld_id_lst = self.ppt.slides._sldIdLst
+        sld_ids = {sld_id.id: sld_id for sld_id in sld_id_lst}
+        for slide_id in slide_ids:
+            sld_id = sld_ids[slide_id]
+            sld_id_lst.remove(sld_id)
+            sld_id_lst.append(sld_id)
+
+    @profiled('finish_pages')
+    def finish_pages(self):
+        '''
+        增量生成结束：删除本次没有添加的页面，按 add_page 的顺序排列页面，并在自定义属性中记录页面指纹
+        '''
+        slide_ids = [slide_id for _, slide_id, _ in self._pages]
+        keep = set(slide_ids)
+        for slide in list(self.ppt.slides):
+            if slide.slide_id not in keep:
+                self._rm_slide(slide)
+        self.arrange_slides(slide_ids)
+
+        props = {TEMPLATE_PROP: self.template_key}
+        for page_key, slide_id, fingerprint in self._pages:
+            props[PAGE_PROP + page_key] = f'{slide_id}:{fingerprint}'
+        write_custom_properties(self.ppt, props, PAGE_PROP_PREFIX)
+
+        self._page_fingerprints = {
+            page_key: (slide_id, fingerprint) for page_key, slide_id, fingerprint in self._pages
+        }
+        self._pages = []
+
+
 # ============
 # llm
 # ============
@@ -595,6 +732,7 @@ class PPt_Generator:
         return width, height
 
 
+    @profiled('generate_img', size=lambda result: os.path.getsize(result[1]) if result[0] else 0)
     async def _generate_img(self, uid, desc, width, height):
         '''
         通过 AI 生成图片，返回值：是否成功、成功时返回图片路径，失败时返回错误信息
@@ -605,7 +743,7 @@ class PPt_Generator:
         # 计算长宽比
         aspect_ratio = width/height
         if aspect_ratio > 16 or aspect_ratio < 1/16:
-            return False
+            return False, '图片长宽比超出范围'
 
         size = f'{int(width)}x{int(height)}'
         try:
@@ -627,6 +765,14 @@ class PPt_Generator:
             f.write(image_data)
         return True, img_path
 
+    async def _generate_img_with_limit(self, semaphore, task):
+        '''
+        在 semaphore 的限制下生成图片，控制同时请求图片接口的数量
+        '''
+        async with semaphore:
+            shp = task['shape']
+            return await self._generate_img(task['uid'], task['desc'], shp.width, shp.height)
+
 
 # ============
 # 通过 slide data 来生成 PPt
@@ -638,12 +784,22 @@ class PPt_Generator:
         # 从数据生成页面
             temp_no = int(slide_data['template_id'])
             new_slide = self._insert_slide_from_template(temp_no)
-            slide_notes = self.replace_placeholders(new_slide.shapes, slide_data['placeholders'])
+
+            # 一次遍历完成 placeholder 替换和图标收集，图标统一渲染后再插入
+            slide_notes = []
+            icon_tasks = []
+            walker = Shape_Walker()
+            with profile_stage(self.profiler, 'replace_placeholders'):
+                walker.visit(walker.walk(new_slide.shapes, placeholders=slide_data['placeholders']), [
+                    functools.partial(self._handle_placeholder, slide_notes),
+                    functools.partial(self._collect_icon, icon_tasks),
+                ])
+            self._replace_icon_tasks(icon_tasks, new_slide.shapes)
             if slide_note:
                 slide_notes.extend([slide_note])
 
             new_slide.notes_slide.notes_text_frame.text = '\n'.join(slide_notes)
-            self.replace_icons(new_slide.shapes)
+            self.slide_index.update_name(new_slide)
 
             # 去掉 p:nvPr 下的 p:custDataLst，还是很容易出错
             # 尤其是在 container 中时，可能 rid 不能出现多次吧
@@ -683,57 +839,83 @@ class PPt_Generator:
         if len(text_list) == 1 and '；' in text_list[0]:
             text_list = text_list[0].split('；')
         for line in text_list:
-            tmp_p = copy.deepcopy(template_p)
+            # 只复制段落的 lxml 元素，复制 python-pptx 对象会连带复制整个 ppt
+            tmp_p = _Paragraph(copy.deepcopy(template_p._p), shape_text_frame)
             tmp_p.runs[0].text = line
             shape_text_frame._element.insert(-1, tmp_p._element)
 
 
-    def _replace_icon_shape(self, shape, shapes, icon_name, ratio=1):
-
-        icon_path = self.icons_handler.find_icon(icon_name)
-        if icon_path:
-            icon_color = self.color_parser.get_fore_color_rgb_hex(shape)
-            width = int(shape.width.pt * ratio)
-            height = int(shape.height.pt * ratio)
-            icon_svg_content = self.icons_handler.get_icon_content(icon_path)
-            icon_png_path = os.path.join(self.temp_dir.name, f'{icon_name}.png')
-            icon_svg_path = os.path.join(self.temp_dir.name, f'{icon_name}.svg')
-            modified_icon_svg_content = self.icons_handler.modify_svg(icon_svg_content, icon_svg_path, icon_color)
-            self.icons_handler.svg_to_png(modified_icon_svg_content, icon_png_path, width, height)
-            pic = shapes.add_picture(icon_png_path, shape.left, shape.top, shape.width, shape.height)
-            shapes._element.remove(shape._element)
-
-            package = pic.part._package
-            svg_part = Part(package.next_image_partname('svg'), 'image/svg+xml', package, modified_icon_svg_content.encode('utf8'))
-            rid = pic.part.relate_to(svg_part, 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image')
-            extLst_str = '''
-            <a:extLst>
-                <a:ext uri="{96DAC541-7B7A-43D3-8B79-37D633B846F1}">
-                    <asvg:svgBlip xmlns:asvg="http://schemas.microsoft.com/office/drawing/2016/SVG/main"
-                        r:embed="RID" />
-                </a:ext>
-            </a:extLst>
-            '''.replace('RID', rid)
-            parser = etree.XMLParser(recover=True)
-            pic._element.xpath('p:blipFill/a:blip')[0].append(etree.fromstring(extLst_str, parser))
-        else:
-            self._replace_text(shape, f'@icon-{icon_name}')
-            
+    def _collect_icon_task(self, shape, icon_name, ratio=1):
+        '''
+        计算图标的颜色和尺寸，图标由 _find_icon_tasks 批量查找
+        '''
+        return {
+            'shape': shape,
+            'icon_name': icon_name,
+            'icon_path': None,
+            'color': self.color_parser.get_fore_color_rgb_hex(shape),
+            'width': int(shape.width.pt * ratio),
+            'height': int(shape.height.pt * ratio),
+        }
 
-    def _parse_style(self, style_str):
+    def _find_icon_tasks(self, tasks):
         '''
-        解析 style_str，返回一个 dict
+        一次查找所有 tasks 的图标，找不到图标的 shape 保留，文字替换为 @icon-name
+        返回找到图标的 tasks
         '''
-        style_dict = {}
-        style_list = style_str.split(' ')
-        for style in style_list:
-            if '-' in style:
-                key, value = style.split('-', 1)
-                style_dict[key] = value
+        with profile_stage(self.profiler, 'icon_search'):
+            icon_paths = self.icons_handler.find_icons(
+                [task['icon_name'] for task in tasks], rng=self.icons_random
+            )
+
+        found = []
+        for task, icon_path in zip(tasks, icon_paths):
+            if icon_path:
+                task['icon_path'] = icon_path
+                found.append(task)
             else:
-                style_dict[style] = ''
+                self._replace_text(task['shape'], f'@icon-{task["icon_name"]}')
+        return found
 
-        return style_dict
+    def _render_icon_tasks(self, tasks):
+        '''
+        批量渲染图标，缓存中没有的图标由 Icons_Handler 交给进程池并行渲染
+        返回与 tasks 顺序一致的 [(svg, png), ...]
+        '''
+        with profile_stage(self.profiler, 'icon_rasterize') as stage:
+            results = self.icons_handler.render_icons([
+                (task['icon_path'], task['color'], task['width'], task['height'], 96) for task in tasks
+            ])
+            stage.add_bytes(sum(len(png) for _, png in results))
+        return results
+
+    def _insert_icon(self, shape, shapes, icon_name, icon_svg, icon_png):
+        '''
+        用渲染好的图标替换 shape，同时保存 svg，PowerPoint 中显示为矢量图
+        '''
+        pic = shapes.add_picture(io.BytesIO(icon_png), shape.left, shape.top, shape.width, shape.height)
+        # 从内存添加的图片没有文件名，替代文字保持为图标名称
+        pic._element.nvPicPr.cNvPr.set('descr', f'{icon_name}.png')
+        shapes._element.remove(shape._element)
+
+        svg_part = self._get_or_add_svg_part(icon_svg)
+        rid = pic.part.relate_to(svg_part, RT.IMAGE)
+        extLst_str = '''
+        <a:extLst>
+            <a:ext uri="{96DAC541-7B7A-43D3-8B79-37D633B846F1}">
+                <asvg:svgBlip xmlns:asvg="http://schemas.microsoft.com/office/drawing/2016/SVG/main"
+                    r:embed="RID" />
+            </a:ext>
+        </a:extLst>
+        '''.replace('RID', rid)
+        parser = etree.XMLParser(recover=True)
+        pic._element.xpath('p:blipFill/a:blip')[0].append(etree.fromstring(extLst_str, parser))
+
+    def _parse_style(self, style_str):
+        '''
+        解析 style_str，返回一个 dict
+        '''
+        return parse_style(style_str)
 
     def _calculate_element_positions(
         self,
@@ -764,63 +946,21 @@ class PPt_Generator:
         返回:
             每个子元素的左上角坐标列表，格式为 [(x1, y1), (x2, y2), ...]
         """
-        positions = []
-        
-        # 计算子元素总体尺寸
-        if direction == "l-r":
-            total_children_width = child_width * child_count + spacing * (child_count - 1)
-            total_children_height = child_height
-        else:  # t-b
-            total_children_width = child_width
-            total_children_height = child_height * child_count + spacing * (child_count - 1)
-        
-        # 计算水平方向偏移量
-        if horizontal_alignment == "l":
-            start_x = parent_x
-        elif horizontal_alignment == "r":
-            start_x = parent_x + parent_width - total_children_width
-        elif horizontal_alignment == "c":
-            start_x = parent_x + (parent_width - total_children_width) / 2
-        else:  # j (只在l-r排列时有效)
-            if child_count > 1:
-                # 重新计算 j 模式下的间距
-                spacing = (parent_width - child_width * child_count) / (child_count - 1)
-            start_x = parent_x
-        
-        # 计算垂直方向偏移量
-        if vertical_alignment == "t":
-            start_y = parent_y
-        elif vertical_alignment == "b":
-            start_y = parent_y + parent_height - total_children_height
-        elif vertical_alignment == "c":
-            start_y = parent_y + (parent_height - total_children_height) / 2
-        else:  # j (只在t-b排列时有效)
-            if child_count > 1:
-                # 重新计算 j 模式下的间距
-                spacing = (parent_height - child_height * child_count) / (child_count - 1)
-            start_y = parent_y
-        
-        # 计算每个子元素的位置
-        for i in range(child_count):
-            if direction == "l-r":
-                # 从左到右排列
-                x = start_x + i * (child_width + spacing)
-                y = start_y
-            else:  # t-b
-                # 从上到下排列
-                x = start_x
-                y = start_y + i * (child_height + spacing)
-            
-            positions.append((Emu(x), Emu(y)))
-        
-        return positions
+        return calculate_positions(
+            parent_width, parent_height, parent_x, parent_y,
+            child_width, child_height, child_count,
+            direction, horizontal_alignment, vertical_alignment, spacing
+        )
 
-    def _replace_container(self, shape, placeholder):
+    def _replace_container(self, shape, placeholder, shapes):
         '''
         替换 container
         args:
             shape: python-pptx 中的 shape，shape 中的文字包含了样式信息
             placeholder: 一个 dict，key 包括 name、components_placeholders
+            shapes: shape 所在的 shapes
+        返回：
+            添加的组件列表，每个元素为 (组件 shape, 组件的 placeholders)，组件中的 placeholder 由调用方替换
         '''
 
         # 获取 component
@@ -836,48 +976,49 @@ class PPt_Generator:
             'valign': 'c',
             'gap': '160000'
         }
-        shape_text = shape.text_frame.text
-        # 寻找 name(style)：notes，(style) 和 ：notes 都可能不存在
-        pattern = r'^(?P<name>[^(:\n]+)(?:[\(（](?P<style>[^()]*)[\)）])?(?:[\:：](?P<notes>.*))?$'
-        match = re.match(pattern, shape_text)
-        if match and match.group('style'):
-            mod_style_str = match.group('style')
-            for k, v in self._parse_style(mod_style_str).items():
+        parsed = parse_placeholder(shape.text_frame.text)
+        if parsed and parsed['style']:
+            for k, v in parse_style(parsed['style']).items():
                 style[k] = v
 
         # 获取 component 数量
         components_len = len(placeholder['components_placeholders'])
 
-        # 获取 shape 的宽、高、左、上
-        width = shape.width
-        height = shape.height
-        left = shape.left
-        top = shape.top
-
         # 获取 component 的宽、高
         component_width = component_dict[0]['width']
         component_height = component_dict[0]['height']
 
-        # 计算子元素位置
-        positions = self._calculate_element_positions(
-            width, height, left, top,
+        # 计算子元素位置，组件太多时按 wrap 换行
+        positions = calculate_grid_positions(
+            shape.width, shape.height, shape.left, shape.top,
             child_width=component_width, child_height=component_height,
             child_count=components_len,
             direction=style['direction'],
             horizontal_alignment=style['align'],
             vertical_alignment=style['valign'],
-            spacing=Emu(int(style['gap']))
+            spacing=Emu(int(style['gap'])),
+            wrap=style.get('wrap')
         )
 
         # 创建 component，然后添加到 ppt 上
+        # 只复制 lxml 的元素，插入后再生成 python-pptx 的 shape
+        comps = []
         for i, pos in enumerate(positions):
-            comp = copy.deepcopy(component)
+            el = copy.deepcopy(component.element)
+            shape.element.addprevious(el)
+            comp = shapes._shape_factory(el)
             comp.left = pos[0]
             comp.top = pos[1]
             comp.width = int(component_width)
             comp.height = int(component_height)
-            self.replace_placeholders([comp], placeholder['components_placeholders'][i])
-            shape.element.addprevious(comp.element)
+
+            # 组件中的图片需要关联到新的 slide
+            if comp.shape_type == MSO_SHAPE_TYPE.PICTURE:
+                self._create_image_part(shapes, comp, component)
+            elif comp.shape_type == MSO_SHAPE_TYPE.GROUP:
+                self._create_image_parts(comp.shapes, component.shapes)
+
+            comps.append((comp, placeholder['components_placeholders'][i]))
 
             # 添加 tags
             # tags = component_dict[0]['tags']
@@ -890,8 +1031,109 @@ class PPt_Generator:
             #     p_tags[0].set(f'{{{self.ns['r']}}}id', n_rid)
 
         # 删除 shape
-        shape.part.slide.shapes.element.remove(shape.element)
+        shape.element.getparent().remove(shape.element)
+
+        return comps
+
+
+    def _handle_placeholder(self, slide_notes, node, walker):
+        '''
+        Shape_Walker 的 handler：如果 shape 的文字和 node.placeholders 中的 placeholder 匹配，替换其内容
+        图片的描述添加到 slide_notes 中
+        '''
+        if node.text is None or node.placeholders is None: return
+
+        # 判断是否是 placeholder：@type-name(style)：notes
+        parsed = parse_placeholder(node.text)
+        if parsed is None: return
+        name = parsed['name']
+
+        placeholder = [p for p in node.placeholders if p['name'].replace(' ', '') == name]
+
+        if len(placeholder) == 0: return
+        placeholder = placeholder[0]
+
+        shape = node.shape
+
+        # 替换内容
+        t = placeholder['type']
+
+        if t == 'text':
+            # shape.text_frame.text = placeholder['content']
+            self._replace_text(shape, placeholder['content'])
+            node.text = placeholder['content']
+        elif t == 'icon':
+            # 先替换为 @icon-name，由 _collect_icon 收集后生成图标
+            node.text = f'@icon-{placeholder["content"]}'
+            self._replace_text(shape, node.text)
+
+        elif t == 'img':
+            # 设置 uid 为 uuid 前四位
+            uid = str(uuid.uuid4())[:4]
+            # shape.text_frame.text = '@img-' + uid
+            node.text = '@img-' + uid
+            self._replace_text(shape, node.text)
+            # 在 slide_notes 中添加 uid 对应的图片
+            slide_notes.append(
+                # f'@img-{uid}\nsize: {int(width)}*{int(height)}\n{default_img_prompt}\n{placeholder["content"]}\n@endimg',
+                f'@img-{uid}\n{default_img_prompt}\n{placeholder["content"]}\n@endimg',
+            )
+        # elif t == 'svg':
+        #     # 设置 uid 为 uuid 前四位
+        #     uid = str(uuid.uuid4())[:4]
+        #     t = '@svg-' + uid
+        #     self._replace_text(shape, t)
+        #     # 在 slide_notes 中添加 uid 对应的 svg
+        #     slide_notes.append(
+        #         f'@svg-{uid}\n{default_svg_prompt}\n{placeholder["content"]}\n@endsvg',
+        #     )
+        elif t == 'container':
+            comps = self._replace_container(shape, placeholder, node.shapes)
+            node.removed = True
+            # 组件中的 shape 紧接着处理，组件本身在 container 所在的 shapes 中
+            comp_nodes = []
+            for comp, comp_placeholders in comps:
+                walker.walk([comp], node.ratio, comp_placeholders, comp_nodes, parent=node.shapes)
+            walker.insert(comp_nodes)
+
+    def _collect_icon(self, tasks, node, walker):
+        '''
+        Shape_Walker 的 handler：收集 @icon-name 的 shape，图标统一查找、渲染后由 _replace_icon_tasks 插入
+        找不到图标时 shape 保留，文字不变
+        '''
+        if node.text is None: return
+
+        match = ICON_PATTERN.match(node.text)
+        if not match: return
+        name = match.group(1)
+        tasks.append(self._collect_icon_task(node.shape, name, node.ratio))
+
+    def _handle_icon_insert(self, rendered, node, walker):
+        '''
+        Shape_Walker 的 handler：把渲染好的图标插入到 shape 的位置
+        '''
+        result = rendered.get(node.shape._element)
+        if result is None: return
+        task, icon_svg, icon_png = result
+        self._insert_icon(node.shape, node.shapes, task['icon_name'], icon_svg, icon_png)
+        node.removed = True
+
+    def _insert_icon_results(self, tasks, results, nodes):
+        rendered = {
+            task['shape']._element: (task, icon_svg, icon_png)
+            for task, (icon_svg, icon_png) in zip(tasks, results)
+        }
+        # 插入图片会改变 group 的大小，由 Shape_Walker 负责恢复
+        Shape_Walker().visit(nodes, [functools.partial(self._handle_icon_insert, rendered)])
 
+    @profiled('icon')
+    def _replace_icon_tasks(self, tasks, nodes):
+        '''
+        渲染 tasks 中的图标，再遍历 nodes（walk 的结果或 shapes）把图标插入到对应的位置
+        '''
+        tasks = self._find_icon_tasks(tasks)
+        if not tasks: return
+        self._insert_icon_results(tasks, self._render_icon_tasks(tasks), nodes)
 
     def replace_placeholders(self, shapes, placeholders: list, ratio=1):
         '''
@@ -899,6 +1141,8 @@ class PPt_Generator:
         args:
             shapes: python-pptx 中的 shapes
             placeholders: 一个列表，每个元素是一个 dict，key 包括 name、content、type
+        返回：
+            需要添加到 slide notes 中的图片描述
         '''
 
         # 这里只是把文字描述添加到 ppt 中，不做 multimedia 的生成
@@ -906,120 +1150,24 @@ class PPt_Generator:
         # 'NoneType' object has no attribute 'recalculate_extents'
 
         slide_notes = []
-
-        for shape in shapes:
-            # 判断 shape 是否是 group
-            if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-
-                origin_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:ext/@cx')[0])
-                scaled_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:chExt/@cx')[0])
-                scale = origin_width / scaled_width
-                group_ratio = ratio * scale
-                sub_slide_notes = self.replace_placeholders(shape.shapes, placeholders, group_ratio)
-                slide_notes.extend(sub_slide_notes)
-                continue
-
-            if hasattr(shape, 'has_text_frame') and shape.has_text_frame:
-                text = shape.text_frame.text
-                # 判断是否是 placeholder
-                if not text.startswith('@'): continue
-
-                # 寻找 type-name(style)：notes，type- (style) 和 ：notes 都可能不存在
-                pattern = re.compile(
-                    r'^(?:(?P<type>\w+)-)?'  # type部分变为可选（带连字符）
-                    r'(?P<name>[^(:：\(\)（）\n]+)'
-                    r'(?:[(\uff08](?P<style>[^()（）]*?)[)\uff09])?'
-                    r'(?:[:\uff1a](?P<notes>.*))?$'
-                )
-                match = re.match(pattern, text[1:])
-                if not match: continue
-                name = match.group('name')
-
-                placeholder = [p for p in placeholders if p['name'].replace(' ', '') == name]
-
-                if len(placeholder) == 0: continue
-                placeholder = placeholder[0]
-
-                # 替换内容
-                t = placeholder['type']
-
-                if t == 'text':
-                    # shape.text_frame.text = placeholder['content']
-                    self._replace_text(shape, placeholder['content'])
-                elif t == 'icon':
-                    # self._replace_icon_shape(shape, shapes, placeholder['content'], ratio)
-                    self._replace_text(shape, f'@icon-{placeholder["content"]}')
-
-                elif t == 'img':
-                    # 设置 uid 为 uuid 前四位
-                    uid = str(uuid.uuid4())[:4]
-                    # shape.text_frame.text = '@img-' + uid
-                    t = '@img-' + uid
-                    self._replace_text(shape, t)
-                    # 在 slide_notes 中添加 uid 对应的图片
-                    width, height = self.get_img_size(shape.width*ratio, shape.height*ratio)
-                    slide_notes.append(
-                        # f'@img-{uid}\nsize: {int(width)}*{int(height)}\n{default_img_prompt}\n{placeholder["content"]}\n@endimg',
-                        f'@img-{uid}\n{default_img_prompt}\n{placeholder["content"]}\n@endimg',
-                    )
-                # elif t == 'svg':
-                #     # 设置 uid 为 uuid 前四位
-                #     uid = str(uuid.uuid4())[:4]
-                #     t = '@svg-' + uid
-                #     self._replace_text(shape, t)
-                #     # 在 slide_notes 中添加 uid 对应的 svg
-                #     slide_notes.append(
-                #         f'@svg-{uid}\n{default_svg_prompt}\n{placeholder["content"]}\n@endsvg',
-                #     )
-                elif t == 'container':
-                    self._replace_container(shape, placeholder)
-        
+        walker = Shape_Walker()
+        walker.visit(walker.walk(shapes, ratio, placeholders), [
+            functools.partial(self._handle_placeholder, slide_notes)
+        ])
         return slide_notes
 
     
     def replace_icons(self, shapes, ratio=1):
         '''
-        遍历 shapes，如果 has_text_frame，读取 text_frame 信息，如果和 placeholder 匹配，替换其内容
+        遍历 shapes，把 @icon-name 的 shape 替换为图标
         args:
             shapes: python-pptx 中的 shapes
         '''
-
-        # 这里只是把文字描述添加到 ppt 中，不做 multimedia 的生成
-        # multimedia 生成统一完成，不然针对 container 没有添加到 ppt 中，因为没有父元素，会报错：
-        # 'NoneType' object has no attribute 'recalculate_extents'
-
-        for shape in shapes:
-            # 判断 shape 是否是 group
-            if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-
-                origin_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:ext/@cx')[0])
-                scaled_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:chExt/@cx')[0])
-                scale = origin_width / scaled_width
-                group_ratio = ratio * scale
-                group_top = shape.top
-                group_left = shape.left
-                group_width = shape.width
-                group_height = shape.height
-                self.replace_icons(shape.shapes, group_ratio)
-                shape.top = group_top
-                shape.left = group_left
-                shape.width = group_width
-                shape.height = group_height
-                continue
-
-            if hasattr(shape, 'has_text_frame') and shape.has_text_frame:
-                text = shape.text_frame.text
-                # 判断是否是 placeholder
-                if not text.startswith('@'): continue
-
-                # 寻找 type-name(style)：notes，type- (style) 和 ：notes 都可能不存在
-                pattern = re.compile(
-                    r'^icon-(.*)'
-                )
-                match = re.match(pattern, text[1:])
-                if not match: continue
-                name = match.group(1)
-                self._replace_icon_shape(shape, shapes, name, ratio)
+        tasks = []
+        walker = Shape_Walker()
+        nodes = walker.walk(shapes, ratio)
+        walker.visit(nodes, [functools.partial(self._collect_icon, tasks)])
+        self._replace_icon_tasks(tasks, nodes)
 
 # ============
 # 图片替换与生成相关
@@ -1058,48 +1206,87 @@ class PPt_Generator:
             if c_i >= len(color_sheme):
                 c_i = 0
 
+    def _collect_img_tasks(self, nodes, slide_notes_str):
+        '''
+        收集 nodes 中待生成的图片（@img-uid 且没有 -g 后缀），不做实际生成
+        args:
+            nodes: Shape_Walker.walk 返回的 Shape_Node 列表，也可以是 python-pptx 中的 shapes
+            slide_notes_str: slide notes 的文字，从中获取图片描述
+        返回：
+            一个列表，每个元素是一个 dict，key 包括 shapes、shape、uid、text、desc
+        '''
+        if not isinstance(nodes, list):
+            nodes = Shape_Walker().walk(nodes)
+
+        tasks = []
+        for node in nodes:
+            text = node.text
+            if text is None or not text.startswith('@img'): continue
+
+            match = IMG_PATTERN.search(text)
+            if match and match.group(2) is None:
+                # 获取信息
+                uid = match.group(1)
+                reg = re.compile(f'@img-{re.escape(uid)}\n(.*?)\n@endimg', re.DOTALL)
+                try:
+                    img_desc = re.search(reg, slide_notes_str).group(1)
+                except:
+                    continue
+                tasks.append({
+                    'shapes': node.shapes,
+                    'shape': node.shape,
+                    'uid': uid,
+                    'text': text,
+                    'desc': img_desc,
+                })
+
+        return tasks
+
+    @profiled('splice_img')
+    def _splice_img(self, task, suc, file_path):
+        '''
+        把生成的图片放回 shape 树中，失败时把错误信息写到 shape 的文字中
+        args:
+            task: _collect_img_tasks 返回的任务
+            suc: 是否生成成功
+            file_path: 成功时为图片路径，失败时为错误信息
+        '''
+        shapes = task['shapes']
+        shp = task['shape']
+        uid = task['uid']
+        text = task['text']
+
+        # 移除之前生成的图片
+        for p in shapes:
+            if p.name == f'img-{uid}':
+                shapes._spTree.remove(p.element)
+                break
+
+        if not suc:
+            # 添加错误信息到材料中
+            new_text = text + ' ' + file_path
+            self.add_colorful_text(shp, new_text)
+        else:
+            # 替换图片
+            p = shapes.add_picture(file_path, width = shp.width, height = shp.height, left = shp.left, top = shp.top)
+            shapes._spTree.remove(p.element)
+            p.name = f'img-{uid}'
+            shp._element.addprevious(p.element)
+            # 文字替换为 -g
+            new_text = text.replace(uid, uid + '-g')
+            self.add_colorful_text(shp, new_text)
+
     async def replace_shapes_img(self, shapes, slide_notes_str):
         '''
         替换 shapes 中的图片
         args:
             shapes: python-pptx 中的 shapes
         '''
-
-        for shp in shapes:
-            if shp.shape_type == MSO_SHAPE_TYPE.GROUP:
-                await self.replace_shapes_img(shp.shapes, slide_notes_str)
-            elif hasattr(shp, 'has_text_frame') and shp.has_text_frame and shp.text_frame.text.startswith('@img'):
-                text = shp.text_frame.text
-                match = re.search(r'@img-(.+?)(-g)?$', text)
-                if match and match.group(2) is None:
-                    # 获取信息
-                    uid = match.group(1)
-                    reg = re.compile(f'@img-{uid}\n(.*?)\n@endimg', re.DOTALL)
-                    try:
-                        img_desc = re.search(reg, slide_notes_str).group(1)
-                    except:
-                        continue
-                    # 移除之前生成的图片
-                    for p in shapes:
-                        if p.name == f'img-{uid}':
-                            shapes._spTree.remove(p.element)
-                            break
-                    
-                    # 生成图片
-                    suc, file_path = await self._generate_img(uid, img_desc, shp.width, shp.height)
-                    if not suc:
-                        # 添加错误信息到材料中
-                        new_text = text + ' ' + file_path
-                        self.add_colorful_text(shp, new_text)
-                    else:
-                        # 替换图片
-                        p = shapes.add_picture(file_path, width = shp.width, height = shp.height, left = shp.left, top = shp.top)
-                        shapes._spTree.remove(p.element)
-                        p.name = f'img-{uid}'
-                        shp._element.addprevious(p.element)
-                        # 文字替换为 -g
-                        new_text = text.replace(uid, uid + '-g')
-                        self.add_colorful_text(shp, new_text)
+        tasks = self._collect_img_tasks(shapes, slide_notes_str)
+        semaphore = asyncio.Semaphore(self.img_gen_concurrency)
+        results = await asyncio.gather(*[self._generate_img_with_limit(semaphore, task) for task in tasks])
+        for task, (suc, file_path) in zip(tasks, results):
+            self._splice_img(task, suc, file_path)
 
 
     async def replace_slide_img(self, slide):
@@ -1113,31 +1300,96 @@ class PPt_Generator:
         slide_notes_str = slide.notes_slide.notes_text_frame.text
         await self.replace_shapes_img(slide.shapes, slide_notes_str)
 
+    def _collect_deck_img_tasks(self):
+        '''
+        收集所有页面中待生成的图片，每页的 shape 树只展开一次，后续替换图标时复用
+        返回 slides、每页展开后的 nodes 和每页对应的任务列表
+        '''
+        slides = list(self.ppt.slides)
+        walker = Shape_Walker()
+        slide_nodes = [walker.walk(slide.shapes) for slide in slides]
+        slide_tasks = [
+            self._collect_img_tasks(nodes, slide.notes_slide.notes_text_frame.text)
+            for slide, nodes in zip(slides, slide_nodes)
+        ]
+        return slides, slide_nodes, slide_tasks
+
+    @profiled('icon')
+    def _render_deck_icons(self, slide_nodes):
+        '''
+        收集所有页面中的图标，一次交给进程池渲染
+        返回每一页的 (tasks, results)，由 _insert_icon_results 插入
+        '''
+        slide_icon_tasks = []
+        for nodes in slide_nodes:
+            tasks = []
+            Shape_Walker().visit(nodes, [functools.partial(self._collect_icon, tasks)])
+            slide_icon_tasks.append(tasks)
+
+        # 所有页面的图标一次查找、一次渲染
+        found = self._find_icon_tasks([task for tasks in slide_icon_tasks for task in tasks])
+        results = dict(zip(map(id, found), self._render_icon_tasks(found)))
+
+        slide_icons = []
+        for tasks in slide_icon_tasks:
+            tasks = [task for task in tasks if id(task) in results]
+            slide_icons.append((tasks, [results[id(task)] for task in tasks]))
+        return slide_icons
+
     # 批量替换图片，yield slide 的 id
     async def batch_replace_multimedia(self):
         '''
         批量替换图片，yield slide 的 id
+        先收集所有页面中待生成的图片，通过 semaphore 限制并发数后同时请求图片接口，
+        请求的同时在进程池中渲染所有页面的图标，
+        再按页面顺序把图片、图标放回 shape 树中，每完成一页 yield 一次，方便上层汇报进度
         '''
-        for slide in self.ppt.slides:
-            await self.replace_slide_img(slide)
-            self.replace_icons(slide.shapes)
-            yield slide.slide_id
+        slides, slide_nodes, slide_tasks = await self._run_blocking(self._collect_deck_img_tasks)
+
+        semaphore = asyncio.Semaphore(self.img_gen_concurrency)
+        slide_futures = [
+            [asyncio.ensure_future(self._generate_img_with_limit(semaphore, task)) for task in tasks]
+            for tasks in slide_tasks
+        ]
+
+        try:
+            # 图片请求进行的同时渲染所有页面的图标
+            slide_icons = await self._run_blocking(self._render_deck_icons, slide_nodes)
+
+            for slide, nodes, tasks, futures, (icon_tasks, icon_results) in zip(
+                slides, slide_nodes, slide_tasks, slide_futures, slide_icons
+            ):
+                for task, future in zip(tasks, futures):
+                    suc, file_path = await future
+                    await self._run_blocking(self._splice_img, task, suc, file_path)
+                if icon_tasks:
+                    await self._run_blocking(self._insert_icon_results, icon_tasks, icon_results, nodes)
+                yield slide.slide_id
+        finally:
+            # 中途退出时，取消尚未完成的图片请求
+            for futures in slide_futures:
+                for future in futures:
+                    future.cancel()
 
 # =============
 # 生成最终清洁版 ppt
 # =============
 
+    def _handle_clear(self, node, walker):
+        '''
+        Shape_Walker 的 handler：删除 @img-* 或 @svg-* 开头的 shape
+        '''
+        if node.text is None: return
+        if node.text.startswith('@img') or node.text.startswith('@svg'):
+            node.shapes._spTree.remove(node.shape.element)
+            node.removed = True
+
     def clear_shapes(self, shapes):
         '''
         清除 shapes 中 @img-* 或 @svg-* 开头的 shape
         '''
-        for shp in shapes:
-            if shp.shape_type == MSO_SHAPE_TYPE.GROUP:
-                self.clear_shapes(shp.shapes)
-            elif hasattr(shp, 'has_text_frame') and shp.has_text_frame:
-                text = shp.text_frame.text
-                if text.startswith('@img') or text.startswith('@svg'):
-                    shapes._spTree.remove(shp.element)
+        walker = Shape_Walker()
+        walker.visit(walker.walk(shapes), [self._handle_clear])
 
 
     def clear_slide(self, slide):
@@ -1152,6 +1404,7 @@ class PPt_Generator:
 
         self.clear_shapes(slide.shapes)
 
+    @profiled('clear')
     def batch_clear_slide(self):
         '''
         批量清除 slide 中 @img-* 或 @svg-* 开头的 shape
@@ -0,0 +1,92 @@
+from pptx.slide import Slide
+
+
+class Slide_Index:
+    '''
+    ppt 中 slide 的索引，避免每次查找 slide 都遍历所有页面、读取 notes
+        slide_id -> slide
+        名称 -> slide，名称为 notes 的第一行或 slide.name，同名时取第一个
+    添加、删除页面或修改 notes 后需要调用 add / remove / update_name 保持索引有效
+    '''
+
+    def __init__(self, ppt):
+        self.ppt = ppt
+        self._by_id = None
+        self._by_name = None
+
+    @staticmethod
+    def get_slide_names(slide):
+        '''
+        slide 的名称，依次为 notes 的第一行和 slide.name
+        '''
+        names = []
+        if slide.has_notes_slide:
+            names.append(slide.notes_slide.notes_text_frame.text.split('\n')[0])
+        names.append(slide.name)
+        return names
+
+    def _build(self):
+        by_id = {}
+        for slide in self.ppt.slides:
+            by_id[slide.slide_id] = slide
+        self._by_id = by_id
+
+    def _build_names(self):
+        by_name = {}
+        for slide in self.ppt.slides:
+            for name in self.get_slide_names(slide):
+                by_name.setdefault(name, slide)
+        self._by_name = by_name
+
+    def get_by_id(self, slide_id):
+        if self._by_id is None:
+            self._build()
+        return self._by_id.get(slide_id)
+
+    def get_by_name(self, name):
+        if self._by_name is None:
+            self._build_names()
+        return self._by_name.get(name)
+
+    def get(self, slide_id):
+        '''
+        与 PPt_Generator._get_slide 的规则一致：
+        int 或数字字符串先按页码，再按 slide_id 查找；其余字符串按名称查找
+        '''
+        if isinstance(slide_id, Slide):
+            return slide_id
+
+        if isinstance(slide_id, str):
+            try:
+                slide_id = int(slide_id)
+            except ValueError:
+                return self.get_by_name(slide_id)
+
+        if isinstance(slide_id, int):
+            try:
+                return self.ppt.slides[slide_id]
+            except IndexError:
+                pass
+            return self.get_by_id(slide_id)
+
+    def add(self, slide):
+        if self._by_id is not None:
+            self._by_id[slide.slide_id] = slide
+        if self._by_name is not None:
+            for name in self.get_slide_names(slide):
+                self._by_name.setdefault(name, slide)
+
+    def remove(self, slide_id):
+        '''
+        删除 slide 后调用，slide 已经不在 ppt 中，无法再读取 slide.slide_id，需要传入 slide_id
+        '''
+        if self._by_id is not None:
+            self._by_id.pop(slide_id, None)
+        # 同名的其他页面需要顶上，直接重建名称索引
+        self._by_name = None
+
+    def update_name(self, slide):
+        '''
+        slide 的 notes 修改后调用
+        '''
+        self._by_name = None
@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .slide_index import Slide_Index
+
+
+class Parsed_Template:
+    '''
+    解析后的模板，由 template_compile 构建，在多个 generator 之间共享，只读
+        temp_ppt: 打开的模板 Presentation，用于复制页面和组件
+        color_parser: 模板主题色
+        component_list: 模板中的组件
+        section_dict: 模板中的 section，section 名称 -> slide id 列表
+        slide_index: 模板的 Slide_Index
+        blank_blob: 删除了所有页面和 section 的空白 ppt，新建 ppt 时直接打开
+        size: 缓存占用的估算大小（字节）
+        image_hashes: 模板中图片 part 的哈希，part -> sha1
+    '''
+
+    def __init__(self, temp_ppt, color_parser, component_list, section_dict, blank_blob, size, image_hashes=None):
+        self.temp_ppt = temp_ppt
+        self.color_parser = color_parser
+        self.component_list = component_list
+        self.section_dict = section_dict
+        self.slide_index = Slide_Index(temp_ppt)
+        self.blank_blob = blank_blob
+        self.size = size
+        self.image_hashes = image_hashes or {}
+
+
+class Template_Cache:
+    '''
+    进程内的模板缓存，key 为模板 id + 文件路径 + 修改时间 + 文件大小，模板文件更新后自动失效
+    按 LRU 淘汰，同时限制缓存数量和估算的内存占用
+    '''
+
+    # 打开后的 lxml 树比 pptx 压缩包大很多，按文件大小的倍数估算内存占用
+    MEMORY_FACTOR = 8
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_size = 0
+        self._lock = threading.Lock()
+
+    def _get_key(self, template, path):
+        stat = os.stat(path)
+        return (template.id, path, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, template, loader):
+        '''
+        获取解析后的模板，没有缓存时调用 loader(path) 解析，返回 Parsed_Template
+        '''
+        path = template.file.path
+        key = self._get_key(template, path)
+
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                return parsed
+
+        # 解析比较耗时，不占用锁，偶尔重复解析也没有关系
+        parsed = loader(path)
+        if parsed.size is None:
+            parsed.size = key[3] * self.MEMORY_FACTOR
+
+        if self.max_entries <= 0:
+            return parsed
+
+        with self._lock:
+            # 同一个模板的旧版本不会再被用到
+            for old_key in [k for k in self._entries if k[0] == key[0] and k != key]:
+                self._remove(old_key)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = parsed
+            self._total_size += parsed.size
+            self._evict()
+
+        return parsed
+
+    def _remove(self, key):
+        parsed = self._entries.pop(key)
+        self._total_size -= parsed.size
+
+    def _evict(self):
+        # 至少保留最新的一个
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._total_size > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, template_id=None):
+        '''
+        删除缓存，不传 template_id 时清空
+        '''
+        with self._lock:
+            for key in [k for k in self._entries if template_id is None or k[0] == template_id]:
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 进程内共享的模板缓存
+template_cache = Template_Cache(
+    settings.TEMPLATE_CACHE_ENTRIES,
+    settings.TEMPLATE_CACHE_MAX_MB * 1024 * 1024
+)
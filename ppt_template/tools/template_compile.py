@@ -0,0 +1,225 @@
+'''
+模板的预编译
+    上传模板时把 PPt_Generator 需要的解析结果保存到模板旁边的 <模板名>.compiled 文件（zip）中：
+        manifest.json: 版本、模板文件的修改时间和大小、section（名称 -> slide id）、
+            组件（所在页面和位置、尺寸、placeholder）、主题色板、模板中图片 part 的哈希
+        blank.pptx: 删除了所有页面和 section 的空白 ppt
+    generator 加载模板时优先读取编译结果，只需要打开模板本身（复制页面和组件时使用），
+    不再提取组件、计算色板、生成空白 ppt
+    编译结果与模板文件不一致（修改时间、大小变化）或者版本不同时忽略，回到解析模板
+    每页的 placeholder 在上传时由 Template_Parser 保存在 PPt_Template.slide_templates 中，这里不重复保存
+    解析模板（parse_template）只需要模板文件，不依赖 PPt_Generator
+'''
+
+import hashlib
+import io
+import json
+import os
+import uuid
+import zipfile
+
+from pptx import Presentation
+
+from .ppt_color_parse import Color_Parser
+from .placeholder_grammar import find_component, get_shape_placeholders, sort_placeholders
+from .template_cache import Parsed_Template
+
+COMPILE_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+BLANK_NAME = 'blank.pptx'
+
+# 组件中保存到 manifest 的字段，element 在加载时根据位置从模板中获取
+COMPONENT_KEYS = ('name', 'slide', 'shape', 'child', 'width', 'height', 'placeholders')
+
+# section 所在的 namespace
+NS = {'p14': 'http://schemas.microsoft.com/office/powerpoint/2010/main'}
+
+
+def get_compiled_path(template_path):
+    return f'{os.path.splitext(template_path)[0]}.compiled'
+
+
+def hash_image_parts(prs):
+    '''
+    模板中图片 part 的哈希：part -> sha1，复制图片时不需要每次重新计算
+    '''
+    return {
+        part: hashlib.sha1(part.blob).hexdigest()
+        for part in prs.part.package.iter_parts()
+        if part.content_type.startswith('image/')
+    }
+
+
+def dump_color_scheme(color_scheme):
+    '''
+    Color_Parser.color_scheme 中 brightness 是 float 的 key，转换为列表保存
+    '''
+    return {
+        theme_name: {
+            tag: [[bright, color['rgb_hex'], color['rgb_int'], color['hsl']] for bright, color in colors.items()]
+            for tag, colors in theme.items()
+        }
+        for theme_name, theme in color_scheme.items()
+    }
+
+
+def load_color_scheme(data):
+    return {
+        theme_name: {
+            tag: {
+                bright: {'rgb_hex': rgb_hex, 'rgb_int': tuple(rgb_int), 'hsl': tuple(hsl)}
+                for bright, rgb_hex, rgb_int, hsl in colors
+            }
+            for tag, colors in theme.items()
+        }
+        for theme_name, theme in data.items()
+    }
+
+
+def get_sections(prs):
+    '''
+    模板中的 section：section 名称 -> slide id 列表
+    '''
+    return {
+        section.get('name'): section.xpath('./p14:sldIdLst/p14:sldId/@id', namespaces=NS)
+        for section in prs.element.iter(f'{{{NS["p14"]}}}section')
+    }
+
+
+def extract_components(prs):
+    '''
+    提取模板中的组件（见 placeholder_grammar.find_component），同时记录组件在模板中的位置（slide、shape、child）
+    '''
+    component_list = []
+    for slide_i, slide in enumerate(prs.slides):
+        for shape_i, shape in enumerate(slide.shapes):
+            found = find_component(shape)
+            if found is None:
+                continue
+            component_name, component, child_i = found
+
+            # 计算比例尺
+            origin_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:ext/@cx')[0])
+            scaled_width = int(shape.element.xpath('./p:grpSpPr/a:xfrm/a:chExt/@cx')[0])
+            scale = origin_width / scaled_width
+
+            component_list.append({
+                'name': component_name,
+                'element': component,
+                # 组件在模板中的位置，加载预编译的模板时使用
+                'slide': slide_i,
+                'shape': shape_i,
+                'child': child_i,
+                'width': component.width * scale,
+                'height': component.height * scale,
+                'placeholders': sort_placeholders(get_shape_placeholders(component, component_list)),
+            })
+
+    return component_list
+
+
+def _build_blank_blob(template_path):
+    '''
+    生成空白 ppt：删除模板中的所有页面和 section，保存时会自动删除没有引用的素材
+    '''
+    prs = Presentation(template_path)
+    slide_id_list = prs.slides._sldIdLst
+    for slide_id in list(slide_id_list):
+        prs.part.drop_rel(slide_id.rId)
+        slide_id_list.remove(slide_id)
+    for section_list in list(prs.element.iter(f'{{{NS["p14"]}}}sectionLst')):
+        section_list.getparent().remove(section_list)
+
+    blank_file = io.BytesIO()
+    prs.save(blank_file)
+    return blank_file.getvalue()
+
+
+def parse_template(template_path):
+    '''
+    解析模板文件，返回 Parsed_Template
+    '''
+    temp_ppt = Presentation(template_path)
+    return Parsed_Template(
+        temp_ppt, Color_Parser(temp_ppt), extract_components(temp_ppt), get_sections(temp_ppt),
+        _build_blank_blob(template_path), None, hash_image_parts(temp_ppt)
+    )
+
+
+def _get_source_info(template_path):
+    stat = os.stat(template_path)
+    return {'version': COMPILE_VERSION, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def save_compiled(template_path, parsed_template):
+    '''
+    保存 Parsed_Template 的编译结果，组件需要包括 slide、shape、child 位置，返回编译结果的路径
+    '''
+    manifest = _get_source_info(template_path)
+    manifest.update({
+        'sections': parsed_template.section_dict,
+        'components': [{key: c[key] for key in COMPONENT_KEYS} for c in parsed_template.component_list],
+        'color_scheme': dump_color_scheme(parsed_template.color_parser.color_scheme),
+        'image_hashes': {str(part.partname): sha1 for part, sha1 in parsed_template.image_hashes.items()},
+    })
+
+    compiled_path = get_compiled_path(template_path)
+    tmp_path = f'{compiled_path}.{uuid.uuid4().hex}.tmp'
+    with zipfile.ZipFile(tmp_path, 'w') as f:
+        f.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False), zipfile.ZIP_DEFLATED)
+        # pptx 本身已经压缩过
+        f.writestr(BLANK_NAME, parsed_template.blank_blob, zipfile.ZIP_STORED)
+    os.replace(tmp_path, compiled_path)
+    return compiled_path
+
+
+def load_compiled(template_path):
+    '''
+    读取编译结果，返回 (manifest, blank_blob)
+    没有编译结果、编译结果损坏或者与模板文件不一致时返回 None
+    '''
+    compiled_path = get_compiled_path(template_path)
+    try:
+        with zipfile.ZipFile(compiled_path) as f:
+            manifest = json.loads(f.read(MANIFEST_NAME))
+            source_info = _get_source_info(template_path)
+            if any(manifest.get(key) != value for key, value in source_info.items()):
+                return None
+            return manifest, f.read(BLANK_NAME)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def load_template(template_path):
+    '''
+    获取解析后的模板，有编译结果时根据编译结果构建，组件的 element 按保存的位置从模板中获取，否则解析模板
+    '''
+    compiled = load_compiled(template_path)
+    if compiled is None:
+        return parse_template(template_path)
+    manifest, blank_blob = compiled
+
+    temp_ppt = Presentation(template_path)
+    color_parser = Color_Parser(temp_ppt, load_color_scheme(manifest['color_scheme']))
+
+    slides = temp_ppt.slides
+    component_list = []
+    for component in manifest['components']:
+        component = dict(component)
+        component['element'] = slides[component['slide']].shapes[component['shape']].shapes[component['child']]
+        component_list.append(component)
+
+    parts = {str(part.partname): part for part in temp_ppt.part.package.iter_parts()}
+    image_hashes = {parts[name]: sha1 for name, sha1 in manifest['image_hashes'].items() if name in parts}
+
+    return Parsed_Template(
+        temp_ppt, color_parser, component_list, manifest['sections'], blank_blob, None, image_hashes
+    )
+
+
+def compile_template(template_path):
+    '''
+    预编译模板，结果保存在模板旁边，上传模板时调用，返回编译结果的路径
+    '''
+    return save_compiled(template_path, parse_template(template_path))
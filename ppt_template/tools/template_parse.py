@@ -1,10 +1,12 @@
 from pptx import Presentation
-from pptx.enum.shapes import MSO_SHAPE_TYPE
 import json
 import re
 import uuid
 from lxml import etree
 
+from .placeholder_grammar import find_component, get_shape_placeholders, sort_placeholders
+from .slide_index import Slide_Index
+
 class Template_Parser():
     '''
     解析 ppt 模板文件
@@ -23,57 +25,33 @@ class Template_Parser():
         self.template_file_path = tempalte_file_path
         self.logger = logger
         self.prs = Presentation(self.template_file_path)
+        # slide_id、名称 -> slide 的索引，所有提取过程共用
+        self.slide_index = Slide_Index(self.prs)
 
         self.sections = self.extract_sections()
+        # section 中的 slide_id，判断页面是否是模板时使用
+        self._template_slide_ids = {int(slide['id']) for slide in self.sections.get('templates', [])}
+        self._section_slide_ids = {int(slide['id']) for slides in self.sections.values() for slide in slides}
         self.components, self.lost_components = self.extract_components(required_components)
         self.slide_templates = self.extract_slide_templates()
 
 
     def _get_slide(self, slide_id, ppt=None):
 
-        if ppt is None: ppt = self.prs
-
-        # 获取指定 slide
-        if isinstance(slide_id, int):
-            try:
-                return ppt.slides[slide_id]
-            except IndexError:
-                pass
-
-            try:
-                return ppt.slides.get(slide_id)
-            except IndexError:
-                pass
-        
-        if isinstance(slide_id, str):
-
-            try:
-                slide_id = int(slide_id)
-                try:
-                    return ppt.slides[slide_id]
-                except IndexError:
-                    pass
-
-
-                try:
-                    return ppt.slides.get(slide_id)
-                except IndexError:
-                    pass
-            except ValueError:
-                pass
-
-            for slide in ppt.slides:
-                if slide.has_notes_slide:
-                    slide_name = slide.notes_slide.notes_text_frame.text.split('\n')[0]
-                    if slide_name == slide_id:
-                        return slide
-                if slide.name == slide_id:
-                    return slide
-            
-            return None
+        # 获取指定 slide：int 或数字先按页码、再按 slide_id 查找，其余按 notes 第一行或 slide.name 查找
+        if ppt is None or ppt is self.prs:
+            return self.slide_index.get(slide_id)
+        return Slide_Index(ppt).get(slide_id)
 
-        if isinstance(slide_id, Slide):
-            return slide_id
+    def _is_template_slide(self, slide):
+        '''
+        有 templates section 时只使用其中的页面；有其他 section 但没有 templates 时，跳过 section 中的页面
+        '''
+        if self.sections == {}:
+            return True
+        if 'templates' in self.sections.keys():
+            return slide.slide_id in self._template_slide_ids
+        return slide.slide_id not in self._section_slide_ids
 
     def _get_slide_name(self, slide):
 
@@ -130,17 +108,9 @@ class Template_Parser():
         '''
         data_list = []
         for i, slide in enumerate(self.prs.slides):
-            # 如果 slide_id 不在 templates 中，那么跳过
-            if self.sections != {} and 'templates' in self.sections.keys() and slide.slide_id not in[int(slide['id']) for slide in  self.sections['templates']]:
+            # 如果 slide_id 不在 templates 中，或者有章节但没有 templates 时在章节中，那么跳过
+            if not self._is_template_slide(slide):
                 continue
-            # 如果有章节，但没有 templates，那么跳过章节中的内容
-            skip = False
-            if self.sections != {} and 'templates' not in self.sections.keys():
-                for section in self.sections:
-                    if slide.slide_id in [int(slide['id']) for slide in self.sections[section]]:
-                        skip = True
-                        break
-                if skip: continue
             
             slide_data = {
                 'id': i,
@@ -183,101 +153,15 @@ class Template_Parser():
             #                 slide_data['placeholder'].append(placeholder_data)
             placeholder_list = []
             for shape in slide.shapes:
-                spl = self._get_placeholder(shape)
-                if spl != []: placeholder_list.extend(spl)
-            slide_data['placeholders'] = self._sort_placeholders(placeholder_list)
+                spl = get_shape_placeholders(shape, self.components)
+                if spl != [] and spl != 'component': placeholder_list.extend(spl)
+            slide_data['placeholders'] = sort_placeholders(placeholder_list)
 
             data_list.append(slide_data)
         
         # self.template_data = data_list
         return data_list
 
-    def _sort_placeholders(self, placeholder_list):
-        '''
-        对 placeholder 进行排序，按照 name 排序
-        '''
-        return sorted(placeholder_list, key=lambda x: x['name'])
-
-
-    
-    def _get_placeholder(self, shape):
-        '''
-        从 shape 中提取 placeholder，如果是 @-c 开头，那么是组件，这部分要通知上层的 group 进行跳过
-        '''
-        placeholder_list = []
-        if shape.has_text_frame:
-            text = shape.text_frame.text
-
-            if text.startswith('#'):
-                return 'component'
-
-            if text.startswith('@'):
-
-                text = text[1:]
-                if text.startswith('img-'):
-                    type = 'img'
-                    text = text[4:]
-                elif text.startswith('svg-'):
-                    type = 'svg'
-                    text = text[4:]
-                elif text.startswith('container-'):
-                    type = 'container'
-                    text = text[10:]
-                elif text.startswith('icon-'):
-                    type = 'icon'
-                    text = text[5:]
-                else:
-                    # diy 前缀需要保留在 name 中，同时 type 为空
-                    type = 'text'
-
-                # 寻找 name(style)：notes，(style) 和 ：notes 都可能不存在
-                # pattern = r'^(?P<name>[^(:\n]+)(?:[\(（](?P<style>[^()]*)[\)）])?(?:[\:：](?P<notes>.*))?$'
-                pattern = r'^(?P<name>[^(:：\(\)（）\n]+)(?:[(\uff08](?P<style>[^()（）]*?)[)\uff09])?(?:[:\uff1a](?P<notes>.*))?$'
-                match = re.match(pattern, text)
-
-                if match:
-                    data = dict(name=match.group('name'))
-                    data['type'] = type
-                    if match.group('style') != None:
-                        data['style'] = match.group('style')
-                    if match.group('notes') != None:
-                        data['description'] = match.group('notes')
-
-                # 对 container 获取 component_placeholders min_component_number max_component_number
-                if type == 'container':
-                    component = [ c for c in self.components if c['name'] == data['name']]
-                    if component != []:
-                        data['component_placeholders'] = component[0]['placeholders']
-
-                    style_dict = self._parse_style(data['style'])
-                    data['min_component_number'] = int(style_dict['min_n']) if 'min_n' in style_dict else 1
-                    data['max_component_number'] = int(style_dict['max_n']) if 'max_n' in style_dict else 5
-
-                placeholder_list.append(data)
-        elif shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-            for sub_shape in shape.shapes:
-                sub_pl = self._get_placeholder(sub_shape)
-                if sub_pl != 'component' and sub_pl != []: placeholder_list.extend(sub_pl)
-
-        return placeholder_list
-
-    
-    def _parse_style(self, style_str):
-        '''
-        解析 style_str，返回一个 dict
-        '''
-        style_dict = {}
-        style_list = style_str.split(' ')
-        for style in style_list:
-            if '-' in style:
-                key, value = style.split('-', 1)
-                style_dict[key] = value
-            else:
-                style_dict[style] = ''
-
-        return style_dict
-
-    
     def extract_components(self, required_components = ['title', 'text']):
         '''
         从页面中提取组件，组件是一个 group 元素，包含一个 # 开头的 text
@@ -285,47 +169,20 @@ class Template_Parser():
         返回 json
         '''
         component_list = []
-        # 遍历所有编组的形状
         for slide in self.prs.slides:
-            # 如果 slide_id 不在 templates 中，那么跳过
-            if self.sections != {} and 'templates' in self.sections.keys() and slide.slide_id not in[int(slide['id']) for slide in  self.sections['templates']]:
+            # 如果 slide_id 不在 templates 中，或者有章节但没有 templates 时在章节中，那么跳过
+            if not self._is_template_slide(slide):
                 continue
-            # 如果有章节，但没有 templates，那么跳过章节中的内容
-            skip = False
-            if self.sections != {} and 'templates' not in self.sections.keys():
-                for section in self.sections:
-                    if slide.slide_id in [int(slide['id']) for slide in self.sections[section]]:
-                        skip = True
-                        break
-                if skip: continue
 
             for shape in slide.shapes:
-                if shape.shape_type == MSO_SHAPE_TYPE.GROUP and len(shape.shapes) == 2:
-                # 理论上只有两个元素，一个 text，另一个是 group、text 或其他
-                    is_component = False
-                    component_name = ''
-                    component_xml = ''
-                    sub_shapes = shape.shapes
-                    sub_shape_1 = sub_shapes[0]
-                    sub_shape_2 = sub_shapes[1]
-                    if sub_shape_1.has_text_frame and sub_shape_1.text.startswith('#'):
-                        is_component = True
-                        component_name = sub_shape_1.text[1:]
-                        component_xml = sub_shape_2.element.xml
-                        component = sub_shape_2
-                    elif sub_shape_2.has_text_frame and sub_shape_2.text.startswith('#'):
-                        is_component = True
-                        component_name = sub_shape_2.text[1:]
-                        component_xml = sub_shape_1.element.xml
-                        component = sub_shape_1
-
-                    if is_component:
-                        if component_name != '' and component_xml != '':
-                            component_list.append({
-                                'name': component_name,
-                                # 'xml': component_xml,
-                                'placeholders': self._sort_placeholders(self._get_placeholder(component))
-                            })
+                found = find_component(shape)
+                if found is None:
+                    continue
+                component_name, component, _ = found
+                component_list.append({
+                    'name': component_name,
+                    'placeholders': sort_placeholders(get_shape_placeholders(component, component_list))
+                })
 
         components_names = [item['name'] for item in component_list]
         lost_components = []
@@ -11,7 +11,7 @@ from django.views.decorators.http import require_POST
 
 # 列出所有当前用户的 ppt_template
 def list_ppt_template(request):
-    ppt_templates = PPt_Template.objects.filter(user=request.user).values('id', 'name', 'created_at')
+    ppt_templates = PPt_Template.objects.filter(user=request.user).values('id', 'name', 'created_at', 'parse_status')
     return JsonResponse({'ppt_templates': list(ppt_templates)})
 
 
@@ -57,7 +57,11 @@ def create_ppt_template(request):
             None
         )
         ppt_template = PPt_Template.objects.create(user=request.user, name=name, file=template_file)
-        return JsonResponse({'id': ppt_template.id, 'name': ppt_template.name, 'created_at': str(ppt_template.created_at)})
+        return JsonResponse({
+            'id': ppt_template.id, 'name': ppt_template.name, 'created_at': str(ppt_template.created_at),
+            # 较大的模板在后台解析，解析完成前为 pending
+            'parse_status': ppt_template.parse_status,
+        })
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 # 删除 ppt_template
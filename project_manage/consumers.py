@@ -6,7 +6,6 @@ from django.core.files import File
 # 引入 sync_to_async
 from asgiref.sync import sync_to_async
 
-from openai import AsyncOpenAI
 import os
 import base64
 
@@ -19,7 +18,9 @@ from project_manage.models import Project_Template
 from knowledge_base.models import Knowledge_Base
 from knowledge_base.tools.chroma_driver import Chroma_Driver
 
-from ppt_template.tools.ppt_generate import PPt_Generator
+from ppt_template.tools.generate_executor import generation_executor
+from ppt_template.tools.generate_profiler import Generation_Profiler, profile_stage
+from .tools.llm_gateway import llm_gateway, iter_completed, PRIORITY_BULK
 
 import asyncio
 
@@ -79,6 +80,14 @@ class CreateProject(AsyncWebsocketConsumer):
         template_json = data.get('template', '')
         template_id = template_json['id']
         template = await PPt_Template.objects.aget(id=template_id)
+        # 模板在后台解析完成前没有页面样式，不能用于创建项目
+        if template.get_parse_error():
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': template.get_parse_error()
+            }), close=True)
+            return
+
         project_template = data.get('project_template', '')
         if project_template:
             project_template_id = project_template['id']
@@ -135,27 +144,8 @@ class CreateProject(AsyncWebsocketConsumer):
             .replace('{reference_tasks}', json.dumps(reference_tasks, ensure_ascii=False))
         )
 
-        # 配置OpenAI客户端
-        try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '未配置OpenAI API密钥'
-            }))
-            return
-
         # 调用OpenAI API生成任务
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[{'role': 'user', 'content': prompt}]
-        )
-
-        # # 解析LLM响应
-        tasks_content = response.choices[0].message.content.strip()
+        tasks_content = await llm_gateway.chat([{'role': 'user', 'content': prompt}])
         # material_tasks = json.loads(tasks_content)
 
         # 保存任务到项目
@@ -277,19 +267,6 @@ class GenerateOutline(AsyncWebsocketConsumer):
                 default_outline = []
 
 
-            # 配置OpenAI客户端
-            try:
-                client = AsyncOpenAI(
-                    base_url = settings.LLM_BASE_URL,
-                    api_key = settings.LLM_API_KEY
-                )
-            except:
-                await self.send(json.dumps({
-                    'status': 'error',
-                    'message': '未配置OpenAI API密钥'
-                }), close=True)
-                return
-
             await self.send(json.dumps({
                 'status': 'doing',
                 'step': 2,
@@ -314,13 +291,7 @@ class GenerateOutline(AsyncWebsocketConsumer):
 
 
             # 调用OpenAI API生成任务
-            response = await client.chat.completions.create(
-                model=settings.LLM_MODEL,
-                messages=[{'role': 'user', 'content': prompt}]
-            )
-
-            # # 解析LLM响应
-            tasks_content = response.choices[0].message.content.strip()
+            tasks_content = await llm_gateway.chat([{'role': 'user', 'content': prompt}])
             await self.send(json.dumps({
                 'status': 'doing',
                 'step': 3,
@@ -522,19 +493,6 @@ class AutoDocRelations(AsyncWebsocketConsumer):
         with open(prompt_file_path, encoding='utf-8') as f:
             prompt_temp = f.read()
 
-        # 配置OpenAI客户端
-        try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '未配置OpenAI API密钥'
-            }))
-            return
-
         # 准备针对叶子节点，进行遍历
         leaf_nodes = project.get_all_leaf_nodes(project.outline)
         for i in range(len(leaf_nodes)):
@@ -570,14 +528,8 @@ class AutoDocRelations(AsyncWebsocketConsumer):
 
             print(prompt)
 
-            # 调用OpenAI API生成任务
-            response = await client.chat.completions.create(
-                model=settings.LLM_MODEL,
-                messages=[{'role': 'user', 'content': prompt}]
-            )
-
-            # 解析LLM响应
-            response = response.choices[0].message.content.strip()
+            # 调用OpenAI API生成任务，逐页处理整个项目，按批量请求排队
+            response = await llm_gateway.chat([{'role': 'user', 'content': prompt}], priority=PRIORITY_BULK)
             doc_list = self.llm_response_to_dict(response)
 
             print(doc_list)
@@ -644,20 +596,16 @@ class GenerateFullText(AsyncWebsocketConsumer):
             prompt_temp = f.read()
 
         leaf_nodes = project.get_all_leaf_nodes(project.outline)
-
-        for i in range(len(leaf_nodes)):
-
-            ppt_page_dict = leaf_nodes[i]
+        ppt_pages = []
+        for ppt_page_dict in leaf_nodes:
             try:
-                ppt_page = await PPt_Page.objects.aget(id=ppt_page_dict['id'], p_type='content')
+                ppt_pages.append(await PPt_Page.objects.aget(id=ppt_page_dict['id'], p_type='content'))
             except:
                 continue
 
-            await self.send(json.dumps({
-                'status': 'doing',
-                'message': f'({i+1}/{len(leaf_nodes)}) 正在处理 {ppt_page.name}'
-            }))
+        outline_md = '\n'.join(project.trans_outline_to_md_list())
 
+        async def generate_page(ppt_page):
 
             related_files = []
             async for rel in Page_and_Doc.objects.filter(ppt_page=ppt_page).select_related('document'):
@@ -674,7 +622,7 @@ class GenerateFullText(AsyncWebsocketConsumer):
                 .replace('{duration}', str(project.duration))
                 .replace('{target}', project.target)
 
-                .replace('{outline}', '\n'.join(project.trans_outline_to_md_list()))
+                .replace('{outline}', outline_md)
                 .replace('{title}', f'{ppt_page.name}: {ppt_page.description}')
                 .replace('{reference_materials}', '\n\n'.join([
                     f'## {rel['name']}\n\n{rel['content']}'
@@ -684,32 +632,38 @@ class GenerateFullText(AsyncWebsocketConsumer):
 
             ppt_page.prompt = prompt
             await ppt_page.asave()
-        
 
-            # 调用 OpenAI API 生成文档
-            try:
-                client = AsyncOpenAI(
-                    base_url = settings.LLM_BASE_URL,
-                    api_key = settings.LLM_API_KEY
-                )
-            except:
-                await self.send(json.dumps({
-                    'status': 'error',
-                    'message': '无法完成请求'
-                }), close=True)
-                return
-            
-            # 调用 OpenAI API 生成文档
-            response = await client.chat.completions.create(
-                model=settings.LLM_MODEL,
-                messages=[{'role': 'user', 'content': prompt}]
-            )
+            # 调用 OpenAI API 生成文档，并发数量和限流重试由 llm_gateway 控制
+            ppt_page.full_text = await llm_gateway.chat([{'role': 'user', 'content': prompt}], priority=PRIORITY_BULK)
+            await ppt_page.asave()
 
-            # 解析LLM响应
-            response = response.choices[0].message.content.strip()
+        await self.send(json.dumps({
+            'status': 'doing',
+            'message': f'正在生成 {len(ppt_pages)} 个页面的全文'
+        }))
 
-            ppt_page.full_text = response
-            await ppt_page.asave()
+        # 所有页面同时开始，按完成的顺序发送进度，一个页面失败不影响其他页面
+        failed_pages = []
+        k = 0
+        async for ppt_page, _, error in iter_completed([(ppt_page, generate_page(ppt_page)) for ppt_page in ppt_pages]):
+            k += 1
+            if error is not None:
+                print(f'生成全文失败 {ppt_page.name}: {error}')
+                failed_pages.append(ppt_page.name)
+                message = f'({k}/{len(ppt_pages)}) 生成失败：{ppt_page.name}'
+            else:
+                message = f'({k}/{len(ppt_pages)}) 已完成：{ppt_page.name}'
+            await self.send(json.dumps({
+                'status': 'doing',
+                'message': message
+            }))
+
+        if failed_pages:
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': f'以下页面生成失败：{"、".join(failed_pages)}',
+            }), close=True)
+            return
 
         await self.send(json.dumps({
             'status': 'success',
@@ -732,49 +686,6 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         print('disconnect')
 
-    async def request_llm(self, prompt_system, prompt):
-
-        # 调用 OpenAI API 生成文档
-        try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '无法完成请求'
-            }), close=True)
-            return
-        
-        # 调用 OpenAI API 生成文档
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': prompt_system}, 
-                {'role': 'user', 'content': prompt}
-            ]
-        )
-
-        # 解析LLM响应
-        response = response.choices[0].message.content.strip()
-
-
-        if response.startswith('```json'):
-            response = response[7:-3]
-
-        try:
-            response_dict = json.loads(response)
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '生成的数据有误'
-            }), close=True)
-            return
-        
-        return response_dict
-
-    
     async def receive(self, text_data):
 
         try:
@@ -798,6 +709,14 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
             }), close=True)
             return
 
+        # 模板在后台解析完成前没有页面样式，不能用于生成
+        if template is not None and template.get_parse_error():
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': template.get_parse_error()
+            }), close=True)
+            return
+
         # 从 generate_slide_data_user.md 中获取 prompt 模板
         work_dir = os.getcwd()
         prompt_file_path = os.path.join(work_dir, 'prompts', 'generate_slide_data_user.md')
@@ -811,20 +730,13 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
 
         
         leaf_nodes = project.get_all_leaf_nodes(project.outline)
-        # 开始项目中的页面替换
-        for i in range(len(leaf_nodes)):
-
-            ppt_page_dict = leaf_nodes[i]
+        jobs = []
+        for ppt_page_dict in leaf_nodes:
             try:
                 ppt_page = await PPt_Page.objects.aget(id=ppt_page_dict['id'], p_type='content')
             except:
                 continue
 
-            await self.send(json.dumps({
-                'status': 'doing',
-                'message': f'({i+1}/{len(leaf_nodes)}) 正在处理 {ppt_page.name}'
-            }))
-            
             full_text = ppt_page.full_text
             if full_text == None:
                 continue
@@ -843,14 +755,45 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
                 prompt_temp.replace('{full_text}', full_text)
                 .replace('{slide_templates}', template_str)
             )
-            response_dict = await self.request_llm(prompt_system, prompt)    
-            await Page_and_Template.objects.aupdate_or_create(
-                ppt_page=ppt_page,
-                ppt_template=template,
-                defaults={
-                    'data': response_dict
-                }
-            )
+            jobs.append((ppt_page, prompt))
+
+        await self.send(json.dumps({
+            'status': 'doing',
+            'message': f'正在生成 {len(jobs)} 个页面的数据'
+        }))
+
+        async def request_llm(prompt):
+            return await llm_gateway.chat_json([
+                {'role': 'system', 'content': prompt_system},
+                {'role': 'user', 'content': prompt}
+            ], priority=PRIORITY_BULK)
+
+        # 所有页面同时请求大模型，按完成的顺序发送进度，全部完成后一次保存
+        page_data = {}
+        failed_pages = []
+        k = 0
+        async for ppt_page, response_dict, error in iter_completed([(ppt_page, request_llm(prompt)) for ppt_page, prompt in jobs]):
+            k += 1
+            if error is not None:
+                print(f'生成页面数据失败 {ppt_page.name}: {error}')
+                failed_pages.append(ppt_page.name)
+                message = f'({k}/{len(jobs)}) 生成失败：{ppt_page.name}'
+            else:
+                page_data[ppt_page.id] = response_dict
+                message = f'({k}/{len(jobs)}) 已完成：{ppt_page.name}'
+            await self.send(json.dumps({
+                'status': 'doing',
+                'message': message
+            }))
+
+        await sync_to_async(Page_and_Template.bulk_save_data)(template, page_data)
+
+        if failed_pages:
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': f'以下页面生成的数据有误：{"、".join(failed_pages)}',
+            }), close=True)
+            return
 
         await self.send(json.dumps({
             'status': 'success',
@@ -859,6 +802,9 @@ class  GenerateSlideData(AsyncWebsocketConsumer):
 
 
 class GeneratePPT(AsyncWebsocketConsumer):
+
+    # 开启 settings.GENERATION_PROFILE 时统计各阶段耗时
+    profiler = None
     
     async def connect(self):
 
@@ -873,47 +819,27 @@ class GeneratePPT(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         print('disconnect')
 
-    async def request_llm(self, prompt_system, prompt):
+    async def send_doing(self, message):
+        '''
+        发送进度，开启耗时统计时附带各阶段的耗时
+        '''
+        data = {
+            'status': 'doing',
+            'message': message
+        }
+        if self.profiler is not None:
+            data['profile'] = self.profiler.summary()
+        await self.send(json.dumps(data))
 
-        # 调用 OpenAI API 生成文档
-        try:
-            client = AsyncOpenAI(
-                base_url = settings.LLM_BASE_URL,
-                api_key = settings.LLM_API_KEY
-            )
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '无法完成请求'
-            }), close=True)
-            return
-        
-        # 调用 OpenAI API 生成文档
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[
+    async def request_llm(self, prompt_system, prompt):
+        '''
+        请求大模型生成 slide_data，回复不是合法的 json 时抛出 ValueError
+        '''
+        with profile_stage(self.profiler, 'llm'):
+            return await llm_gateway.chat_json([
                 {'role': 'system', 'content': prompt_system}, 
                 {'role': 'user', 'content': prompt}
-            ]
-        )
-
-        # 解析LLM响应
-        response = response.choices[0].message.content.strip()
-
-
-        if response.startswith('```json'):
-            response = response[7:-3]
-
-        try:
-            response_dict = json.loads(response)
-        except:
-            await self.send(json.dumps({
-                'status': 'error',
-                'message': '生成的数据有误'
-            }), close=True)
-            return
-        
-        return response_dict
+            ], priority=PRIORITY_BULK)
 
     async def receive(self, text_data):
 
@@ -936,7 +862,15 @@ class GeneratePPT(AsyncWebsocketConsumer):
             }), close=True)
             return
         template = project.ppt_template
-        
+
+        # 模板在后台解析完成前没有页面样式，不能用于生成
+        if template is not None and template.get_parse_error():
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': template.get_parse_error()
+            }), close=True)
+            return
+
         ppt_generate, created = await PPt_Generate.objects.aget_or_create(
             project=project,
             defaults={'current_stage': 'file_generation'}
@@ -947,12 +881,13 @@ class GeneratePPT(AsyncWebsocketConsumer):
         # 如果 temp_file_path 存在，删除
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
-        ppt_generator = PPt_Generator(temp_file_path, template)
+        # 增量生成：在上次的中间文件基础上，只重新生成有变化的页面
+        reuse_file = ppt_generate.intermediate_file.path if ppt_generate.intermediate_file else None
+        if settings.GENERATION_PROFILE:
+            self.profiler = Generation_Profiler(f'project_{project.id}')
+        ppt_generator = await generation_executor.create_generator(temp_file_path, template, reuse_file, self.profiler)
 
-        await self.send(json.dumps({
-                'status': 'doing',
-                'message': '获取页面数据'
-            }))
+        await self.send_doing('获取页面数据')
 
 
         # # 获取标题页
@@ -992,41 +927,108 @@ class GeneratePPT(AsyncWebsocketConsumer):
         with open(prompt_system_file_path, encoding='utf-8') as f:
             prompt_system = f.read()
 
-        # 先生成标题页
-        await self.send(json.dumps({
-                'status': 'doing',
-                'message': f'正在处理标题页'
-            }))
+        # 先准备所有需要大模型生成的页面（标题页、章节页），同时请求，再按顺序组装
+        # llm_jobs: [(ppt_page, prompt)]，llm_data: {ppt_page.id: slide_data}
+        llm_jobs = []
+        llm_data = {}
+
         title_page, created = await PPt_Page.objects.aget_or_create(
             project=project,
             p_type='construct',
             name='标题'
         )
 
-        # 替换 prompt 模板中的变量
-        prompt = (
-            prompt_temp.replace('{full_text}', f'项目主题：{project.theme}')
-            .replace('{slide_templates}', json.dumps(template.cover_template, ensure_ascii=False))
-        )
+        # 标题页没有变化时，不再请求大模型
+        cover_source = f'项目主题：{project.theme}'
+        title_page_and_temp = await Page_and_Template.objects.filter(ppt_page=title_page, ppt_template=template).afirst()
+        if title_page_and_temp and title_page_and_temp.data and await ppt_generator.is_page_unchanged(
+            title_page.id, title_page_and_temp.data, source=cover_source
+        ):
+            llm_data[title_page.id] = title_page_and_temp.data
+        else:
+            # 替换 prompt 模板中的变量
+            prompt = (
+                prompt_temp.replace('{full_text}', cover_source)
+                .replace('{slide_templates}', json.dumps(template.cover_template, ensure_ascii=False))
+            )
+            llm_jobs.append((title_page, prompt))
 
-        response_dict = await self.request_llm(prompt_system, prompt)
+        flatten_outline = project.flatten_outline()
 
-        title_page_and_temp, created = await Page_and_Template.objects.aupdate_or_create(
-            ppt_page=title_page,
-            ppt_template=template,
-            defaults={
-                'data': response_dict
-            }
-        )
-        ppt_generator.add_slide(response_dict)
-        
+        # 已有的 slide_data：ppt_page.id -> data
+        saved_data = {
+            page_and_temp.ppt_page_id: page_and_temp.data
+            async for page_and_temp in Page_and_Template.objects.filter(ppt_page__project=project, ppt_template=template)
+        }
+
+        # 大纲中的页面：(ppt_page_dict, ppt_page, 章节页的 (full_text, template_str))
+        outline_pages = []
+        no_L1 = 0
+        no_L2 = 0
+        for ppt_page_dict in flatten_outline:
+            try:
+                ppt_page = await PPt_Page.objects.aget(id=ppt_page_dict['id'])
+            except:
+                continue
+
+            chapter = None
+            if 'chapter' in ppt_page_dict.keys():
+                level = ppt_page_dict['level']
+                if level == 1: 
+                    no_L1 += 1
+                    chapter = (f'{no_L1} {ppt_page.name}', json.dumps(template.chapter_L1_template, ensure_ascii=False))
+                elif level == 2: 
+                    no_L2 += 1
+                    chapter = (f'{no_L1}.{no_L2} {ppt_page.name}', json.dumps(template.chapter_L2_template, ensure_ascii=False))
+            outline_pages.append((ppt_page_dict, ppt_page, chapter))
+
+            if chapter is None:
+                continue
+            # 章节页没有变化时，不再请求大模型
+            full_text, template_str = chapter
+            data = saved_data.get(ppt_page.id)
+            if data and await ppt_generator.is_page_unchanged(ppt_page.id, data, full_text, source=template_str):
+                llm_data[ppt_page.id] = data
+            else:
+                prompt = (
+                    prompt_temp.replace('{full_text}', full_text)
+                    .replace('{slide_templates}', template_str)
+                )
+                llm_jobs.append((ppt_page, prompt))
+
+        if llm_jobs:
+            await self.send_doing(f'正在生成 {len(llm_jobs)} 个标题页和章节页')
+
+        failed_pages = []
+        new_data = {}
+        k = 0
+        async for ppt_page, response_dict, error in iter_completed(
+            [(ppt_page, self.request_llm(prompt_system, prompt)) for ppt_page, prompt in llm_jobs]
+        ):
+            k += 1
+            if error is not None:
+                print(f'生成页面数据失败 {ppt_page.name}: {error}')
+                failed_pages.append(ppt_page.name)
+                await self.send_doing(f'({k}/{len(llm_jobs)}) 生成失败：{ppt_page.name}')
+            else:
+                new_data[ppt_page.id] = response_dict
+                await self.send_doing(f'({k}/{len(llm_jobs)}) 已完成：{ppt_page.name}')
+
+        await sync_to_async(Page_and_Template.bulk_save_data)(template, new_data)
+        if failed_pages:
+            await self.send(json.dumps({
+                'status': 'error',
+                'message': f'以下页面生成的数据有误：{"、".join(failed_pages)}',
+            }), close=True)
+            return
+        llm_data.update(new_data)
+
+        # 以下只使用已经准备好的数据组装页面
+        await self.send_doing(f'正在处理标题页')
+        await ppt_generator.add_page(title_page.id, llm_data[title_page.id], source=cover_source)
 
-        flatten_outline = project.flatten_outline()
         # 生成目录
-        await self.send(json.dumps({
-                'status': 'doing',
-                'message': f'正在生成目录'
-            }))
+        await self.send_doing(f'正在生成目录')
         toc_page, created = await PPt_Page.objects.aget_or_create(
             project=project,
             p_type='construct',
@@ -1067,64 +1069,22 @@ class GeneratePPT(AsyncWebsocketConsumer):
                 'data': response_dict
             }
         )
-        ppt_generator.add_slide(toc_page_and_temp.data)
+        await ppt_generator.add_page(toc_page.id, toc_page_and_temp.data)
         
         # 生成章节页和内容页
-        no_L1 = 0
-        no_L2 = 0
-        for i in range(len(flatten_outline)):
+        for i, (ppt_page_dict, ppt_page, chapter) in enumerate(outline_pages):
 
-            ppt_page_dict = flatten_outline[i]
-            try:
-                ppt_page = await PPt_Page.objects.aget(id=ppt_page_dict['id'])
-            except:
-                continue
-
-            await self.send(json.dumps({
-                'status': 'doing',
-                'message': f'({i+1}/{len(flatten_outline)}) 正在处理 {ppt_page.name}'
-            }))
-            
+            await self.send_doing(f'({i+1}/{len(outline_pages)}) 正在处理 {ppt_page.name}')
 
             # 章节页面
-            if 'chapter' in ppt_page_dict.keys():
-                level = ppt_page_dict['level']
-                if level == 1: 
-                    no_L1 += 1
-                    template_str = json.dumps(template.chapter_L1_template, ensure_ascii=False)
-                    full_text = f'{no_L1} {ppt_page.name}'
-                elif level == 2: 
-                    no_L2 += 1
-                    template_str = json.dumps(template.chapter_L2_template, ensure_ascii=False)
-                    full_text = f'{no_L1}.{no_L2} {ppt_page.name}'
-
-                prompt = (
-                    prompt_temp.replace('{full_text}', full_text)
-                    .replace('{slide_templates}', template_str)
-                )
-                response_dict = await self.request_llm(prompt_system, prompt)    
-                page_and_temp, created = await Page_and_Template.objects.aupdate_or_create(
-                    ppt_page=ppt_page,
-                    ppt_template=template,
-                    defaults={
-                        'data': response_dict
-                    }
-                )
-                ppt_generator.add_slide(response_dict, full_text)
+            if chapter is not None:
+                full_text, template_str = chapter
+                await ppt_generator.add_page(ppt_page.id, llm_data[ppt_page.id], full_text, source=template_str)
 
             # 叶子节点
             else:
-                try:
-                    ppt_page_and_temp = await Page_and_Template.objects.aget(
-                        ppt_page=ppt_page,
-                        ppt_template=template
-                    )
-                    data = ppt_page_and_temp.data
-                    empty = False
-                except:
-                    empty = True
-                
-                if data == {} or data == None or data == [] or empty == True:
+                data = saved_data.get(ppt_page.id)
+                if data == {} or data == None or data == []:
                     # 没有 slide_data
                     temp = template.blank_template.copy()
                     if 'placeholders' in temp.keys() and len(temp['placeholders']) > 0:
@@ -1137,36 +1097,35 @@ class GeneratePPT(AsyncWebsocketConsumer):
                     slide_note += f'\n{ppt_page.description}'
                 if ppt_page.full_text:
                     slide_note += f'\n\n{ppt_page.full_text}'
-                ppt_generator.add_slide(data, slide_note)
+                await ppt_generator.add_page(ppt_page.id, data, slide_note)
+
+        # 删除不再需要的页面，按大纲顺序排列
+        await ppt_generator.finish_pages()
         
         # 图片替换
         i = 1
         async for _ in ppt_generator.batch_replace_multimedia():
-            await self.send(json.dumps({
-                'status': 'doing',
-                'message': f'正在替换第 {i} 页的图片'
-            }))
+            await self.send_doing(f'正在替换第 {i} 页的图片')
             i += 1
 
-        await self.send(json.dumps({
-            'status': 'doing',
-            'message': '保存文件'
-        }))
+        await self.send_doing('保存文件')
 
-        blob = ppt_generator.save_and_export_blob() # 文件保存到了 temp_file_path
-        with open(temp_file_path, 'rb') as f:
-            temp_file_content = File(f)
-            await sync_to_async(ppt_generate.intermediate_file.save)('', temp_file_content)
+        blob = await ppt_generator.export_to_field(ppt_generate.intermediate_file)
 
         ppt_generate.current_stage = 'multimedia_processing'
         await ppt_generate.asave()
 
-        await self.send(json.dumps({
+        result = {
             'status': 'success',
             'message': '生成完成',
             'file': base64.b64encode(blob).decode('utf-8'),
             'file_name': project.name + '_intermediate.pptx'
-        }), close=True)
+        }
+        if self.profiler is not None:
+            result['profile'] = self.profiler.summary()
+            if settings.GENERATION_PROFILE_DIR:
+                await sync_to_async(self.profiler.dump)(settings.GENERATION_PROFILE_DIR)
+        await self.send(json.dumps(result), close=True)
 
 
 class MultimediaProcessing(AsyncWebsocketConsumer):
@@ -1232,7 +1191,7 @@ class MultimediaProcessing(AsyncWebsocketConsumer):
             f.write(base64.b64decode(base64_str))
         
         # 替换文件
-        ppt_generator = PPt_Generator(intermediate_file, project.ppt_template)
+        ppt_generator = await generation_executor.create_generator(intermediate_file, project.ppt_template)
         i = 1
         async for _ in ppt_generator.batch_replace_multimedia():
             await self.send(json.dumps({
@@ -1248,7 +1207,7 @@ class MultimediaProcessing(AsyncWebsocketConsumer):
 
 
         try:
-            blob = ppt_generator.save_and_export_blob()
+            blob = await ppt_generator.save_and_export_blob()
             await self.send(json.dumps({
                 'status': 'success',
                 'message': '生成完成',
@@ -1308,19 +1267,14 @@ class GenerateFinalPPT(AsyncWebsocketConsumer):
             return
 
         intermediate_file = ppt_generate.intermediate_file.path
-        ppt_generator = PPt_Generator(intermediate_file, project.ppt_template)
+        ppt_generator = await generation_executor.create_generator(intermediate_file, project.ppt_template)
 
         await self.send(json.dumps({
             'status': 'doing',
             'message': '正在清理中间数据'
         }))
-        ppt_generator.batch_clear_slide()
-        temp_file_path = await ppt_generate.get_temp_file_path()
-        blob = ppt_generator.save_and_export_blob(temp_file_path)
-
-        with open(temp_file_path, 'rb') as f:
-            temp_file_content = File(f)
-            await sync_to_async(ppt_generate.final_file.save)('', temp_file_content)
+        await ppt_generator.batch_clear_slide()
+        blob = await ppt_generator.export_to_field(ppt_generate.final_file)
         
         ppt_generate.current_stage = 'final_file'
         await ppt_generate.asave()
@@ -381,3 +381,311 @@ class ProjectPPTSyncTests(TestCase):
         self.assertEqual(len(self.project.outline[0]['sub_tasks']), 1)
         self.assertEqual(len(self.project.outline[0]['sub_tasks'][0]['sub_tasks']), 1)
         self.assertEqual(PPt_Page.objects.count(), 3)
+
+
+class _Chat_Completions:
+    '''
+    模拟 AsyncOpenAI().chat.completions，记录同时进行的请求数，前 rate_limited 次请求返回 429
+    '''
+
+    def __init__(self, rate_limited=0):
+        self.rate_limited = rate_limited
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def create(self, model, messages):
+        import asyncio
+        import httpx
+        from openai import RateLimitError
+
+        self.calls += 1
+        if self.calls <= self.rate_limited:
+            response = httpx.Response(429, headers={'retry-after': '0'}, request=httpx.Request('POST', 'http://llm'))
+            raise RateLimitError('rate limited', response=response, body=None)
+
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+
+        message = type('Message', (), {'content': f' {messages[0]["content"]} '})
+        return type('Response', (), {'choices': [type('Choice', (), {'message': message})], 'usage': None})
+
+
+def test_llm_gateway_limits_concurrency_and_retries(monkeypatch):
+    import asyncio
+    from .tools import llm_gateway as gateway_module
+
+    completions = _Chat_Completions(rate_limited=2)
+    clients = []
+
+    def fake_client(**kwargs):
+        clients.append(kwargs)
+        return type('Client', (), {'chat': type('Chat', (), {'completions': completions})})
+
+    monkeypatch.setattr(gateway_module, 'AsyncOpenAI', fake_client)
+    gateway = gateway_module.LLM_Gateway(base_url='http://llm', api_key='key', model='m', concurrency=3, max_retries=2)
+
+    async def run():
+        return await asyncio.gather(*[
+            gateway.chat([{'role': 'user', 'content': f'page {i}'}]) for i in range(10)
+        ])
+
+    assert asyncio.run(run()) == [f'page {i}' for i in range(10)]
+    # 所有请求共用一个客户端，并发不超过限制，被限流的请求重试成功
+    assert len(clients) == 1 and clients[0]['max_retries'] == 0
+    assert completions.max_running <= 3
+    assert completions.calls == 12
+
+    # 超过最大重试次数时抛出限流异常
+    completions.calls, completions.rate_limited = 0, 3
+    with pytest.raises(gateway_module.RateLimitError):
+        asyncio.run(gateway.chat([{'role': 'user', 'content': 'page'}]))
+
+
+class _Slide_Data_Gateway:
+    '''
+    模拟 llm_gateway：页面越靠前返回越慢，名称为“失败”的页面返回不合法的 json
+    '''
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    async def chat_json(self, messages, priority=None):
+        import asyncio
+        import re
+
+        full_text = re.search(r'(全文|失败) \d', messages[1]['content']).group()
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05 / (int(full_text[-1]) + 1))
+        self.running -= 1
+        if full_text.startswith('失败'):
+            raise ValueError('invalid json')
+        return {'template_id': 1, 'full_text': full_text}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_generate_slide_data_runs_pages_concurrently(monkeypatch):
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    import asyncio
+    from channels.testing import WebsocketCommunicator
+    from ppt_page.models import Page_and_Template
+    from ppt_template.models import PPt_Template
+    from . import consumers
+
+    gateway = _Slide_Data_Gateway()
+    monkeypatch.setattr(consumers, 'llm_gateway', gateway)
+
+    user = User.objects.create_user(username='testuser', password='12345')
+    template = PPt_Template.objects.create(name='t', user=user, file_hash='-', slide_templates=[{'id': 1}])
+    project = Project.objects.create(name='Test Project', user=user, ppt_template=template)
+    pages = [
+        PPt_Page.objects.create(project=project, name=f'页面{i}', full_text=f'{"失败" if i == 1 else "全文"} {i}')
+        for i in range(4)
+    ]
+    project.outline = [{'id': page.id, 'name': page.name, 'desc': '', 'sub_tasks': []} for page in pages]
+    project.save()
+    # 已有的数据被更新
+    Page_and_Template.objects.create(ppt_page=pages[0], ppt_template=template, data={'old': True})
+
+    async def run():
+        communicator = WebsocketCommunicator(consumers.GenerateSlideData.as_asgi(), '/generate_slide_data/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.send_to(text_data=json.dumps({'project_id': project.id}))
+        messages = []
+        while True:
+            message = json.loads(await communicator.receive_from(timeout=5))
+            messages.append(message)
+            if message['status'] != 'doing':
+                break
+        await communicator.disconnect()
+        return messages
+
+    messages = asyncio.run(run())
+
+    # 按完成的顺序发送进度，后面的页面先完成
+    assert [m['message'] for m in messages[1:-1]] == [
+        '(1/4) 已完成：页面3', '(2/4) 已完成：页面2', '(3/4) 生成失败：页面1', '(4/4) 已完成：页面0'
+    ]
+    assert messages[-1]['status'] == 'error' and '页面1' in messages[-1]['message']
+    assert gateway.max_running == 4
+
+    data = {pt.ppt_page_id: pt.data for pt in Page_and_Template.objects.filter(ppt_template=template)}
+    assert data[pages[0].id] == {'template_id': 1, 'full_text': '全文 0'}
+    assert data[pages[1].id] == {}
+    assert data[pages[3].id]['full_text'] == '全文 3'
+
+
+def test_token_bucket_waits_for_refill():
+    from .tools.llm_gateway import Token_Bucket
+
+    now = [0.0]
+    bucket = Token_Bucket(60, clock=lambda: now[0])
+    assert bucket.get_delay(60) == 0
+    bucket.consume(60)
+    # 每秒恢复 1 个
+    assert bucket.get_delay(1) == pytest.approx(1)
+    now[0] = 30
+    assert bucket.get_delay(30) == 0
+    # 超过容量的请求按容量等待，实际用量超出时余额为负
+    bucket.consume(90)
+    assert bucket.get_delay(1000) == pytest.approx(120)
+    assert Token_Bucket(0).get_delay(10 ** 9) == 0
+
+
+def _start_stub_llm_server():
+    '''
+    本地的 OpenAI 兼容服务，记录每个请求的连接端口和内容
+    内容为“限流”的第一个请求返回 429，内容为“服务端错误”的第一个请求返回 500
+    '''
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        ports = []
+        contents = []
+        # 内容 -> 第一次请求返回的错误状态码
+        failures = {'限流': 429, '服务端错误': 500}
+        failed = set()
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            content = body['messages'][-1]['content']
+            Handler.ports.append(self.client_address[1])
+            Handler.contents.append(content)
+
+            if content in Handler.failures and content not in Handler.failed:
+                Handler.failed.add(content)
+                self._reply(Handler.failures[content], {'error': {'message': content}}, {'retry-after': '0'})
+                return
+
+            time.sleep(0.05)
+            self._reply(200, {
+                'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': f' {content} '}}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+            })
+
+        def _reply(self, status, data, headers={}):
+            payload = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, Handler
+
+
+def test_llm_gateway_against_stub_server():
+    import asyncio
+    from .tools.llm_gateway import LLM_Gateway, PRIORITY_BULK
+
+    server, handler = _start_stub_llm_server()
+    try:
+        gateway = LLM_Gateway(
+            base_url=f'http://127.0.0.1:{server.server_port}/v1', api_key='key', model='stub',
+            concurrency=1, max_retries=1, requests_per_minute=0, tokens_per_minute=0,
+        )
+
+        async def run():
+            bulk = [
+                asyncio.create_task(gateway.chat([{'role': 'user', 'content': f'批量{i}'}], priority=PRIORITY_BULK))
+                for i in range(3)
+            ]
+            await asyncio.sleep(0.01)
+            # 交互请求排在还没有开始的批量请求前面
+            interactive = await gateway.chat([{'role': 'user', 'content': '限流'}])
+            return interactive, await asyncio.gather(*bulk)
+
+        interactive, bulk = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert interactive == '限流' and bulk == ['批量0', '批量1', '批量2']
+    # 限流后等待重试时不占用并发数
+    assert handler.contents == ['批量0', '限流', '批量1', '限流', '批量2']
+    # 所有请求复用同一个 keep-alive 连接
+    assert len(set(handler.ports)) == 1
+
+    metrics = gateway.metrics()
+    assert metrics['interactive']['requests'] == 1 and metrics['interactive']['retries'] == 1
+    assert metrics['bulk']['succeeded'] == 3 and metrics['bulk']['prompt_tokens'] == 30
+    assert metrics['running'] == 0 and metrics['waiting'] == 0
+
+
+def test_llm_gateway_retries_server_errors():
+    import asyncio
+    from .tools.llm_gateway import LLM_Gateway
+
+    server, handler = _start_stub_llm_server()
+    try:
+        gateway = LLM_Gateway(
+            base_url=f'http://127.0.0.1:{server.server_port}/v1', api_key='key', model='stub',
+            concurrency=1, max_retries=1, requests_per_minute=0, tokens_per_minute=0,
+        )
+        response = asyncio.run(gateway.chat([{'role': 'user', 'content': '服务端错误'}]))
+    finally:
+        server.shutdown()
+
+    # 第一次返回 500，重试后成功
+    assert response == '服务端错误'
+    assert handler.contents == ['服务端错误', '服务端错误']
+    metrics = gateway.metrics()['interactive']
+    assert metrics['retries'] == 1 and metrics['succeeded'] == 1 and metrics['failed'] == 0
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('parse_status, message', [('pending', '模板解析中'), ('failed', '模板解析失败')])
+def test_generation_rejects_unparsed_template(monkeypatch, parse_status, message):
+    pytest.importorskip('cairosvg', exc_type=OSError)
+    import asyncio
+    from channels.testing import WebsocketCommunicator
+    from ppt_template.models import PPt_Template
+    from . import consumers
+
+    gateway = _Slide_Data_Gateway()
+    monkeypatch.setattr(consumers, 'llm_gateway', gateway)
+
+    async def create_generator(*args, **kwargs):
+        raise AssertionError('模板未解析时不应该开始生成')
+    monkeypatch.setattr(consumers.generation_executor, 'create_generator', create_generator)
+
+    user = User.objects.create_user(username='testuser', password='12345')
+    template = PPt_Template.objects.create(name='t', user=user, file_hash='-', parse_status=parse_status)
+    project = Project.objects.create(name='Test Project', user=user, ppt_template=template)
+    page = PPt_Page.objects.create(project=project, name='页面0', full_text='全文 0')
+    project.outline = [{'id': page.id, 'name': page.name, 'desc': '', 'p_type': 'content', 'sub_tasks': []}]
+    project.save()
+
+    async def run(consumer, data):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), '/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.send_to(text_data=json.dumps(data))
+        response = json.loads(await communicator.receive_from(timeout=5))
+        await communicator.disconnect()
+        return response
+
+    for consumer, data in [
+        (consumers.GenerateSlideData, {'project_id': project.id}),
+        (consumers.GeneratePPT, {'project_id': project.id}),
+        (consumers.CreateProject, {'theme': 'x', 'template': {'id': template.id}}),
+    ]:
+        response = asyncio.run(run(consumer, data))
+        assert response['status'] == 'error' and message in response['message']
+    assert gateway.running == gateway.max_running == 0
+    assert Project.objects.count() == 1
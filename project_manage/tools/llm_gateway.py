@@ -0,0 +1,305 @@
+'''
+大模型请求的统一入口
+    进程内共用一个 AsyncOpenAI 客户端，请求复用其 httpx 连接池中的 keep-alive 连接，不再每次请求都创建新的客户端
+    同时进行的请求数量不超过 settings.LLM_CONCURRENCY，多个页面可以直接并发调用 chat
+    每分钟的请求数和 token 数按令牌桶限制（settings.LLM_REQUESTS_PER_MINUTE、LLM_TOKENS_PER_MINUTE）
+    等待的请求按优先级排队：单个页面的交互请求（PRIORITY_INTERACTIVE）排在整份 ppt 的批量请求（PRIORITY_BULK）前面
+    返回限流（429）、服务端错误（5xx）以及连接失败、超时时按指数退避重试，服务端返回 Retry-After 时按其等待
+    客户端本身不重试（max_retries=0），所有重试都在 gateway 中进行，重试等待时不占用并发数
+    metrics() 返回各优先级的请求数、token 用量、排队和请求耗时
+    httpx 的连接绑定在创建它的事件循环上，所以客户端和排队状态按事件循环分别创建
+    iter_completed 用于一次提交多个页面的请求，按完成的顺序返回结果
+'''
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# 第一次重试的等待时间（秒），之后每次翻倍，最长 MAX_RETRY_DELAY
+RETRY_BASE_DELAY = 1
+MAX_RETRY_DELAY = 30
+
+# 优先级，数字越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+# 可以重试的错误：限流、服务端错误、连接失败和超时（APITimeoutError 是 APIConnectionError 的子类）
+RETRY_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+# 请求前按字符数估算 token 数（中文约 1 字 1 token，英文约 4 个字符 1 token），完成后按返回的 usage 修正
+CHARS_PER_TOKEN = 2
+
+
+class Token_Bucket:
+    '''
+    每分钟 rate 个令牌的令牌桶，容量为 rate，rate 为 0 时不限制
+    余额可以为负：请求完成后按实际用量补扣，之后的请求需要等余额恢复
+    args:
+        clock: 返回秒数的时钟，测试时可以替换
+    '''
+
+    def __init__(self, rate, clock=time.monotonic):
+        self.rate = rate
+        self.clock = clock
+        self._tokens = rate
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / 60)
+        self._updated = now
+
+    def get_delay(self, amount):
+        '''
+        获取 amount 个令牌需要等待的秒数，0 表示可以立即获取，amount 超过容量时按容量计算
+        '''
+        if not self.rate:
+            return 0
+        amount = min(amount, self.rate)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                return 0
+            return (amount - self._tokens) * 60 / self.rate
+
+    def consume(self, amount):
+        '''
+        扣除 amount 个令牌，amount 为负数时退回
+        '''
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.rate, self._tokens - amount)
+
+
+class _Loop_State:
+    '''
+    一个事件循环中的客户端和排队状态
+    '''
+
+    def __init__(self, client):
+        self.client = client
+        self.condition = asyncio.Condition()
+        self.waiting = []  # (priority, 序号) 的堆，堆顶的请求最先执行
+        self.running = 0
+
+
+def estimate_tokens(messages):
+    return sum(len(message['content']) for message in messages) // CHARS_PER_TOKEN + 1
+
+
+class LLM_Gateway:
+    '''
+    args:
+        base_url, api_key, model: 为 None 时使用 settings 中的大模型配置
+        concurrency: 同时进行的最大请求数，为 None 时使用 settings.LLM_CONCURRENCY
+        max_retries: 限流、服务端错误、连接失败时的最大重试次数，为 None 时使用 settings.LLM_MAX_RETRIES
+        requests_per_minute, tokens_per_minute: 为 None 时使用 settings 中的配置，0 表示不限制
+    '''
+
+    def __init__(self, base_url=None, api_key=None, model=None, concurrency=None, max_retries=None,
+                 requests_per_minute=None, tokens_per_minute=None):
+        self.base_url = base_url or settings.LLM_BASE_URL
+        self.api_key = api_key or settings.LLM_API_KEY
+        self.model = model or settings.LLM_MODEL
+        self.concurrency = concurrency or settings.LLM_CONCURRENCY
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.request_bucket = Token_Bucket(
+            settings.LLM_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        )
+        self.token_bucket = Token_Bucket(
+            settings.LLM_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        )
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        # 事件循环 -> _Loop_State
+        self._loops = weakref.WeakKeyDictionary()
+        self._metrics = {name: self._empty_metrics() for name in PRIORITY_NAMES.values()}
+
+    @staticmethod
+    def _empty_metrics():
+        return {
+            'requests': 0, 'succeeded': 0, 'failed': 0, 'retries': 0,
+            'prompt_tokens': 0, 'completion_tokens': 0,
+            'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'request_seconds': 0.0,
+        }
+
+    def _get_loop_state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loops.get(loop)
+            if state is None:
+                # 重试由 gateway 控制，客户端本身不重试
+                state = _Loop_State(AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0))
+                self._loops[loop] = state
+            return state
+
+    @property
+    def client(self):
+        '''
+        当前事件循环的共享客户端
+        '''
+        return self._get_loop_state().client
+
+    def _record(self, priority, **values):
+        with self._lock:
+            metrics = self._metrics[PRIORITY_NAMES[priority]]
+            for key, value in values.items():
+                if key == 'max_wait_seconds':
+                    metrics[key] = max(metrics[key], value)
+                else:
+                    metrics[key] += value
+
+    def metrics(self):
+        '''
+        各优先级的统计，以及当前正在执行和排队的请求数
+        '''
+        with self._lock:
+            result = {name: dict(metrics) for name, metrics in self._metrics.items()}
+            result['running'] = sum(state.running for state in self._loops.values())
+            result['waiting'] = sum(len(state.waiting) for state in self._loops.values())
+        return result
+
+    async def _acquire(self, state, priority, tokens):
+        '''
+        排队直到轮到这个请求：排在最前面、有空闲的并发数、令牌桶中有足够的余额
+        '''
+        entry = (priority, next(self._seq))
+        async with state.condition:
+            heapq.heappush(state.waiting, entry)
+            try:
+                while True:
+                    delay = None
+                    if state.waiting[0] == entry and state.running < self.concurrency:
+                        delay = max(self.request_bucket.get_delay(1), self.token_bucket.get_delay(tokens))
+                        if delay == 0:
+                            break
+                    # 等待其他请求完成，或者等令牌桶恢复
+                    try:
+                        await asyncio.wait_for(state.condition.wait(), delay)
+                    except TimeoutError:
+                        pass
+            except BaseException:
+                state.waiting.remove(entry)
+                heapq.heapify(state.waiting)
+                state.condition.notify_all()
+                raise
+
+            heapq.heappop(state.waiting)
+            state.running += 1
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+            # 下一个请求可能也可以开始
+            state.condition.notify_all()
+
+    async def _release(self, state):
+        async with state.condition:
+            state.running -= 1
+            state.condition.notify_all()
+
+    def _get_retry_delay(self, error, attempt):
+        # 连接失败和超时没有 response
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        except (TypeError, ValueError):
+            # 加上随机抖动，避免并发的请求同时重试
+            return min(RETRY_BASE_DELAY * 2 ** attempt, MAX_RETRY_DELAY) * random.uniform(0.5, 1)
+
+    async def chat(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        '''
+        调用 chat.completions.create，返回去掉首尾空白的回复内容
+        args:
+            priority: PRIORITY_INTERACTIVE 或 PRIORITY_BULK
+            kwargs: 传给 chat.completions.create，可以通过 model 指定其他模型
+        超过最大重试次数后抛出最后一次的错误（RateLimitError、InternalServerError、APIConnectionError 等）
+        '''
+        state = self._get_loop_state()
+        kwargs.setdefault('model', self.model)
+        tokens = estimate_tokens(messages)
+        self._record(priority, requests=1)
+
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            await self._acquire(state, priority, tokens)
+            started_at = time.perf_counter()
+            self._record(priority, wait_seconds=started_at - queued_at, max_wait_seconds=started_at - queued_at)
+            try:
+                response = await state.client.chat.completions.create(messages=messages, **kwargs)
+            except RETRY_ERRORS as error:
+                if attempt >= self.max_retries:
+                    self._record(priority, failed=1)
+                    raise
+                delay = self._get_retry_delay(error, attempt)
+                attempt += 1
+                self._record(priority, retries=1)
+                logger.warning(f'大模型请求失败（{type(error).__name__}），{delay:.1f} 秒后第 {attempt} 次重试')
+            except BaseException:
+                self._record(priority, failed=1)
+                raise
+            else:
+                usage = response.usage
+                if usage is not None:
+                    # 按实际用量修正请求前估算的 token 数
+                    self.token_bucket.consume(usage.total_tokens - tokens)
+                    self._record(priority, prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                self._record(priority, succeeded=1)
+                return response.choices[0].message.content.strip()
+            finally:
+                self._record(priority, request_seconds=time.perf_counter() - started_at)
+                await self._release(state)
+
+            # 等待时不占用并发数，让其他请求继续
+            await asyncio.sleep(delay)
+
+    async def chat_json(self, messages, **kwargs):
+        '''
+        调用 chat 并把回复解析为 json，回复可以放在 ```json 代码块中
+        回复不是合法的 json 时抛出 ValueError
+        '''
+        response = await self.chat(messages, **kwargs)
+        if response.startswith('```json'):
+            response = response[7:-3]
+        return json.loads(response)
+
+
+async def iter_completed(jobs):
+    '''
+    同时执行 jobs 中的协程，按完成的顺序 yield (key, 结果, 异常)
+    args:
+        jobs: (key, 协程) 的列表，一个协程抛出异常不影响其他协程，异常通过第三项返回
+    提前退出（例如连接断开）时取消还没有完成的协程
+    '''
+    async def run(key, coro):
+        try:
+            return key, await coro, None
+        except Exception as error:
+            return key, None, error
+
+    tasks = [asyncio.create_task(run(key, coro)) for key, coro in jobs]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# 进程内共享的 gateway
+llm_gateway = LLM_Gateway()